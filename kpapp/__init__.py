@@ -1,7 +1,47 @@
-from .application import Application, Daemonizer
-from .service import Service
-from .thrcnt import ThresholdCounter
-from .task import Task
-from .db import Database
-from .common import conf, logger
-from .utils import check_type, log_format_info
+import importlib
+import sys
+import types
+
+"""
+The package exports are imported lazily on first attribute access, so tools
+that only need a small part of kpapp don't pay for importing peewee, yaml and
+the task and database stack.
+"""
+
+_EXPORTS = {
+	'Application': 'application',
+	'Daemonizer': 'application',
+	'Service': 'service',
+	'ThresholdCounter': 'thrcnt',
+	'Task': 'task',
+	'AsyncTask': 'task',
+	'TaskGroup': 'task',
+	'Database': 'db',
+	'conf': 'common',
+	'logger': 'common',
+	'check_type': 'utils',
+	'log_format_info': 'utils',
+}
+
+__all__ = sorted(_EXPORTS.keys())
+
+class _LazyModule(types.ModuleType):
+	"""
+	Package module importing the submodule of an export when the export is
+	first accessed.
+	"""
+	def __getattr__(self, name):
+		if not _EXPORTS.has_key(name):
+			raise AttributeError('module \'' + self.__name__ + '\' has no attribute \'' + name + '\'')
+		value = getattr(importlib.import_module('.' + _EXPORTS[name], self.__name__), name)
+		setattr(self, name, value)
+		return value
+
+	def __dir__(self):
+		return sorted(set(self.__dict__.keys()) | set(_EXPORTS.keys()))
+
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+# Keeps the replaced module and with it the globals above alive
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
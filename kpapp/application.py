@@ -2,12 +2,21 @@ import time
 import os
 import sys
 import atexit
+import errno
+import fcntl
+import select
+import signal
+import threading
 from signal import SIGTERM
 
-from .common import conf, logger
+from . import loghandler
+from .common import conf, logger, bizz
 from .task import TaskManager
 from .tasks.dummy import Dummy
 from .db import DatabaseManager
+from .events import EventLog
+from .misc import diff
+from .service import Service
 
 """
 The application.py module containes all classes needed for the major execution
@@ -32,6 +41,10 @@ class Application:
 		self.__config = config
 		# A dictionary of service objects
 		self.__services = {}
+		# Signal number or True when shutdown is requested
+		self.__stopping = None
+		self.__reload = False
+		self.__wakeup = None
 
 	def _initialize(self):
 		"""
@@ -44,30 +57,202 @@ class Application:
 	def _finalize(self):
 		"""
 		Things to be done after main process loop execution. This method can be
-		overriden. Don't forget to stop the TaskManager.
+		overriden. Don't forget to stop the TaskManager. Waits for the
+		asynchronous log handlers to write the queued records.
 		"""
 		self.task_manager().stop()
+		if self.__services.has_key(EventLog.NAME):
+			self.event_log().close()
+		loghandler.flush()
 
 	def run(self, mode = 'default'):
 		"""
-		The main loop and thread of the application. Supports Ctrl^C key
-		interruption, should not be overriden. Also handles major unexpected
-		exceptions and logs them as CRITICAL.
+		The main loop and thread of the application. Blocks until SIGTERM,
+		SIGINT (Ctrl^C) or shutdown() and then finalizes, should not be
+		overriden. Also handles major unexpected exceptions and logs them as
+		CRITICAL.
+
+		SIGHUP reloads the config, see reload(). When the "Application"
+		section sets "watch_config" the config file is checked for changes
+		every so many seconds and reloaded when modified.
+
+		When the "Log" section sets "async", the app and biz loggers write
+		through AsyncFileHandlers while running, the other values of the
+		section are passed to AsyncFileHandler.
 		"""
+		logs = self.__async_logging()
+		try:
+			self.__run()
+		finally:
+			for log, pairs in logs:
+				loghandler.uninstall(log, pairs)
+
+	def __run(self):
 		logger.info('========== Begin execution of program ==========')
 		try:
-			self._initialize()
+			self.__wakeup = os.pipe()
+			for fd in self.__wakeup:
+				flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+				fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 			try:
-				while True:
-					time.sleep(1)
-			except KeyboardInterrupt:
-				pass
-			self._finalize()
+				handlers = self.__install()
+				try:
+					self.__open_databases()
+					self._initialize()
+					self.__wait()
+					self._finalize()
+				finally:
+					self.__uninstall(handlers)
+			finally:
+				os.close(self.__wakeup[0])
+				os.close(self.__wakeup[1])
+				self.__wakeup = None
 		except Exception as e:
 			logger.critical('Application.run(), Unhandled exception: (%s)', str(e), exc_info=True)
 			sys.exit('########## Program crash due to internal error ##########')
 		logger.info('========== Finish execution of program ==========')
 
+	def __async_logging(self):
+		"""
+		Installs the AsyncFileHandlers if configured, returns the loggers and
+		their replaced handlers.
+		"""
+		config = dict(self.__config.get('Log', {}))
+		if not config.pop('async', False):
+			return []
+		return [(log, loghandler.install(log, config)) for log in (logger, bizz)]
+
+	def __open_databases(self):
+		"""
+		Opens the configured databases before _initialize() when the
+		"Application" section sets "open_databases" to "serial" or
+		"parallel", so the first request doesn't pay for opening them.
+		"""
+		mode = self.__config.get('Application', {}).get('open_databases')
+		if not mode:
+			return
+		if mode not in ('serial', 'parallel'):
+			raise ValueError('open_databases must be "serial" or "parallel"')
+		timings = self.database_manager().open(parallel=(mode == 'parallel'))
+		logger.info('Opened %d databases', len(timings))
+
+	def reload(self, config = None):
+		"""
+		Replaces the config and calls reconfigure() of the instantiated
+		services whose section changed, so they retune in place. Returns the
+		set of changed section names.
+		config		The new config dictionary, None reloads the file loaded by
+					conf
+		"""
+		if config is None:
+			try:
+				config = conf.reload()
+			except Exception:
+				logger.error('Config reload failed, keeping the current config', exc_info=True)
+				return set()
+		if not isinstance(config, dict):
+			raise TypeError('config not dict')
+		changed = diff(self.__config, config)
+		self.__config = config
+		for name in sorted(changed):
+			service = self.__services.get(name)
+			if not isinstance(service, Service):
+				continue
+			try:
+				service.reconfigure(config.get(name, {}))
+			except Exception:
+				logger.error('Reconfiguring service %s failed', name, exc_info=True)
+		logger.info('Config reloaded, changed sections: %s', ', '.join(sorted(changed)) or 'none')
+		return changed
+
+	def shutdown(self):
+		"""
+		Requests the main loop to finalize and exit, can be called from any
+		thread.
+		"""
+		self.__stopping = True
+		self.__wake()
+
+	def __install(self):
+		"""
+		Installs the signal handlers and points the signal wakeup fd at the
+		wakeup pipe, returns the previous handlers. Signals can only be handled
+		in the main thread, elsewhere only shutdown() ends the main loop.
+		"""
+		if not isinstance(threading.current_thread(), threading._MainThread):
+			return None
+		handlers = {}
+		for signum in (signal.SIGTERM, signal.SIGINT):
+			handlers[signum] = signal.signal(signum, self.__signal)
+		handlers[signal.SIGHUP] = signal.signal(signal.SIGHUP, self.__hangup)
+		handlers['fd'] = signal.set_wakeup_fd(self.__wakeup[1])
+		return handlers
+
+	def __uninstall(self, handlers):
+		"""
+		Restores the signal handlers returned by __install().
+		"""
+		if handlers is None:
+			return
+		signal.set_wakeup_fd(handlers.pop('fd'))
+		for signum, handler in handlers.items():
+			signal.signal(signum, handler)
+
+	def __signal(self, signum, frame):
+		"""
+		Signal handler, flags the main loop to stop. The wakeup fd written by
+		the interpreter makes the main loop notice at once.
+		"""
+		self.__stopping = signum
+
+	def __hangup(self, signum, frame):
+		"""
+		SIGHUP handler, flags the main loop to reload the config.
+		"""
+		self.__reload = True
+
+	def __wake(self):
+		"""
+		Writes to the wakeup pipe.
+		"""
+		try:
+			os.write(self.__wakeup[1], '\0')
+		except (OSError, TypeError):
+			pass
+
+	def __wait(self):
+		"""
+		Blocks on the wakeup pipe until a signal or shutdown() stops the main
+		loop, reloads the config on SIGHUP or when the watched file changed.
+		"""
+		while self.__stopping is None:
+			# Read every round, a reload may change it, unset blocks
+			watch = self.__config.get('Application', {}).get('watch_config') or None
+			try:
+				select.select([self.__wakeup[0]], [], [], watch)
+			except select.error as e:
+				if e.args[0] != errno.EINTR:
+					raise
+			try:
+				while os.read(self.__wakeup[0], 512):
+					pass
+			except OSError as e:
+				if e.errno != errno.EAGAIN:
+					raise
+			if self.__stopping is not None:
+				break
+			if self.__reload:
+				self.__reload = False
+				logger.info('Received SIGHUP, reloading config')
+				self.reload()
+			elif watch and conf.changed():
+				logger.info('Config file changed, reloading config')
+				self.reload()
+		if self.__stopping is True:
+			logger.info('Shutdown requested')
+		else:
+			logger.info('Received signal %d, shutting down', self.__stopping)
+
 	def _service(self, name, service):
 		"""
 		Helper method to instantiate a Service IoC style
@@ -98,24 +283,37 @@ class Application:
 		task manager.
 		"""
 		def service(self):
-			return TaskManager()
+			return TaskManager(self.__config.get(TaskManager.NAME, {}))
 		return self._service(TaskManager.NAME, service)
 
 	def database_manager(self):
 		"""
-		IoC implementation of the TaskManager, returns the one instance of
-		task manager.
+		IoC implementation of the DatabaseManager, returns the one instance of
+		database manager. Its writers run on the task manager.
 		"""
 		def service(self):
-			return DatabaseManager(self._config(DatabaseManager.NAME))
+			return DatabaseManager(self._config(DatabaseManager.NAME), self.task_manager())
 		return self._service(DatabaseManager.NAME, service)
 
+	def event_log(self):
+		"""
+		IoC implementation of the EventLog, returns the one instance of event
+		log. Configured by the optional "EventLog" section, with "path"
+		relative to the application directory, default "/data/events", and
+		"segment_bytes" and "index_interval".
+		"""
+		def service(self):
+			cc = dict(self.__config.get(EventLog.NAME, {}))
+			return EventLog(conf.app_dir() + cc.pop('path', '/data/events'), **cc)
+		return self._service(EventLog.NAME, service)
+
 class Daemonizer:
 	"""
 	An Application daemonizer
 
 	Usage: daemonize a subclassed Application class
 	"""
+	STOP_TIMEOUT = 30
 	def __init__(self, app, pidfile, stdin='/dev/null', stdout='/dev/null', stderr='/dev/null'):
 		self.__app = app
 		self.__stdin = stdin
@@ -210,14 +408,20 @@ class Daemonizer:
 			sys.stderr.write(message % self.__pidfile)
 			return # not an error in a restart
 
-		# Try killing the daemon process
+		# Ask the daemon process to finalize and wait for it to exit
 		try:
+			os.kill(pid, SIGTERM)
+			deadline = time.time() + Daemonizer.STOP_TIMEOUT
+			delay = 0.01
 			while 1:
-				os.kill(pid, SIGTERM)
-				time.sleep(0.1)
+				os.kill(pid, 0)
+				if time.time() > deadline:
+					sys.stderr.write("Daemon pid %d didn't exit within %d seconds\n" % (pid, Daemonizer.STOP_TIMEOUT))
+					sys.exit(1)
+				time.sleep(delay)
+				delay = min(delay * 2, 0.5)
 		except OSError, err:
-			err = str(err)
-			if err.find("No such process") > 0:
+			if err.errno == errno.ESRCH:
 				if os.path.exists(self.__pidfile):
 					os.remove(self.__pidfile)
 			else:
@@ -0,0 +1,232 @@
+import csv
+import itertools
+import json
+import os
+import time
+
+from .common import logger
+
+"""
+The bulk.py module containes the Bulk class that streams CSV and JSONL files
+into and out of a Database at disk speed.
+"""
+
+class Bulk:
+	"""
+	Bulk loads CSV or JSONL files into a table with batched executemany()
+	inside large transactions, and dumps queries to CSV or JSONL files while
+	streaming the rows. The format follows the file extension, ".csv" or
+	".jsonl", unless given. CSV files start with a header row of column
+	names, JSONL files contain one JSON object per line.
+	"""
+	FORMATS = ('csv', 'jsonl')
+	RELAX = (('synchronous', 'OFF'), ('temp_store', 'MEMORY'), ('cache_size', -65536))
+	def __init__(self, db):
+		"""
+		db	The Database to load into or dump from
+		"""
+		self.__db = db
+
+	def load(self, table, path, format = None, columns = None, batch = 10000, relax = False, checkpoint = None, progress = None, null = ''):
+		"""
+		Loads the rows of a file into a table and returns the number of
+		loaded rows. Every batch is committed in its own transaction under
+		the write lock, which is released between the batches so readers
+		aren't blocked for the whole load. With a checkpoint file a failed
+		load resumes after the last committed batch when run again, and the
+		checkpoint is removed when done.
+		table		A table name or a peewee Model
+		path		Path to the CSV or JSONL file
+		format		"csv" or "jsonl", defaults to the file extension
+		columns		Column names, defaults to the CSV header or the keys of
+					the first JSON object
+		batch		Rows per transaction, and per hold of the write lock
+		relax		Relax durability PRAGMAs, see RELAX, during every batch
+		checkpoint	Path to the checkpoint file, None disables resuming
+		progress	Callable called with the number of loaded rows after
+					every batch
+		null		CSV value loaded as NULL
+		"""
+		table = self.__table(table)
+		format = self.__format(path, format)
+		done = 0
+		if checkpoint is not None and os.path.exists(checkpoint):
+			with open(checkpoint) as f:
+				done = int(f.read().strip() or 0)
+			logger.info('Resuming load of %s into %s after %d rows', path, table, done)
+		start = time.time()
+		count = done
+		with open(path, 'rb') as f:
+			columns, rows = self.__reader(f, format, columns, null)
+			sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (
+				table, ', '.join('"%s"' % c for c in columns), ', '.join(['?'] * len(columns)))
+			rows = itertools.islice(rows, done, None)
+			chunk = []
+			for row in rows:
+				chunk.append(row)
+				if len(chunk) >= batch:
+					count += self.__insert(sql, chunk, relax, checkpoint, count, progress)
+					chunk = []
+			if chunk:
+				count += self.__insert(sql, chunk, relax, checkpoint, count, progress)
+		if checkpoint is not None and os.path.exists(checkpoint):
+			os.remove(checkpoint)
+		logger.info('Loaded %d rows of %s into %s in %.1fs', count - done, path, table, time.time() - start)
+		return count - done
+
+	def dump(self, query, path, format = None, params = (), chunk = 10000, progress = None, key = None):
+		"""
+		Dumps the rows of a query to a file and returns the number of rows.
+		The rows are fetched "chunk" at a time, each chunk under its own read
+		lock so writers get in between chunks, and the file is written to a
+		temporary file that replaces "path" when done. With a "key" the rows
+		are paged by key, see Database.paginate(), without one by LIMIT and
+		OFFSET, which rescans the skipped rows for every chunk.
+		query		A SQL string, a peewee query, or a peewee Model to dump
+					the whole table
+		path		Path to the CSV or JSONL file
+		format		"csv" or "jsonl", defaults to the file extension
+		params		Parameters of a SQL string
+		progress	Callable called with the number of dumped rows after
+					every chunk
+		key			Name of a unique column of the query, defaults to the
+					primary key of a Model
+		"""
+		format = self.__format(path, format)
+		if isinstance(query, type):
+			pk = query._meta.primary_key
+			if key is None and pk and getattr(pk, 'column_name', None):
+				key = pk.column_name
+			query = 'SELECT * FROM "%s"' % self.__table(query)
+		if not isinstance(query, basestring):
+			query, params = query.sql()
+		with self.__db.read() as conn:
+			cursor = conn.execute_sql('SELECT * FROM (%s) LIMIT 0' % query, params)
+			names = [d[0] for d in cursor.description]
+		if key is None:
+			rows = self.__pages(query, params, chunk)
+		else:
+			rows = self.__db.paginate(query, key, params, chunk)
+		count = 0
+		tmp = path + '.tmp'
+		with open(tmp, 'wb') as f:
+			if format == 'csv':
+				writer = csv.writer(f)
+				writer.writerow([self.__encode(name) for name in names])
+			for row in rows:
+				if format == 'csv':
+					writer.writerow([self.__encode(value) for value in row])
+				else:
+					f.write(json.dumps(dict(zip(names, row))) + '\n')
+				count += 1
+				if progress is not None and count % chunk == 0:
+					progress(count)
+			if progress is not None and count % chunk:
+				progress(count)
+		os.rename(tmp, path)
+		logger.info('Dumped %d rows to %s', count, path)
+		return count
+
+	def __pages(self, query, params, chunk):
+		"""
+		Generates the rows of a query with LIMIT and OFFSET, fetching every
+		chunk under its own read lock.
+		"""
+		offset = 0
+		while True:
+			with self.__db.read() as conn:
+				rows = conn.execute_sql(
+					'SELECT * FROM (%s) LIMIT ? OFFSET ?' % query, tuple(params) + (chunk, offset)).fetchall()
+			for row in rows:
+				yield row
+			if len(rows) < chunk:
+				return
+			offset += chunk
+
+	def __insert(self, sql, rows, relax, checkpoint, count, progress):
+		"""
+		Inserts a batch in one transaction under the write lock and records
+		the checkpoint.
+		"""
+		with self.__db.write() as conn:
+			restore = self.__relax(conn) if relax else []
+			try:
+				with conn.atomic():
+					self.__db.invalidate(sql)
+					conn.cursor().executemany(sql, rows)
+			finally:
+				for name, value in restore:
+					conn.execute_sql('PRAGMA %s = %s' % (name, value))
+		count += len(rows)
+		if checkpoint is not None:
+			tmp = checkpoint + '.tmp'
+			with open(tmp, 'w') as f:
+				f.write(str(count))
+			os.rename(tmp, checkpoint)
+		if progress is not None:
+			progress(count)
+		return len(rows)
+
+	def __reader(self, f, format, columns, null):
+		"""
+		Returns the column names and a generator of row tuples.
+		"""
+		if format == 'csv':
+			reader = csv.reader(f)
+			header = [c.decode('utf-8') for c in next(reader)]
+			if columns is None:
+				columns = header
+			index = [header.index(c) for c in columns]
+			def rows():
+				for line in reader:
+					if not line:
+						# Blank lines are skipped, also when resuming
+						continue
+					values = [v.decode('utf-8') for v in line]
+					yield tuple(None if values[i] == null else values[i] for i in index)
+			return columns, rows()
+		lines = (line for line in f if line.strip())
+		first = None
+		if columns is None:
+			try:
+				first = json.loads(next(lines))
+			except StopIteration:
+				return [], iter([])
+			columns = sorted(first.keys())
+		def rows():
+			if first is not None:
+				yield tuple(first.get(c) for c in columns)
+			for line in lines:
+				obj = json.loads(line)
+				yield tuple(obj.get(c) for c in columns)
+		return columns, rows()
+
+	def __relax(self, conn):
+		"""
+		Sets the RELAX PRAGMAs on the connection and returns the previous
+		values.
+		"""
+		restore = []
+		for name, value in self.RELAX:
+			restore.append((name, conn.execute_sql('PRAGMA %s' % name).fetchone()[0]))
+			conn.execute_sql('PRAGMA %s = %s' % (name, value))
+		return restore
+
+	def __table(self, table):
+		if isinstance(table, basestring):
+			return table
+		return table._meta.table_name
+
+	def __format(self, path, format):
+		if format is None:
+			format = os.path.splitext(path)[1].lstrip('.').lower()
+		if format not in self.FORMATS:
+			raise ValueError('format must be one of: ' + ', '.join(self.FORMATS))
+		return format
+
+	def __encode(self, value):
+		if value is None:
+			return ''
+		if isinstance(value, unicode):
+			return value.encode('utf-8')
+		return value
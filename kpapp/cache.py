@@ -0,0 +1,216 @@
+import collections
+import re
+import threading
+import time
+
+"""
+The cache.py module containes the QueryCache class used by the Database
+wrapper to cache query results until a write touches the tables they read.
+"""
+
+TOKEN = re.compile(r"'(?:[^']|'')*'|[`\"\[]?(\w+)[`\"\]]?|([(),.;])")
+WRITE = re.compile(
+	r'^\s*(?:(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO|UPDATE(?:\s+OR\s+\w+)?'
+	r'|DELETE\s+FROM|(?:DROP|ALTER|CREATE)\s+TABLE(?:\s+IF(?:\s+NOT)?\s+EXISTS)?)'
+	r'\s+[`"\[]?(\w+)', re.IGNORECASE)
+SELECT = re.compile(r'^\s*(?:SELECT|WITH)\b', re.IGNORECASE)
+# Keywords ending a FROM list
+CLAUSES = frozenset(['where', 'group', 'order', 'limit', 'having', 'window', 'union', 'except', 'intersect'])
+
+def _tokens(sql):
+	"""
+	Returns a list of the (token, offset) pairs of a statement, identifiers
+	unquoted and string literals left out.
+	"""
+	tokens = []
+	for match in TOKEN.finditer(sql):
+		token = match.group(1) or match.group(2)
+		if token:
+			tokens.append((token, match.start()))
+	return tokens
+
+def read_tables(sql):
+	"""
+	Returns the set of lower case table names a SELECT statement reads, from
+	the FROM lists and joins of the statement and its subqueries.
+	"""
+	tables = set()
+	tokens = _tokens(sql)
+	depth = 0
+	lists = set()
+	expect = False
+	for i, (token, offset) in enumerate(tokens):
+		lower = token.lower()
+		if token == '(':
+			depth += 1
+			expect = False
+		elif token == ')':
+			lists.discard(depth)
+			depth -= 1
+		elif token == ',':
+			expect = depth in lists
+		elif token in '.;':
+			continue
+		elif expect:
+			if i + 2 < len(tokens) and tokens[i + 1][0] == '.':
+				# schema.table
+				lower = tokens[i + 2][0].lower()
+			tables.add(lower)
+			expect = False
+		elif lower in ('from', 'join'):
+			expect = True
+			if lower == 'from':
+				lists.add(depth)
+		elif lower in CLAUSES:
+			lists.discard(depth)
+	return tables
+
+def written_tables(sql):
+	"""
+	Returns the set of lower case table names a statement writes, an empty
+	set for statements that don't write and None if the tables are unknown.
+	"""
+	if SELECT.match(sql):
+		if not re.match(r'^\s*WITH\b', sql, re.IGNORECASE):
+			return set()
+		# The statement following the common table expressions decides
+		depth = 0
+		for token, offset in _tokens(sql):
+			lower = token.lower()
+			if token == '(':
+				depth += 1
+			elif token == ')':
+				depth -= 1
+			elif depth == 0 and lower in ('select', 'values'):
+				return set()
+			elif depth == 0 and lower in ('insert', 'replace', 'update', 'delete'):
+				sql = sql[offset:]
+				break
+		else:
+			return None
+	match = WRITE.match(sql)
+	if match is None:
+		if re.match(r'^\s*(?:PRAGMA|BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|EXPLAIN)\b', sql, re.IGNORECASE):
+			return set()
+		return None
+	return set([match.group(1).lower()])
+
+class QueryCache:
+	"""
+	QueryCache is a LRU cache of query results keyed by SQL and parameters.
+	Every entry expires after its TTL and is invalidated when one of the
+	tables it reads is written.
+	"""
+	def __init__(self, size = 1000, ttl = 60):
+		"""
+		size	Maximum number of cached results
+		ttl		Default seconds a result is valid, None never expires
+		"""
+		if size < 1:
+			raise ValueError('size must be at least 1')
+		self.__size = size
+		self.__ttl = ttl
+		self.__entries = collections.OrderedDict()
+		self.__tables = {}
+		self.__lock = threading.Lock()
+		self.__counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidations': 0}
+
+	def configure(self, size = None, ttl = None):
+		"""
+		Changes the size and default TTL in place, evicting the least recently
+		used results when shrinking. None keeps a value.
+		"""
+		if size is not None and size < 1:
+			raise ValueError('size must be at least 1')
+		with self.__lock:
+			if size is not None:
+				self.__size = size
+			if ttl is not None:
+				self.__ttl = ttl
+			while len(self.__entries) > self.__size:
+				old = self.__entries.popitem(last=False)
+				self.__unlink(old[0], old[1])
+				self.__counters['evictions'] += 1
+
+	def get(self, sql, params = ()):
+		"""
+		Returns the cached result, or None on a miss.
+		"""
+		key = (sql, tuple(params))
+		with self.__lock:
+			entry = self.__entries.pop(key, None)
+			if entry is None:
+				self.__counters['misses'] += 1
+				return None
+			if entry[0] is not None and entry[0] < time.time():
+				self.__unlink(key, entry)
+				self.__counters['expired'] += 1
+				self.__counters['misses'] += 1
+				return None
+			self.__entries[key] = entry
+			self.__counters['hits'] += 1
+			return entry[1]
+
+	def put(self, sql, params, result, ttl = None):
+		"""
+		Caches the result of a query, evicting the least recently used result
+		when full.
+		ttl		Seconds the result is valid, defaults to the cache TTL
+		"""
+		if ttl is None:
+			ttl = self.__ttl
+		expires = None
+		if ttl is not None:
+			expires = time.time() + ttl
+		key = (sql, tuple(params))
+		tables = read_tables(sql)
+		with self.__lock:
+			entry = self.__entries.pop(key, None)
+			if entry is not None:
+				self.__unlink(key, entry)
+			while len(self.__entries) >= self.__size:
+				old = self.__entries.popitem(last=False)
+				self.__unlink(old[0], old[1])
+				self.__counters['evictions'] += 1
+			self.__entries[key] = (expires, result, tables)
+			for table in tables:
+				self.__tables.setdefault(table, set()).add(key)
+
+	def invalidate(self, tables = None):
+		"""
+		Removes the results reading any of the tables, all results when
+		"tables" is None. Returns the number of removed results.
+		"""
+		with self.__lock:
+			if tables is None:
+				count = len(self.__entries)
+				self.__entries.clear()
+				self.__tables.clear()
+			else:
+				count = 0
+				for table in tables:
+					for key in self.__tables.pop(table.lower(), ()):
+						entry = self.__entries.pop(key, None)
+						if entry is not None:
+							self.__unlink(key, entry)
+							count += 1
+			self.__counters['invalidations'] += count
+		return count
+
+	def stats(self):
+		"""
+		Returns a dictionary with the hit, miss, eviction, expiry and
+		invalidation counters and the number of cached results.
+		"""
+		with self.__lock:
+			stats = dict(self.__counters)
+			stats['size'] = len(self.__entries)
+		return stats
+
+	def __unlink(self, key, entry):
+		for table in entry[2]:
+			keys = self.__tables.get(table)
+			if keys is not None:
+				keys.discard(key)
+				if not keys:
+					del self.__tables[table]
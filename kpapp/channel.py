@@ -0,0 +1,306 @@
+import collections
+import threading
+import time
+import Queue
+
+"""
+The channel.py module containes the Channel and Topic classes used by the
+TaskManager to move data between producer and consumer tasks.
+"""
+
+class ChannelClosed(RuntimeError):
+	"""
+	Raised when putting to a closed Channel, or getting from a closed and
+	empty Channel.
+	"""
+	pass
+
+class Channel:
+	"""
+	Channel is a bounded queue with one consumer. Batch puts and gets take the
+	lock once for many items. When the channel is full the policy decides what
+	happens to new items:
+
+	block		Wait until there is room, or the timeout expires
+	drop		Discard the new item
+	drop_oldest	Discard the oldest queued item
+	coalesce	Replace the queued item with the same key(item), or discard
+				the oldest queued item if there is none
+	"""
+	POLICIES = ('block', 'drop', 'drop_oldest', 'coalesce')
+	def __init__(self, name, size = 0, policy = 'block', key = None):
+		"""
+		name	A string with the channel name
+		size	Maximum number of queued items, 0 is unbounded
+		policy	What to do with new items when full, see POLICIES
+		key		Callable returning the coalesce key of an item
+		"""
+		if not isinstance(name, basestring):
+			raise TypeError('name not basestring')
+		if policy not in self.POLICIES:
+			raise ValueError('policy must be one of: ' + ', '.join(self.POLICIES))
+		if policy == 'coalesce' and key is None:
+			raise ValueError('coalesce policy requires key')
+
+		self.__name = name
+		self.__size = size
+		self.__policy = policy
+		self.__key = key
+		self.__queue = collections.deque()
+		self.__keys = {}
+		self.__lock = threading.Lock()
+		self.__not_empty = threading.Condition(self.__lock)
+		self.__not_full = threading.Condition(self.__lock)
+		self.__closed = False
+		self.__counters = {'put': 0, 'get': 0, 'dropped': 0, 'coalesced': 0}
+
+	def name(self):
+		"""
+		Returns channel name.
+		"""
+		return self.__name
+
+	def qsize(self):
+		"""
+		Returns the number of queued items.
+		"""
+		return len(self.__queue)
+
+	def closed(self):
+		"""
+		Returns True if the channel is closed.
+		"""
+		return self.__closed
+
+	def stats(self):
+		"""
+		Returns a dictionary with the put, get, dropped and coalesced counters
+		and the number of queued items.
+		"""
+		with self.__lock:
+			stats = dict(self.__counters)
+			stats['queued'] = len(self.__queue)
+		return stats
+
+	def put(self, item, timeout = None):
+		"""
+		Puts an item. Returns False if the item was dropped or the timeout
+		expired, raises ChannelClosed if the channel is closed.
+		"""
+		return self.put_batch([item], timeout) == 1
+
+	def put_batch(self, items, timeout = None):
+		"""
+		Puts several items taking the lock once. Returns the number of items
+		that were queued or coalesced, raises ChannelClosed if the channel is
+		closed.
+		timeout		Seconds to wait in total for room with the block policy
+		"""
+		count = 0
+		coalesced = 0
+		endtime = None
+		if timeout is not None:
+			endtime = time.time() + timeout
+		with self.__lock:
+			for item in items:
+				if self.__closed:
+					raise ChannelClosed('Channel "' + self.__name + '" closed')
+				if self.__size > 0 and len(self.__queue) >= self.__size:
+					if self.__coalesce(item):
+						coalesced += 1
+						continue
+					if not self.__full(item, endtime):
+						continue
+				self.__append(item)
+				count += 1
+			if count:
+				self.__counters['put'] += count
+				self.__not_empty.notify()
+		return count + coalesced
+
+	def get(self, timeout = None):
+		"""
+		Returns the next item. Raises Queue.Empty if the timeout expires and
+		ChannelClosed if the channel is closed and empty.
+		"""
+		items = self.get_batch(1, timeout)
+		if not items:
+			raise Queue.Empty
+		return items[0]
+
+	def get_batch(self, max_items = 0, timeout = None):
+		"""
+		Waits for at least one item and returns a list of up to "max_items"
+		items, 0 takes all queued items. Returns an empty list if the timeout
+		expires and raises ChannelClosed if the channel is closed and empty.
+		"""
+		endtime = None
+		if timeout is not None:
+			endtime = time.time() + timeout
+		with self.__lock:
+			while not self.__queue:
+				if self.__closed:
+					raise ChannelClosed('Channel "' + self.__name + '" closed')
+				if endtime is None:
+					self.__not_empty.wait()
+				else:
+					remaining = endtime - time.time()
+					if remaining <= 0:
+						return []
+					self.__not_empty.wait(remaining)
+			count = len(self.__queue)
+			if max_items > 0:
+				count = min(count, max_items)
+			items = [self.__pop() for i in range(count)]
+			self.__counters['get'] += count
+			self.__not_full.notify_all()
+		return items
+
+	def close(self):
+		"""
+		Closes the channel and wakes up all waiting threads. Queued items can
+		still be read.
+		"""
+		with self.__lock:
+			self.__closed = True
+			self.__not_empty.notify_all()
+			self.__not_full.notify_all()
+
+	def __coalesce(self, item):
+		"""
+		Replaces the queued item with the same key with the coalesce policy,
+		returns True if an item was replaced.
+		"""
+		if self.__policy != 'coalesce':
+			return False
+		entry = self.__keys.get(self.__key(item))
+		if entry is None:
+			return False
+		entry[1] = item
+		self.__counters['coalesced'] += 1
+		return True
+
+	def __full(self, item, endtime):
+		"""
+		Applies the policy to an item put to the full channel, returns True if
+		the item should be appended.
+		"""
+		if self.__policy == 'drop':
+			self.__counters['dropped'] += 1
+			return False
+		if self.__policy in ('drop_oldest', 'coalesce'):
+			self.__pop()
+			self.__counters['dropped'] += 1
+			return True
+		# Items already put in this batch must reach the consumer first
+		self.__not_empty.notify()
+		while len(self.__queue) >= self.__size:
+			if self.__closed:
+				raise ChannelClosed('Channel "' + self.__name + '" closed')
+			if endtime is None:
+				self.__not_full.wait()
+			else:
+				remaining = endtime - time.time()
+				if remaining <= 0:
+					return False
+				self.__not_full.wait(remaining)
+		return True
+
+	def __append(self, item):
+		if self.__key is None:
+			self.__queue.append(item)
+		else:
+			entry = [self.__key(item), item]
+			self.__keys[entry[0]] = entry
+			self.__queue.append(entry)
+
+	def __pop(self):
+		entry = self.__queue.popleft()
+		if self.__key is None:
+			return entry
+		if self.__keys.get(entry[0]) is entry:
+			del self.__keys[entry[0]]
+		return entry[1]
+
+class Topic:
+	"""
+	Topic fans out published items to the Channels of all subscribers.
+	"""
+	def __init__(self, name):
+		"""
+		name	A string with the topic name
+		"""
+		if not isinstance(name, basestring):
+			raise TypeError('name not basestring')
+		self.__name = name
+		self.__lock = threading.Lock()
+		self.__subscribers = []
+		self.__count = 0
+		self.__closed = False
+
+	def name(self):
+		"""
+		Returns topic name.
+		"""
+		return self.__name
+
+	def subscribe(self, size = 0, policy = 'drop_oldest', key = None):
+		"""
+		Returns a new Channel receiving all items published from now on. The
+		default policy keeps a slow subscriber from blocking the publishers.
+		"""
+		with self.__lock:
+			if self.__closed:
+				raise ChannelClosed('Topic "' + self.__name + '" closed')
+			self.__count += 1
+			channel = Channel('%s-%d' % (self.__name, self.__count), size, policy, key)
+			self.__subscribers = self.__subscribers + [channel]
+		return channel
+
+	def unsubscribe(self, channel):
+		"""
+		Removes a subscriber and closes its channel.
+		"""
+		with self.__lock:
+			self.__subscribers = [c for c in self.__subscribers if c is not channel]
+		channel.close()
+
+	def subscribers(self):
+		"""
+		Returns the number of subscribers.
+		"""
+		return len(self.__subscribers)
+
+	def publish(self, item, timeout = None):
+		"""
+		Publishes an item, returns the number of subscribers that accepted
+		it.
+		"""
+		return self.publish_batch([item], timeout)
+
+	def publish_batch(self, items, timeout = None):
+		"""
+		Publishes several items, returns the number of subscribers that
+		accepted all of them.
+		"""
+		if self.__closed:
+			raise ChannelClosed('Topic "' + self.__name + '" closed')
+		items = list(items)
+		count = 0
+		for channel in self.__subscribers:
+			try:
+				if channel.put_batch(items, timeout) == len(items):
+					count += 1
+			except ChannelClosed:
+				pass
+		return count
+
+	def close(self):
+		"""
+		Closes the topic and the channels of all subscribers.
+		"""
+		with self.__lock:
+			self.__closed = True
+			subscribers = self.__subscribers
+		for channel in subscribers:
+			channel.close()
@@ -1,26 +1,42 @@
-import sys
 import os
-import yaml
 import logging
-import types
 
 from .misc import Config
 
 """
 The common.py script is where all globally accessable variables and instances
-are set up.
+are set up. The log files are opened on the first record, their directory is
+created then if missing.
 """
 
 
 conf = Config()
 
+class LogFile(logging.FileHandler):
+	"""
+	A FileHandler opening its file on the first record and creating the log
+	directory if missing, so importing kpapp touches no files.
+	"""
+	def __init__(self, filename, mode = 'a+'):
+		logging.FileHandler.__init__(self, filename, mode=mode, delay=True)
+
+	def _open(self):
+		path = os.path.dirname(self.baseFilename)
+		if not os.path.isdir(path):
+			try:
+				os.makedirs(path)
+			except OSError:
+				if not os.path.isdir(path):
+					raise
+		return logging.FileHandler._open(self)
+
 class Log():
 	def __init__(self, config = {}):
 		pass
 
 	def logger(self):
 		logger = logging.getLogger('app')
-		hdlr = logging.FileHandler(conf.app_dir() + '/data/log/error.log', mode='a+')
+		hdlr = LogFile(conf.app_dir() + '/data/log/error.log', mode='a+')
 		formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
 		hdlr.setFormatter(formatter)
 		logger.addHandler(hdlr)
@@ -29,7 +45,7 @@ class Log():
 
 	def bizz(self):
 		logger = logging.getLogger('biz')
-		hdlr = logging.FileHandler(conf.app_dir() + '/data/log/bizz.log', mode='a+')
+		hdlr = LogFile(conf.app_dir() + '/data/log/bizz.log', mode='a+')
 		formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
 		hdlr.setFormatter(formatter)
 		logger.addHandler(hdlr)
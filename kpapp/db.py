@@ -1,8 +1,23 @@
 import importlib
+import collections
+import copy
+import re
 import threading
+import heapq
+import time
+from contextlib import contextmanager
 from peewee import SqliteDatabase, Database as PWDatabase
+from playhouse.pool import PooledSqliteDatabase
+from .bulk import Bulk
+from .jobs import JobQueue
+from .cache import QueryCache, SELECT, written_tables
+from .metrics import QueryStats
+from .rwlock import RWLock
 from .service import Service
-from .common import conf
+from .shard import ShardedDatabase, crc32
+from .tasks.writer import Writer
+from .common import conf, logger
+from .misc import diff
 
 """
 The db.py module containes application wrappers and helper classes to work with
@@ -10,35 +25,618 @@ databases within the application such as the Database wrapper class and the
 DatabaseManager class.
 """
 
+class SqlitePool(PooledSqliteDatabase):
+	"""
+	A pooled SqliteDatabase where every thread gets its own connection, so
+	readers don't queue behind each other. Connections are either kept by the
+	thread or checked out while the thread holds a Database lock, and
+	connections that have been idle in the pool too long are closed.
+	"""
+	def __init__(self, database, checkout = True, idle_timeout = None, busy_timeout = 5, **kwargs):
+		"""
+		database		Path to the database file
+		checkout		True returns the connection to the pool on release,
+						False keeps it with the thread
+		idle_timeout	Seconds a connection may be unused in the pool, None
+						keeps it
+		busy_timeout	Seconds a connection waits for a locked database
+		kwargs			Arguments for PooledSqliteDatabase, max_connections,
+						stale_timeout, timeout and pragmas
+		"""
+		self.__checkout = checkout
+		self.__idle_timeout = idle_timeout
+		self.__returned = {}
+		self.__evicted = time.time()
+		# Checked out connections move between threads
+		kwargs.setdefault('check_same_thread', False)
+		PooledSqliteDatabase.__init__(self, database, **kwargs)
+		# "timeout" is taken by the pool, the connection timeout is set here
+		self._timeout = busy_timeout
+
+	def checkout(self):
+		"""
+		Returns True if connections are checked out per lock() instead of
+		kept per thread.
+		"""
+		return self.__checkout
+
+	def idle(self):
+		"""
+		Returns the number of idle connections in the pool.
+		"""
+		return len(self._connections)
+
+	def in_use(self):
+		"""
+		Returns the number of connections in use.
+		"""
+		return len(self._in_use)
+
+	def evict(self, idle_timeout = None):
+		"""
+		Closes the pooled connections that have been idle longer than
+		"idle_timeout" seconds, defaults to the configured idle timeout.
+		Returns the number of closed connections.
+		"""
+		if idle_timeout is None:
+			idle_timeout = self.__idle_timeout
+		if idle_timeout is None:
+			return 0
+		now = time.time()
+		with self._lock:
+			self.__evicted = now
+			keep = []
+			for entry in self._connections:
+				key = self.conn_key(entry[1])
+				if now - self.__returned.get(key, now) > idle_timeout:
+					self.__returned.pop(key, None)
+					self._close(entry[1], True)
+				else:
+					keep.append(entry)
+			count = len(self._connections) - len(keep)
+			heapq.heapify(keep)
+			self._connections = keep
+		return count
+
+	def configure(self, max_connections = None, idle_timeout = None, stale_timeout = None, timeout = None):
+		"""
+		Retunes the pool in place, idle connections beyond a lowered maximum
+		are closed now and connections in use when returned. None keeps a
+		value.
+		"""
+		with self._lock:
+			if max_connections is not None:
+				self._max_connections = max_connections
+			if idle_timeout is not None:
+				self.__idle_timeout = idle_timeout
+			if stale_timeout is not None:
+				self._stale_timeout = stale_timeout
+			if timeout is not None:
+				self._wait_timeout = timeout or float('inf')
+			while len(self._connections) + len(self._in_use) > self._max_connections and self._connections:
+				entry = heapq.heappop(self._connections)
+				self._close(entry[1], True)
+
+	def _close(self, conn, close_conn = False):
+		key = self.conn_key(conn)
+		if not close_conn and self._in_use.has_key(key) and len(self._connections) + len(self._in_use) > self._max_connections:
+			# Returned to a pool over its lowered maximum, see configure()
+			del self._in_use[key]
+			close_conn = True
+		PooledSqliteDatabase._close(self, conn, close_conn)
+		if close_conn:
+			self.__returned.pop(self.conn_key(conn), None)
+		else:
+			self.__returned[self.conn_key(conn)] = time.time()
+
+	def _release(self):
+		"""
+		Called when a Database lock is released, returns the connection to
+		the pool in checkout mode and now and then evicts idle connections.
+		"""
+		if self.__checkout:
+			self.close()
+		if self.__idle_timeout is not None and time.time() - self.__evicted > self.__idle_timeout:
+			self.evict()
+
+class _Cursor:
+	"""
+	Cursor proxy counting the fetched rows into QueryStats.
+	"""
+	def __init__(self, cursor, stats, entry):
+		self.__cursor = cursor
+		self.__stats = stats
+		self.__entry = entry
+
+	def __getattr__(self, name):
+		return getattr(self.__cursor, name)
+
+	def __iter__(self):
+		for row in self.__cursor:
+			self.__stats.rows(self.__entry, 1)
+			yield row
+
+	def fetchone(self):
+		row = self.__cursor.fetchone()
+		if row is not None:
+			self.__stats.rows(self.__entry, 1)
+		return row
+
+	def fetchmany(self, *args):
+		rows = self.__cursor.fetchmany(*args)
+		self.__stats.rows(self.__entry, len(rows))
+		return rows
+
+	def fetchall(self):
+		rows = self.__cursor.fetchall()
+		self.__stats.rows(self.__entry, len(rows))
+		return rows
+
 class Database:
 	"""
-	A Database wrapper for Database and ORM connection for peewee.
+	A Database wrapper for Database and ORM connection for peewee. Readers
+	share the database and writers get it exclusively through a RWLock with
+	writer preference, a SqlitePool gives every thread a connection of its
+	own while it holds the lock.
+
+	Usage:
+		with db.read() as conn:
+			...
+		with db.atomic() as conn:
+			...
 	"""
 	def __init__(self, db):
 		#, peewee.SqliteDatabase, peewee.MySQLDatabase, peewee.PostgresqlDatabase)
 		if not isinstance(db, PWDatabase):
 			raise TypeError
 		self.__db = db
-		self.__lock = threading.Lock()
+		self.__lock = RWLock()
+		self.__local = threading.local()
+		self.__pool = isinstance(db, SqlitePool)
+		self.__cache = None
+		self.__queries = None
+		self.__slow = None
+		self.__explain = True
+		self.__execute_sql = db.execute_sql
+		db.execute_sql = self.__execute
 
 	def get(self):
 		return self.__db
 
 	def lock(self):
-		self.__lock.acquire()
+		"""
+		Acquires the write lock, prefer write() which can't leave the lock
+		held on exceptions.
+		"""
+		self.__lock.acquire_write()
+		self.__enter()
 
 	def unlock(self):
-		self.__lock.release()
+		"""
+		Releases the write lock acquired by lock().
+		"""
+		self.__leave()
+		self.__lock.release_write()
+		written = getattr(self.__local, 'written', None)
+		if written and not getattr(self.__local, 'depth', 0):
+			# Results cached while the transaction was open are stale now
+			self.__local.written = set()
+			cache = self.__cache
+			if cache is not None:
+				cache.invalidate(written)
+
+	@contextmanager
+	def read(self):
+		"""
+		Context manager holding the shared read lock, yields the peewee
+		database.
+		"""
+		self.__lock.acquire_read()
+		try:
+			self.__enter()
+			try:
+				yield self.__db
+			finally:
+				self.__leave()
+		finally:
+			self.__lock.release_read()
+
+	@contextmanager
+	def write(self):
+		"""
+		Context manager holding the exclusive write lock, yields the peewee
+		database.
+		"""
+		self.lock()
+		try:
+			yield self.__db
+		finally:
+			self.unlock()
+
+	@contextmanager
+	def atomic(self):
+		"""
+		Context manager running a transaction, or a savepoint when nested,
+		under the write lock. Commits on exit and rolls back on exceptions.
+		"""
+		with self.write():
+			with self.__db.atomic():
+				yield self.__db
+
+	def enable_cache(self, size = 1000, ttl = 60):
+		"""
+		Caches the results of select() in a QueryCache. Statements executed
+		through the peewee database invalidate the results reading the tables
+		they write, statements the cache can't parse invalidate all results.
+		An enabled cache is resized in place.
+		size	Maximum number of cached results
+		ttl		Default seconds a result is valid
+		"""
+		if self.__cache is None:
+			self.__cache = QueryCache(size, ttl)
+		else:
+			self.__cache.configure(size, ttl)
+
+	def disable_cache(self):
+		"""
+		Drops the QueryCache, waiting for the running reads and writes.
+		"""
+		with self.write():
+			self.__cache = None
+
+	def cache(self):
+		"""
+		Returns the QueryCache, or None.
+		"""
+		return self.__cache
+
+	def instrument(self, slow = None, explain = True):
+		"""
+		Records the execution time and rows of every statement executed
+		through the peewee database in a QueryStats. Statements slower than
+		"slow" seconds are logged with their EXPLAIN QUERY PLAN output.
+		Calling it again keeps the recorded statistics.
+		slow		Slow query threshold in seconds, None logs nothing
+		explain		Log the query plan of slow statements
+		"""
+		self.__slow = slow
+		self.__explain = explain
+		if self.__queries is None:
+			self.__queries = QueryStats()
+
+	def uninstrument(self):
+		"""
+		Stops recording query statistics and drops the recorded ones.
+		"""
+		self.__queries = None
+		self.__slow = None
+
+	def queries(self, n = 10, by = 'total'):
+		"""
+		Returns the top "n" statements by "by", see QueryStats.top(), an empty
+		list when not instrumented.
+		"""
+		if self.__queries is None:
+			return []
+		return self.__queries.top(n, by)
+
+	def select(self, query, params = (), ttl = None):
+		"""
+		Runs a query under the read lock and returns its rows as a list,
+		cached when the cache is enabled.
+		query	A SQL string or a peewee query, which returns model instances
+		params	Parameters of a SQL string
+		ttl		Seconds the result is valid, defaults to the cache TTL
+		"""
+		if isinstance(query, basestring):
+			sql = query
+		else:
+			sql, params = query.sql()
+		cache = self.__cache
+		if cache is not None:
+			result = cache.get(sql, params)
+			if result is not None:
+				return self.__copy(result)
+		with self.read() as conn:
+			if isinstance(query, basestring):
+				result = conn.execute_sql(sql, params).fetchall()
+			else:
+				result = list(query)
+			cache = self.__cache
+			if cache is None:
+				return result
+			# Cached under the read lock, so no write can invalidate the
+			# tables before the result is in the cache
+			cached = tuple(result)
+			cache.put(sql, params, cached, ttl)
+		return self.__copy(cached)
+
+	def iterate(self, query, params = (), chunk = 1000, row = 'tuple', sig = None):
+		"""
+		Generator streaming the rows of a query, fetched "chunk" rows at a
+		time so memory stays flat regardless of the result size. The read
+		lock is held until the generator is exhausted or closed in the same
+		thread, long scans that must pause should use paginate().
+		query	A SQL string or a peewee query
+		params	Parameters of a SQL string
+		chunk	Number of rows fetched at once
+		row		"tuple", "namedtuple", "dict", or "model" for peewee queries
+		sig		A Signal, the generator stops between chunks when it halts
+		"""
+		if row == 'model':
+			if isinstance(query, basestring):
+				raise ValueError('row "model" requires a peewee query')
+			with self.read():
+				for i, obj in enumerate(query.iterator()):
+					yield obj
+					if sig is not None and (i + 1) % chunk == 0 and sig.halt():
+						return
+			return
+		if not isinstance(query, basestring):
+			query, params = query.sql()
+		with self.read() as conn:
+			cursor = conn.execute_sql(query, params)
+			convert = self.__convert(cursor, row)
+			rows = cursor.fetchmany(chunk)
+			while rows:
+				for r in rows:
+					yield convert(r)
+				if sig is not None and sig.halt():
+					return
+				rows = cursor.fetchmany(chunk)
+
+	def paginate(self, query, key, params = (), chunk = 1000, row = 'tuple', sig = None, start = None):
+		"""
+		Generator streaming the rows of a query with keyset pagination, one
+		query per chunk ordered by the unique column "key" and starting after
+		the last key of the previous chunk. The read lock is only held while
+		a chunk is fetched, between chunks the generator stops when "sig"
+		halts and waits while it is paused.
+		query	A SQL string, or a peewee query
+		key		The key column name for a SQL string, a peewee Field for a
+				peewee query
+		params	Parameters of a SQL string
+		chunk	Number of rows per query
+		row		"tuple", "namedtuple", "dict", or "model" for peewee queries
+		sig		A Signal to listen to between chunks
+		start	Key to start after, None starts at the beginning
+		"""
+		if row == 'model' and isinstance(query, basestring):
+			raise ValueError('row "model" requires a peewee query')
+		last = start
+		while True:
+			if isinstance(query, basestring):
+				if last is None:
+					sql = 'SELECT * FROM (%s) ORDER BY "%s" LIMIT ?' % (query, key)
+					args = tuple(params) + (chunk,)
+				else:
+					sql = 'SELECT * FROM (%s) WHERE "%s" > ? ORDER BY "%s" LIMIT ?' % (query, key, key)
+					args = tuple(params) + (last, chunk)
+				name = key
+			else:
+				page = query if last is None else query.where(key > last)
+				page = page.order_by(key).limit(chunk)
+				sql, args = page.sql()
+				name = key.column_name
+			with self.read() as conn:
+				if row == 'model':
+					rows = list(page)
+					if rows:
+						last = getattr(rows[-1], key.name)
+				else:
+					cursor = conn.execute_sql(sql, args)
+					names = [d[0] for d in cursor.description]
+					if name not in names:
+						raise ValueError('Key column "' + name + '" not selected')
+					convert = self.__convert(cursor, row)
+					raw = cursor.fetchall()
+					if raw:
+						last = raw[-1][names.index(name)]
+					rows = [convert(r) for r in raw]
+			for r in rows:
+				yield r
+			if len(rows) < chunk:
+				return
+			if sig is not None:
+				if sig.halt():
+					return
+				sig.pause()
+				if sig.halt():
+					return
+
+	def warm(self, statements = ()):
+		"""
+		Opens a connection and runs the warm-up statements on it, so the
+		first request doesn't pay for opening the file, reading the schema and
+		filling the page cache. SELECT statements are run and fetched, other
+		statements are only compiled with EXPLAIN. Returns the seconds spent.
+		statements	A list of SQL strings or [sql, params] pairs
+		"""
+		start = time.time()
+		with self.read() as conn:
+			conn.execute_sql('PRAGMA schema_version').fetchall()
+			for statement in statements:
+				if isinstance(statement, basestring):
+					sql, params = statement, ()
+				else:
+					sql, params = statement
+				if SELECT.match(sql) and written_tables(sql) == set():
+					conn.execute_sql(sql, params).fetchall()
+				else:
+					conn.execute_sql('EXPLAIN ' + sql, params).fetchall()
+		return time.time() - start
+
+	def invalidate(self, sql):
+		"""
+		Invalidates the cached results reading the tables written by the SQL
+		statement "sql".
+		"""
+		cache = self.__cache
+		if cache is None:
+			return
+		tables = written_tables(sql)
+		if tables is None:
+			cache.invalidate()
+		elif tables:
+			cache.invalidate(tables)
+			if getattr(self.__local, 'depth', 0):
+				self.__local.written = getattr(self.__local, 'written', set()) | tables
+
+	def stats(self):
+		"""
+		Returns the lock statistics, see RWLock.stats(), the cache counters,
+		see QueryCache.stats(), and the query statistics, see
+		QueryStats.snapshot().
+		"""
+		stats = self.__lock.stats()
+		if self.__cache is not None:
+			stats['cache'] = self.__cache.stats()
+		if self.__queries is not None:
+			stats['queries'] = self.__queries.snapshot()
+		return stats
+
+	def __enter__(self):
+		self.lock()
+		return self.__db
+
+	def __exit__(self, type, value, traceback):
+		self.unlock()
+
+	def __execute(self, sql, params = None, *args, **kwargs):
+		"""
+		Replaces execute_sql() of the peewee database to invalidate the cache
+		and instrument the statements.
+		"""
+		if self.__cache is not None:
+			self.invalidate(sql)
+		queries = self.__queries
+		if queries is None:
+			return self.__execute_sql(sql, params, *args, **kwargs)
+		start = time.time()
+		cursor = self.__execute_sql(sql, params, *args, **kwargs)
+		elapsed = time.time() - start
+		entry = queries.record(sql, elapsed, cursor.rowcount)
+		slow = self.__slow
+		if slow is not None and elapsed >= slow:
+			self.__log_slow(sql, params, elapsed)
+		return _Cursor(cursor, queries, entry)
+
+	def __log_slow(self, sql, params, elapsed):
+		plan = ''
+		if self.__explain and written_tables(sql) is not None:
+			try:
+				rows = self.__execute_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+				plan = '\n'.join(str(row[-1]) for row in rows)
+			except Exception:
+				plan = 'No query plan'
+		logger.warning('Slow query %.3fs: %s %r\n%s', elapsed, sql, params, plan)
+
+	def __copy(self, result):
+		"""
+		Returns a list copy of a cached result, model instances are copied
+		too so callers can't change the cached ones.
+		"""
+		if result and not isinstance(result[0], tuple):
+			return copy.deepcopy(list(result))
+		return list(result)
+
+	def __convert(self, cursor, row):
+		"""
+		Returns a function converting the tuples fetched from "cursor" to the
+		"row" type.
+		"""
+		if row == 'tuple':
+			return tuple
+		names = [d[0] for d in cursor.description]
+		if row == 'namedtuple':
+			return collections.namedtuple('Row', names, rename=True)._make
+		if row == 'dict':
+			return lambda r: dict(zip(names, r))
+		raise ValueError('row must be "tuple", "namedtuple", "dict" or "model"')
+
+	def __enter(self):
+		"""
+		Checks out a connection on the outermost lock of the thread.
+		"""
+		depth = getattr(self.__local, 'depth', 0)
+		if not depth and self.__pool:
+			self.__db.connect(reuse_if_open=True)
+		self.__local.depth = depth + 1
+
+	def __leave(self):
+		depth = self.__local.depth - 1
+		self.__local.depth = depth
+		if not depth and self.__pool:
+			self.__db._release()
 
 class DatabaseManager(Service):
 	"""
 	Databasemanager service for the Application
+
+	Every connection is opened with the PRAGMAs of the "profile" of the
+	database, see PROFILES, overridden by the "journal_mode", "synchronous",
+	"cache_size", "mmap_size" and "temp_store" values of the database.
+	"busy_timeout" is the seconds to wait for a locked database, default 5.
+	"warmup" is a list of statements run by open(), see Database.warm().
+
+	A database configured with a "pool" section is opened as a SqlitePool in
+	WAL journal mode, unless "journal_mode" says otherwise:
+
+	pool:
+		max_connections	Maximum number of connections, default 8
+		checkout		Return connections to the pool on release, default
+						True, False keeps one connection per thread
+		idle_timeout	Seconds before an idle connection is closed
+		stale_timeout	Seconds before any connection is recycled
+		timeout			Seconds to wait for a free connection, default 10
+
+	A "cache" section enables the query cache of Database.select():
+
+	cache:
+		size			Maximum number of cached results, default 1000
+		ttl				Default seconds a result is valid, default 60
+
+	Every database records query statistics, see Database.queries(), unless
+	"instrument" is False:
+
+	instrument:
+		slow			Seconds after which a statement is logged with its
+						query plan, default None
+		explain			Log the query plan of slow statements, default True
+
+	The "sharded_sqlite" type spreads a database over "shards" files, the
+	"path" is formatted with the shard number, e.g. "/data/users-%d.db". The
+	optional "key" names the key hash function, default kpapp.shard.crc32.
+	get() then returns a ShardedDatabase.
+
+	A reloaded config retunes the opened databases in place, the PRAGMAs and
+	busy timeout apply to new connections. Removing "cache" disables the
+	cache, removing "instrument" restores the default. Changes to "type", "class",
+	"path", "shards", "key", "writer", "jobs" and adding or removing "pool"
+	take effect after a restart.
 	"""
 	NAME = 'DatabaseManager'
-	def __init__(self, config = {}):
+	PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store')
+	RESTART = ('type', 'class', 'path', 'shards', 'key', 'writer', 'jobs')
+	PROFILES = {
+		'default': {},
+		'safe': {'journal_mode': 'wal', 'synchronous': 'full'},
+		'fast': {
+			'journal_mode': 'wal', 'synchronous': 'normal', 'cache_size': -65536,
+			'mmap_size': 268435456, 'temp_store': 'memory'},
+	}
+	def __init__(self, config = {}, task_manager = None):
+		"""
+		config			Dictionary with a section per database
+		task_manager	The TaskManager running the writers, optional
+		"""
 		Service.__init__(self, self.NAME, config)
 
 		self.__instances = {}
+		self.__writers = {}
+		self.__jobs = {}
+		self.__task_manager = task_manager
+		self.__lock = threading.Lock()
 
 	def __instantiate(self, name):
 		if not self.__instances.has_key(name):
@@ -57,10 +655,9 @@ class DatabaseManager(Service):
 				raise RuntimeError('Database class "' + str(cc['class']) + '" not found.')
 
 			if cc['type'] == 'sqlite':
-				conn = SqliteDatabase(conf.app_dir() + cc['path'])
-				db = klass(conn)
-				if not isinstance(db, Database):
-					raise TypeError('Database connection "' + str(name) + '" "package" not of type Database.')
+				db = self.__database(name, cc, klass, cc['path'])
+			elif cc['type'] == 'sharded_sqlite':
+				db = self.__sharded(name, cc, klass)
 			else:
 				raise RuntimeError('Database connection "' + str(name) + '" "type" value is invalid.')
 
@@ -68,8 +665,240 @@ class DatabaseManager(Service):
 
 		return self.__instances[name]
 
+	def __database(self, name, cc, klass, path):
+		"""
+		Instantiates the Database class "klass" for the file "path".
+		"""
+		db = klass(self.__sqlite(name, cc, path))
+		if not isinstance(db, Database):
+			raise TypeError('Database connection "' + str(name) + '" "package" not of type Database.')
+		if cc.get('cache') is not None:
+			db.enable_cache(**cc['cache'])
+		instrument = cc.get('instrument', {})
+		if instrument is not False:
+			db.instrument(**(instrument or {}))
+		return db
+
+	def __sharded(self, name, cc, klass):
+		"""
+		Instantiates a ShardedDatabase of "shards" Databases, "path" is
+		formatted with the shard number.
+		"""
+		if not isinstance(cc.get('shards'), int) or cc['shards'] < 1:
+			raise RuntimeError('Database connection "' + str(name) + '" must configure "shards".')
+		if '%d' not in cc['path']:
+			raise RuntimeError('Database connection "' + str(name) + '" "path" must contain "%d".')
+		key = crc32
+		if cc.has_key('key'):
+			try:
+				pkg = cc['key'].rsplit('.',1)
+				key = getattr(importlib.import_module(pkg[0]), pkg[1])
+			except (ImportError, AttributeError):
+				raise RuntimeError('Shard key "' + str(cc['key']) + '" not found.')
+		shards = [self.__database(name, cc, klass, cc['path'] % i) for i in range(cc['shards'])]
+		return ShardedDatabase(name, shards, key)
+
+	def __sqlite(self, name, cc, path):
+		"""
+		Opens a SqliteDatabase, or a SqlitePool when "pool" is configured.
+		"""
+		pool = cc.get('pool')
+		if pool is not None and not isinstance(pool, dict):
+			raise RuntimeError('Database connection "' + str(name) + '" "pool" must be a dictionary.')
+		pragmas = self.__pragmas(name, cc, pool is not None)
+		timeout = cc.get('busy_timeout', 5)
+		if pool is None:
+			return SqliteDatabase(conf.app_dir() + path, pragmas=pragmas, timeout=timeout)
+		return SqlitePool(
+			conf.app_dir() + path,
+			checkout=pool.get('checkout', True),
+			idle_timeout=pool.get('idle_timeout'),
+			max_connections=pool.get('max_connections', 8),
+			stale_timeout=pool.get('stale_timeout'),
+			timeout=pool.get('timeout', 10),
+			pragmas=pragmas,
+			busy_timeout=timeout)
+
+	def __pragmas(self, name, cc, pooled):
+		"""
+		Returns the list of PRAGMA name and value pairs of a database, from its
+		profile overridden by its own values.
+		"""
+		profile = cc.get('profile', 'default')
+		if not self.PROFILES.has_key(profile):
+			raise RuntimeError('Database connection "' + str(name) + '" "profile" value is invalid.')
+		values = dict(self.PROFILES[profile])
+		if pooled:
+			values.setdefault('journal_mode', 'wal')
+		for pragma in self.PRAGMAS:
+			if cc.has_key(pragma):
+				values[pragma] = cc[pragma]
+		for pragma, value in values.items():
+			if not isinstance(value, (int, long)) and not (isinstance(value, basestring) and re.match(r'^\w+$', value)):
+				raise RuntimeError('Database connection "' + str(name) + '" "' + pragma + '" value is invalid.')
+		return [(pragma, values[pragma]) for pragma in self.PRAGMAS if values.has_key(pragma)]
+
+	def _reconfigured(self, old, new):
+		"""
+		Retunes the opened databases whose section changed, databases not
+		opened yet use the new config when first opened.
+		"""
+		for name in sorted(diff(old, new)):
+			if not self.__instances.has_key(name):
+				continue
+			if not new.has_key(name):
+				logger.warning('Database %s removed from config, kept open until restart', name)
+				continue
+			self.__retune(name, old[name], new[name])
+
+	def __retune(self, name, old, new):
+		changed = diff(old, new)
+		fixed = changed & set(self.RESTART)
+		if (old.get('pool') is None) != (new.get('pool') is None):
+			fixed.add('pool')
+		if fixed:
+			logger.warning('Database %s, changes to %s take effect after a restart', name, ', '.join(sorted(fixed)))
+		pragmas = self.__pragmas(name, new, old.get('pool') is not None)
+		db = self.__instances[name]
+		for shard in (db.shards() if isinstance(db, ShardedDatabase) else [db]):
+			pw = shard.get()
+			if changed & set(self.PRAGMAS + ('profile',)):
+				pw._pragmas = pragmas
+			if 'busy_timeout' in changed:
+				pw._timeout = new.get('busy_timeout', 5)
+			if 'pool' in changed and 'pool' not in fixed:
+				pool = new['pool']
+				pw.configure(
+					pool.get('max_connections', 8), pool.get('idle_timeout'),
+					pool.get('stale_timeout'), pool.get('timeout', 10))
+			if 'cache' in changed:
+				if new.get('cache') is None:
+					shard.disable_cache()
+				else:
+					shard.enable_cache(**new['cache'])
+			if 'instrument' in changed:
+				# A removed section falls back to the default, instrumented
+				instrument = new.get('instrument', {})
+				if instrument is False:
+					shard.uninstrument()
+				else:
+					shard.instrument(**(instrument or {}))
+		logger.info('Database %s reconfigured: %s', name, ', '.join(sorted(changed - fixed)))
+
 	def get(self, name):
+		if self.__instances.has_key(name):
+			# Also when removed from a reloaded config, it's kept open
+			return self.__instances[name]
 		if not self._config().has_key(name):
 			raise RuntimeError('Database connection "' + str(name) + '" not configured.')
 		else:
 			return self.__instantiate(name)
+
+	def open(self, names = None, parallel = False):
+		"""
+		Opens databases ahead of their first use and runs their "warmup"
+		statements, see Database.warm(). Returns a dictionary with the seconds
+		spent per database.
+		names		List of database names, defaults to all configured
+		parallel	Open the pooled databases in concurrent threads, the
+					others are opened on the calling thread which keeps their
+					connections
+		"""
+		if names is None:
+			names = sorted(self._config().keys())
+		timings = {}
+		def shards(name):
+			db = self.get(name)
+			return db.shards() if isinstance(db, ShardedDatabase) else [db]
+		def warm(name):
+			warmup = self._config().get(name, {}).get('warmup') or ()
+			timings[name] = sum(shard.warm(warmup) for shard in shards(name))
+			logger.info('Opened database %s in %.3fs', name, timings[name])
+		if not parallel:
+			for name in names:
+				warm(name)
+			return timings
+		errors = []
+		def run(name):
+			try:
+				warm(name)
+			except Exception:
+				logger.error('Opening database %s failed', name, exc_info=True)
+				errors.append(name)
+			finally:
+				# Pooled connections are per thread, hand them back before
+				# it exits
+				for shard in shards(name):
+					if not shard.get().is_closed():
+						shard.get().close()
+		pooled = [name for name in names if all(isinstance(shard.get(), SqlitePool) for shard in shards(name))]
+		threads = [threading.Thread(target=run, args=(name,)) for name in pooled]
+		for thread in threads:
+			thread.start()
+		try:
+			for name in names:
+				if name not in pooled:
+					warm(name)
+		finally:
+			for thread in threads:
+				thread.join()
+		if errors:
+			raise RuntimeError('Opening databases "' + '", "'.join(sorted(errors)) + '" failed.')
+		return timings
+
+	def queries(self, name, n = 10, by = 'total'):
+		"""
+		Returns the top "n" statements of a database by "by", see
+		QueryStats.top(). The statements of the shards of a sharded database
+		are listed per shard.
+		"""
+		db = self.get(name)
+		if isinstance(db, ShardedDatabase):
+			return [shard.queries(n, by) for shard in db.shards()]
+		return db.queries(n, by)
+
+	def bulk(self, name):
+		"""
+		Returns a Bulk loader and dumper for a database.
+		"""
+		db = self.get(name)
+		if isinstance(db, ShardedDatabase):
+			raise RuntimeError('Database connection "' + str(name) + '" is sharded, load the shards.')
+		return Bulk(db)
+
+	def jobs(self, name):
+		"""
+		Returns the JobQueue stored in a database. Configured by the optional
+		"jobs" section of the database, with "table", "visibility",
+		"max_attempts", "backoff" and "max_backoff", see JobQueue.
+		"""
+		with self.__lock:
+			if not self.__jobs.has_key(name):
+				db = self.get(name)
+				if isinstance(db, ShardedDatabase):
+					raise RuntimeError('Database connection "' + str(name) + '" is sharded, it has no job queue.')
+				self.__jobs[name] = JobQueue(db, **(self._config().get(name, {}).get('jobs') or {}))
+			return self.__jobs[name]
+
+	def writer(self, name):
+		"""
+		Returns the Writer task of a database, set up with the TaskManager on
+		first use. Configured by the optional "writer" section of the
+		database, with "max_batch", "max_delay" and "queue_size".
+		"""
+		if self.__task_manager is None:
+			raise RuntimeError('DatabaseManager has no TaskManager to run writers.')
+		with self.__lock:
+			if not self.__writers.has_key(name):
+				db = self.get(name)
+				if isinstance(db, ShardedDatabase):
+					raise RuntimeError('Database connection "' + str(name) + '" is sharded, it has no writer.')
+				cc = self._config().get(name, {}).get('writer') or {}
+				tm = self.__task_manager
+				channel = tm.channel(Writer.NAME + '.' + name, cc.get('queue_size', 10000))
+				writer = Writer(
+					Writer.NAME + '.' + name, tm.get_signal(), db, channel,
+					cc.get('max_batch', 500), cc.get('max_delay', 0.01))
+				tm.setup(writer, tags=[Writer.NAME])
+				self.__writers[name] = writer
+			return self.__writers[name]
@@ -0,0 +1,299 @@
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from .common import logger
+
+"""
+The events.py module containes the EventLog class, an append-only log of
+structured business events stored in segment files with a sparse time index
+for reading time ranges.
+"""
+
+class EventLog:
+	"""
+	EventLog appends events as JSON lines to segment files in a directory.
+	Every segment has an index file with the time and offset of an event
+	about every "index_interval" bytes, so a reader finds the start of a
+	time range by binary search and reads on from there through a memory
+	map. A new segment is started when the current one reaches
+	"segment_bytes".
+
+	Event times never decrease, an event appended with an earlier time than
+	the last one is rejected, events without a time get the current time or
+	the time of the last event if the clock went back.
+
+	Usage:
+		log.append('order', {'id': 42})
+		for event in log.query(start, end, types=['order']):
+			...
+	"""
+	NAME = 'EventLog'
+	INDEX = struct.Struct('<dQ')
+	SEGMENT = re.compile(r'^(\d{8})\.jsonl$')
+	def __init__(self, path, segment_bytes = 64 * 1024 * 1024, index_interval = 64 * 1024):
+		"""
+		path			Directory of the segment files, created if missing
+		segment_bytes	Size at which a new segment is started
+		index_interval	Bytes between the events recorded in the index
+		"""
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		self.__path = path
+		self.__segment_bytes = segment_bytes
+		self.__index_interval = index_interval
+		self.__lock = threading.Lock()
+		self.__indexes = {}
+		self.__data = None
+		self.__index = None
+		self.__number = None
+		self.__last = 0
+		segments = self.segments()
+		while len(segments) > 1 and not os.path.getsize(self.__file(segments[-1], 'jsonl')):
+			# Started but never written to, the previous segment continues
+			for ext in ('jsonl', 'idx'):
+				if os.path.exists(self.__file(segments[-1], ext)):
+					os.remove(self.__file(segments[-1], ext))
+			segments.pop()
+		self.__open(segments[-1] if segments else 0)
+
+	def segments(self):
+		"""
+		Returns the sorted list of segment numbers.
+		"""
+		numbers = []
+		for name in os.listdir(self.__path):
+			match = self.SEGMENT.match(name)
+			if match:
+				numbers.append(int(match.group(1)))
+		return sorted(numbers)
+
+	def append(self, type, data = None, ts = None):
+		"""
+		Appends an event and returns its time.
+		type	A string with the event type
+		data	JSON serializable event data
+		ts		Event time in seconds since the epoch, defaults to now
+		"""
+		return self.append_many([(type, data, ts)])[-1]
+
+	def append_many(self, events):
+		"""
+		Appends several events with one write and returns the list of their
+		times.
+		events	A list of (type, data) or (type, data, ts) tuples
+		"""
+		with self.__lock:
+			if self.__data is None:
+				raise RuntimeError('EventLog closed')
+			last = self.__last
+			lines = []
+			for event in events:
+				ts = event[2] if len(event) > 2 else None
+				if ts is None:
+					ts = max(time.time(), last)
+				elif ts < last:
+					raise ValueError('Event time %f before the last event %f' % (ts, last))
+				last = ts
+				line = json.dumps({'ts': ts, 'type': event[0], 'data': event[1]}, separators=(',', ':'))
+				lines.append((ts, line + '\n'))
+			chunk = []
+			for ts, line in lines:
+				if self.__size >= self.__segment_bytes:
+					self.__data.write(''.join(chunk))
+					chunk = []
+					self.__open(self.__number + 1)
+				if not self.__offsets or self.__size - self.__offsets[-1] >= self.__index_interval:
+					self.__times.append(ts)
+					self.__offsets.append(self.__size)
+					self.__index.write(self.INDEX.pack(ts, self.__size))
+				chunk.append(line)
+				self.__size += len(line)
+				self.__last = ts
+			self.__data.write(''.join(chunk))
+			return [ts for ts, line in lines]
+
+	def flush(self, sync = False):
+		"""
+		Writes the buffered events to the segment file.
+		sync	Also sync the file to disk
+		"""
+		with self.__lock:
+			if self.__data is None:
+				return
+			self.__data.flush()
+			self.__index.flush()
+			if sync:
+				os.fsync(self.__data.fileno())
+				os.fsync(self.__index.fileno())
+
+	def close(self):
+		"""
+		Flushes and closes the current segment.
+		"""
+		self.flush(True)
+		with self.__lock:
+			if self.__data is not None:
+				self.__data.close()
+				self.__index.close()
+				self.__data = None
+				self.__index = None
+
+	def query(self, start = None, end = None, types = None):
+		"""
+		Returns a generator of the events with a time from "start" up to but
+		not including "end", as dictionaries with "ts", "type" and "data".
+		start	Start time, None reads from the first event
+		end		End time, None reads to the last event
+		types	A list of event types to return, None returns all
+		"""
+		self.flush()
+		if types is not None:
+			types = frozenset(types)
+		numbers = self.segments()
+		firsts = []
+		for number in numbers:
+			times = self.__read_index(number)[0]
+			firsts.append(times[0] if times else None)
+		for i, number in enumerate(numbers):
+			if firsts[i] is None:
+				continue
+			if end is not None and firsts[i] >= end:
+				break
+			following = [t for t in firsts[i + 1:] if t is not None]
+			if start is not None and following and following[0] < start:
+				continue
+			for event in self.__scan(number, start, end, types):
+				if event is None:
+					return
+				yield event
+
+	def prune(self, before):
+		"""
+		Removes the segments holding only events older than "before", returns
+		the number of removed segments. The current segment is kept.
+		"""
+		removed = 0
+		numbers = self.segments()
+		for number, following in zip(numbers, numbers[1:]):
+			times = self.__read_index(following)[0]
+			if number == self.__number or not times or times[0] >= before:
+				break
+			with self.__lock:
+				self.__indexes.pop(number, None)
+			os.remove(self.__file(number, 'jsonl'))
+			if os.path.exists(self.__file(number, 'idx')):
+				os.remove(self.__file(number, 'idx'))
+			removed += 1
+		if removed:
+			logger.info('Pruned %d event log segments before %f', removed, before)
+		return removed
+
+	def __file(self, number, ext):
+		return os.path.join(self.__path, '%08d.%s' % (number, ext))
+
+	def __open(self, number):
+		"""
+		Opens segment "number" for appending, rebuilding the index entries
+		lost in a crash and cutting a partly written last event.
+		"""
+		if self.__data is not None:
+			self.__data.close()
+			self.__index.close()
+			with open(self.__file(self.__number, 'idx'), 'rb') as f:
+				self.__indexes[self.__number] = self.__parse(f.read())
+		path = self.__file(number, 'jsonl')
+		size = os.path.getsize(path) if os.path.exists(path) else 0
+		times, offsets = [], []
+		if os.path.exists(self.__file(number, 'idx')):
+			with open(self.__file(number, 'idx'), 'rb') as f:
+				times, offsets = self.__parse(f.read())
+		while offsets and offsets[-1] >= size:
+			times.pop()
+			offsets.pop()
+		last = self.__last
+		pos = offsets[-1] if offsets else 0
+		if pos < size:
+			with open(path, 'rb') as f:
+				f.seek(pos)
+				for line in f:
+					if not line.endswith('\n'):
+						break
+					last = json.loads(line)['ts']
+					if not offsets or pos - offsets[-1] >= self.__index_interval:
+						times.append(last)
+						offsets.append(pos)
+					pos += len(line)
+			if pos < size:
+				logger.warning('Event log segment %s cut from %d to %d bytes', path, size, pos)
+				with open(path, 'r+b') as f:
+					f.truncate(pos)
+				size = pos
+		with open(self.__file(number, 'idx'), 'wb') as f:
+			f.write(''.join(self.INDEX.pack(t, o) for t, o in zip(times, offsets)))
+		self.__number = number
+		self.__times = times
+		self.__offsets = offsets
+		self.__size = size
+		self.__last = last
+		self.__data = open(path, 'ab')
+		self.__index = open(self.__file(number, 'idx'), 'ab')
+
+	def __parse(self, raw):
+		times, offsets = [], []
+		for i in range(0, len(raw) - len(raw) % self.INDEX.size, self.INDEX.size):
+			t, o = self.INDEX.unpack_from(raw, i)
+			times.append(t)
+			offsets.append(o)
+		return times, offsets
+
+	def __read_index(self, number):
+		"""
+		Returns the times and offsets of the index of a segment, cached for
+		all but the current segment.
+		"""
+		with self.__lock:
+			if number == self.__number:
+				return list(self.__times), list(self.__offsets)
+			if not self.__indexes.has_key(number):
+				with open(self.__file(number, 'idx'), 'rb') as f:
+					self.__indexes[number] = self.__parse(f.read())
+			return self.__indexes[number]
+
+	def __scan(self, number, start, end, types):
+		"""
+		Generates the events of a segment from "start", seeking with the
+		index, and None once an event reaches "end".
+		"""
+		times, offsets = self.__read_index(number)
+		pos = 0
+		if start is not None:
+			i = bisect.bisect_left(times, start)
+			if i > 0:
+				pos = offsets[i - 1]
+		with open(self.__file(number, 'jsonl'), 'rb') as f:
+			if os.fstat(f.fileno()).st_size == 0:
+				return
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				size = len(data)
+				while pos < size:
+					stop = data.find('\n', pos)
+					if stop < 0:
+						break
+					event = json.loads(data[pos:stop])
+					pos = stop + 1
+					if start is not None and event['ts'] < start:
+						continue
+					if end is not None and event['ts'] >= end:
+						yield None
+						return
+					if types is None or event['type'] in types:
+						yield event
+			finally:
+				data.close()
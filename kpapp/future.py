@@ -0,0 +1,103 @@
+import sys
+import threading
+
+"""
+The future.py module containes the Future class, a placeholder for a result
+that is produced by another thread.
+"""
+
+class TimeoutError(RuntimeError):
+	"""
+	Raised when waiting for a Future times out.
+	"""
+	pass
+
+class Future:
+	"""
+	Future holds the result or exception of a unit of work that is executed
+	asynchronously, for instance by a TaskGroup worker.
+	"""
+	def __init__(self):
+		self.__cond = threading.Condition()
+		self.__done = False
+		self.__result = None
+		self.__exc_info = None
+		self.__callbacks = []
+
+	def done(self):
+		"""
+		Returns True if a result or exception has been set.
+		"""
+		return self.__done
+
+	def set_result(self, result):
+		"""
+		Sets the result and wakes up waiting threads.
+		"""
+		self.__finish(result, None)
+
+	def set_exception(self, exc_info = None):
+		"""
+		Sets the exception and wakes up waiting threads.
+		exc_info	A sys.exc_info() tuple or an exception instance, defaults
+					to the exception currently being handled
+		"""
+		if exc_info is None:
+			exc_info = sys.exc_info()
+		elif isinstance(exc_info, BaseException):
+			exc_info = (type(exc_info), exc_info, None)
+		self.__finish(None, exc_info)
+
+	def result(self, timeout = None):
+		"""
+		Waits for and returns the result, or raises the exception.
+		timeout		Seconds to wait, None waits forever
+		"""
+		self.__wait(timeout)
+		if self.__exc_info is not None:
+			raise self.__exc_info[0], self.__exc_info[1], self.__exc_info[2]
+		return self.__result
+
+	def exception(self, timeout = None):
+		"""
+		Waits for and returns the exception, or None on success.
+		timeout		Seconds to wait, None waits forever
+		"""
+		self.__wait(timeout)
+		if self.__exc_info is not None:
+			return self.__exc_info[1]
+		return None
+
+	def add_done_callback(self, fn):
+		"""
+		Registers a callable that is called with the Future when it is done.
+		If already done the callable is called immediately.
+		"""
+		with self.__cond:
+			if not self.__done:
+				self.__callbacks.append(fn)
+				return
+		fn(self)
+
+	def __wait(self, timeout):
+		with self.__cond:
+			if timeout is None:
+				while not self.__done:
+					self.__cond.wait()
+			elif not self.__done:
+				self.__cond.wait(timeout)
+			if not self.__done:
+				raise TimeoutError('Future not done within timeout')
+
+	def __finish(self, result, exc_info):
+		with self.__cond:
+			if self.__done:
+				raise RuntimeError('Future already done')
+			self.__result = result
+			self.__exc_info = exc_info
+			self.__done = True
+			callbacks = self.__callbacks
+			self.__callbacks = []
+			self.__cond.notify_all()
+		for fn in callbacks:
+			fn(self)
@@ -0,0 +1,228 @@
+import collections
+import json
+import re
+import time
+
+from .common import logger
+
+"""
+The jobs.py module containes the JobQueue class, a durable job queue stored
+in a table of a Database, so queued work survives restarts.
+"""
+
+Job = collections.namedtuple('Job', 'id payload priority attempts')
+
+class JobQueue:
+	"""
+	JobQueue keeps jobs in a table of a Database. Jobs are enqueued and
+	claimed in batches, a claimed job is invisible to other claims for the
+	visibility timeout and has to be acknowledged with ack() before it runs
+	out, otherwise it is claimed again. Failed jobs are retried with
+	exponential backoff until "max_attempts" is reached and then moved to the
+	dead letter, where dead() lists them and requeue() revives them.
+
+	Jobs with a higher priority are claimed first, jobs of equal priority in
+	enqueue order. Payloads must be JSON serializable.
+	"""
+	READY = 0
+	DEAD = 1
+	def __init__(self, db, table = 'jobs', visibility = 30, max_attempts = 5, backoff = 1, max_backoff = 300):
+		"""
+		db				The Database to store the jobs in
+		table			Name of the job table, created if missing
+		visibility		Seconds a claimed job is invisible to other claims
+		max_attempts	Number of claims before a job is dead lettered
+		backoff			Seconds before the first retry, doubled per attempt
+		max_backoff		Maximum seconds between retries
+		"""
+		if not re.match(r'^\w+$', table):
+			raise ValueError('table must be a plain name')
+		if max_attempts < 1:
+			raise ValueError('max_attempts must be at least 1')
+		self.__db = db
+		self.__table = table
+		self.__visibility = visibility
+		self.__max_attempts = max_attempts
+		self.__backoff = backoff
+		self.__max_backoff = max_backoff
+		with db.atomic() as conn:
+			conn.execute_sql(
+				'CREATE TABLE IF NOT EXISTS "%s" ('
+				'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+				'payload TEXT NOT NULL, '
+				'priority INTEGER NOT NULL DEFAULT 0, '
+				'attempts INTEGER NOT NULL DEFAULT 0, '
+				'state INTEGER NOT NULL DEFAULT 0, '
+				'leased INTEGER NOT NULL DEFAULT 0, '
+				'available REAL NOT NULL, '
+				'created REAL NOT NULL, '
+				'error TEXT)' % table)
+			conn.execute_sql(
+				'CREATE INDEX IF NOT EXISTS "%s_claim" ON "%s" (state, priority DESC, available, id)' % (table, table))
+
+	def name(self):
+		"""
+		Returns the name of the job table.
+		"""
+		return self.__table
+
+	def put(self, payload, priority = 0, delay = 0):
+		"""
+		Enqueues a job and returns its id.
+		delay	Seconds before the job can be claimed
+		"""
+		now = time.time()
+		with self.__db.atomic() as conn:
+			cursor = conn.execute_sql(
+				'INSERT INTO "%s" (payload, priority, available, created) VALUES (?, ?, ?, ?)' % self.__table,
+				(json.dumps(payload), priority, now + delay, now))
+			return cursor.lastrowid
+
+	def put_many(self, payloads, priority = 0, delay = 0):
+		"""
+		Enqueues several jobs in one transaction and returns their number.
+		"""
+		now = time.time()
+		rows = [(json.dumps(payload), priority, now + delay, now) for payload in payloads]
+		if not rows:
+			return 0
+		sql = 'INSERT INTO "%s" (payload, priority, available, created) VALUES (?, ?, ?, ?)' % self.__table
+		with self.__db.atomic() as conn:
+			self.__db.invalidate(sql)
+			conn.cursor().executemany(sql, rows)
+		return len(rows)
+
+	def claim(self, n = 100, visibility = None):
+		"""
+		Claims up to "n" visible jobs in one transaction and returns them as
+		a list of Job tuples, highest priority first. Jobs whose visibility
+		timeout ran out on their last attempt are dead lettered instead.
+		visibility	Seconds the jobs are invisible, defaults to the queue
+					visibility timeout
+		"""
+		if visibility is None:
+			visibility = self.__visibility
+		now = time.time()
+		with self.__db.write() as conn:
+			# IMMEDIATE keeps other processes from claiming the same jobs
+			with conn.atomic(lock_type='IMMEDIATE'):
+				rows = conn.execute_sql(
+					'SELECT id, payload, priority, attempts FROM "%s" '
+					'WHERE state = ? AND available <= ? '
+					'ORDER BY priority DESC, available, id LIMIT ?' % self.__table,
+					(self.READY, now, n)).fetchall()
+				expired = [row[0] for row in rows if row[3] >= self.__max_attempts]
+				jobs = [Job(row[0], json.loads(row[1]), row[2], row[3] + 1) for row in rows if row[3] < self.__max_attempts]
+				if expired:
+					self.__update(conn,
+						'UPDATE "%s" SET state = ?, leased = 0, error = ? WHERE id IN (%s)',
+						(self.DEAD, 'Visibility timeout expired'), expired)
+				if jobs:
+					self.__update(conn,
+						'UPDATE "%s" SET attempts = attempts + 1, leased = 1, available = ? WHERE id IN (%s)',
+						(now + visibility,), [job.id for job in jobs])
+		if expired:
+			logger.warning('Job queue %s, dead lettered %d expired jobs', self.__table, len(expired))
+		return jobs
+
+	def ack(self, jobs):
+		"""
+		Removes finished jobs, returns the number removed. A job claimed again
+		after its visibility timeout ran out is not removed by a stale ack.
+		"""
+		rows = [(job.id, job.attempts) for job in jobs]
+		if not rows:
+			return 0
+		sql = 'DELETE FROM "%s" WHERE id = ? AND attempts = ?' % self.__table
+		with self.__db.atomic() as conn:
+			cursor = conn.cursor()
+			cursor.executemany(sql, rows)
+			self.__db.invalidate(sql)
+			return cursor.rowcount
+
+	def nack(self, jobs, error = None, delay = None):
+		"""
+		Returns failed jobs to the queue to be retried after the backoff, or
+		moves them to the dead letter after their last attempt. Returns the
+		number of dead lettered jobs.
+		error	A string describing the failure, kept with the job
+		delay	Seconds before the retry, defaults to the backoff
+		"""
+		now = time.time()
+		retry = []
+		dead = []
+		for job in jobs:
+			if job.attempts >= self.__max_attempts:
+				dead.append((self.DEAD, error, job.id, job.attempts))
+			else:
+				wait = delay
+				if wait is None:
+					wait = min(self.__backoff * 2 ** (job.attempts - 1), self.__max_backoff)
+				retry.append((now + wait, error, job.id, job.attempts))
+		with self.__db.atomic() as conn:
+			cursor = conn.cursor()
+			if retry:
+				cursor.executemany(
+					'UPDATE "%s" SET leased = 0, available = ?, error = ? WHERE id = ? AND attempts = ?' % self.__table,
+					retry)
+			if dead:
+				cursor.executemany(
+					'UPDATE "%s" SET leased = 0, state = ?, error = ? WHERE id = ? AND attempts = ?' % self.__table,
+					dead)
+			self.__db.invalidate('UPDATE "%s"' % self.__table)
+		if dead:
+			logger.warning('Job queue %s, dead lettered %d jobs: %s', self.__table, len(dead), error)
+		return len(dead)
+
+	def dead(self, n = 100):
+		"""
+		Returns up to "n" dead lettered jobs as a list of dictionaries with
+		the job, its last error and its creation time, oldest first.
+		"""
+		rows = self.__db.select(
+			'SELECT id, payload, priority, attempts, error, created FROM "%s" '
+			'WHERE state = ? ORDER BY id LIMIT ?' % self.__table, (self.DEAD, n))
+		return [{
+			'job': Job(row[0], json.loads(row[1]), row[2], row[3]),
+			'error': row[4],
+			'created': row[5],
+		} for row in rows]
+
+	def requeue(self, ids = None):
+		"""
+		Moves dead lettered jobs back to the queue with their attempts reset,
+		all of them when "ids" is None. Returns the number of requeued jobs.
+		"""
+		sql = 'UPDATE "%s" SET state = ?, attempts = 0, leased = 0, available = ?, error = NULL WHERE state = ?' % self.__table
+		params = (self.READY, time.time(), self.DEAD)
+		with self.__db.atomic() as conn:
+			if ids is None:
+				return conn.execute_sql(sql, params).rowcount
+			cursor = conn.cursor()
+			cursor.executemany(sql + ' AND id = ?', [params + (i,) for i in ids])
+			self.__db.invalidate(sql)
+			return cursor.rowcount
+
+	def stats(self):
+		"""
+		Returns a dictionary with the number of ready, delayed, claimed and
+		dead jobs.
+		"""
+		now = time.time()
+		row = self.__db.select(
+			'SELECT '
+			'COALESCE(SUM(state = ? AND available <= ?), 0), '
+			'COALESCE(SUM(state = ? AND available > ? AND leased = 0), 0), '
+			'COALESCE(SUM(state = ? AND available > ? AND leased = 1), 0), '
+			'COALESCE(SUM(state = ?), 0) FROM "%s"' % self.__table,
+			(self.READY, now, self.READY, now, self.READY, now, self.DEAD))[0]
+		return {'ready': row[0], 'delayed': row[1], 'claimed': row[2], 'dead': row[3]}
+
+	def __update(self, conn, sql, params, ids):
+		"""
+		Runs an UPDATE for a list of ids, in chunks below the SQLite limit of
+		bound parameters.
+		"""
+		for i in range(0, len(ids), 500):
+			chunk = ids[i:i + 500]
+			conn.execute_sql(sql % (self.__table, ', '.join(['?'] * len(chunk))), params + tuple(chunk))
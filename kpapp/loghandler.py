@@ -0,0 +1,246 @@
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+import weakref
+
+from .channel import Channel, ChannelClosed
+
+"""
+The loghandler.py module containes the AsyncFileHandler class that writes log
+records to file from a thread of its own, and helpers to swap it in for the
+FileHandlers of the app and biz loggers.
+"""
+
+_handlers = weakref.WeakSet()
+
+class AsyncFileHandler(logging.Handler):
+	"""
+	AsyncFileHandler queues log records on a bounded Channel and a writer
+	thread formats and writes them to file in batches, so logging on a hot
+	path costs an enqueue instead of a disk write. When the buffer is full
+	the overflow policy decides, see Channel.POLICIES except "coalesce".
+
+	The file is rotated when it grows beyond "max_bytes" or every "interval"
+	seconds. Rotated files are renamed with a number suffix, ".1" being the
+	newest, and optionally compressed with gzip.
+	"""
+	POLL = 0.05
+	def __init__(self, filename, mode = 'a', buffer = 10000, overflow = 'drop_oldest', batch = 500,
+			max_bytes = 0, interval = 0, backup_count = 5, compress = False):
+		"""
+		filename		Path to the log file
+		mode			Mode the log file is opened with
+		buffer			Maximum number of queued records, 0 is unbounded
+		overflow		"block", "drop" or "drop_oldest" records when full
+		batch			Maximum number of records written at once
+		max_bytes		Rotate when the file grows beyond, 0 disables
+		interval		Rotate every so many seconds, 0 disables
+		backup_count	Number of rotated files to keep
+		compress		Compress rotated files with gzip
+		"""
+		logging.Handler.__init__(self)
+		if overflow not in ('block', 'drop', 'drop_oldest'):
+			raise ValueError('overflow must be "block", "drop" or "drop_oldest"')
+		self.baseFilename = os.path.abspath(filename)
+		self.__mode = mode
+		self.__batch = batch
+		self.__max_bytes = max_bytes
+		self.__interval = interval
+		self.__backup_count = backup_count
+		self.__compress = compress
+		self.__channel = Channel('log:' + self.baseFilename, buffer, overflow)
+		self.__waiters = []
+		self.__waiters_lock = threading.Lock()
+		self.__stream = None
+		self.__rollover = None
+		self.__written = 0
+		self.__rotations = 0
+		self.__thread = threading.Thread(target=self.__run, name='AsyncFileHandler')
+		self.__thread.daemon = True
+		self.__thread.start()
+		_handlers.add(self)
+
+	def emit(self, record):
+		"""
+		Queues a record, the message is rendered now since the arguments may
+		change before the writer thread gets to it.
+		"""
+		try:
+			record.msg = record.getMessage()
+			record.args = None
+			self.__channel.put(record)
+		except ChannelClosed:
+			pass
+		except Exception:
+			self.handleError(record)
+
+	def flush(self, timeout = 5):
+		"""
+		Waits until the records queued so far are written.
+		timeout		Seconds to wait, None waits forever
+		"""
+		if not self.__thread.is_alive() or threading.current_thread() is self.__thread:
+			return
+		event = threading.Event()
+		with self.__waiters_lock:
+			self.__waiters.append(event)
+		event.wait(timeout)
+
+	def close(self):
+		"""
+		Writes the queued records, stops the writer thread and closes the
+		file.
+		"""
+		self.__channel.close()
+		if threading.current_thread() is not self.__thread:
+			self.__thread.join(10)
+		logging.Handler.close(self)
+
+	def stats(self):
+		"""
+		Returns a dictionary with the number of queued, dropped and written
+		records and the number of rotations.
+		"""
+		stats = self.__channel.stats()
+		return {
+			'queued': stats['queued'],
+			'dropped': stats['dropped'],
+			'written': self.__written,
+			'rotations': self.__rotations,
+		}
+
+	def __run(self):
+		"""
+		The writer thread, writes batches of records until the Channel is
+		closed and empty.
+		"""
+		try:
+			while True:
+				try:
+					records = self.__channel.get_batch(self.__batch, self.POLL)
+				except ChannelClosed:
+					break
+				if records:
+					self.__write(records)
+				if not self.__channel.qsize():
+					self.__wake()
+		finally:
+			if self.__stream is not None:
+				self.__stream.close()
+				self.__stream = None
+			self.__wake()
+
+	def __write(self, records):
+		if self.__stream is None:
+			try:
+				self.__open()
+			except Exception:
+				self.handleError(records[0])
+				return
+		lines = []
+		for record in records:
+			try:
+				lines.append(self.format(record) + '\n')
+			except Exception:
+				self.handleError(record)
+		data = ''.join(line.encode('utf-8') if isinstance(line, unicode) else line for line in lines)
+		try:
+			self.__stream.write(data)
+			self.__stream.flush()
+		except Exception:
+			self.handleError(records[-1])
+		self.__written += len(lines)
+		if self.__max_bytes and self.__stream.tell() >= self.__max_bytes:
+			self.__rotate()
+		elif self.__rollover is not None and time.time() >= self.__rollover:
+			self.__rotate()
+
+	def __open(self):
+		path = os.path.dirname(self.baseFilename)
+		if not os.path.isdir(path):
+			try:
+				os.makedirs(path)
+			except OSError:
+				if not os.path.isdir(path):
+					raise
+		self.__stream = open(self.baseFilename, self.__mode)
+		self.__stream.seek(0, os.SEEK_END)
+		if self.__interval:
+			self.__rollover = time.time() + self.__interval
+
+	def __rotate(self):
+		"""
+		Renames the log file to the first backup, shifting the older backups,
+		and reopens it.
+		"""
+		self.__stream.close()
+		self.__stream = None
+		suffix = '.gz' if self.__compress else ''
+		name = lambda i: '%s.%d%s' % (self.baseFilename, i, suffix)
+		if self.__backup_count < 1:
+			os.remove(self.baseFilename)
+		else:
+			if os.path.exists(name(self.__backup_count)):
+				os.remove(name(self.__backup_count))
+			for i in range(self.__backup_count - 1, 0, -1):
+				if os.path.exists(name(i)):
+					os.rename(name(i), name(i + 1))
+			if self.__compress:
+				with open(self.baseFilename, 'rb') as src:
+					with gzip.open(name(1) + '.tmp', 'wb') as dst:
+						shutil.copyfileobj(src, dst)
+				os.rename(name(1) + '.tmp', name(1))
+				os.remove(self.baseFilename)
+			else:
+				os.rename(self.baseFilename, name(1))
+		self.__rotations += 1
+		self.__open()
+
+	def __wake(self):
+		with self.__waiters_lock:
+			waiters, self.__waiters = self.__waiters, []
+		for event in waiters:
+			event.set()
+
+def install(logger, config = {}):
+	"""
+	Replaces the FileHandlers of a logger with AsyncFileHandlers writing to
+	the same files, returns a list of (old, new) handler pairs for
+	uninstall().
+	config		Dictionary with AsyncFileHandler arguments
+	"""
+	pairs = []
+	for old in list(logger.handlers):
+		if not isinstance(old, logging.FileHandler):
+			continue
+		new = AsyncFileHandler(old.baseFilename, **config)
+		new.setFormatter(old.formatter)
+		new.setLevel(old.level)
+		logger.addHandler(new)
+		logger.removeHandler(old)
+		old.close()
+		pairs.append((old, new))
+	return pairs
+
+def uninstall(logger, pairs):
+	"""
+	Closes the AsyncFileHandlers installed by install(), after writing their
+	queued records, and puts FileHandlers for the same files back.
+	"""
+	for old, new in pairs:
+		logger.removeHandler(new)
+		new.close()
+		hdlr = type(old)(old.baseFilename, mode=old.mode)
+		hdlr.setFormatter(old.formatter)
+		hdlr.setLevel(old.level)
+		logger.addHandler(hdlr)
+
+def flush(timeout = 5):
+	"""
+	Waits until all AsyncFileHandlers wrote their queued records.
+	"""
+	for handler in list(_handlers):
+		handler.flush(timeout)
@@ -0,0 +1,245 @@
+import collections
+import heapq
+import itertools
+import sys
+import threading
+import time
+import types
+
+from .common import logger
+from .future import Future
+
+"""
+The loop.py module containes the EventLoop class, a lightweight generator
+based coroutine scheduler used by the TaskManager to run AsyncTasks without a
+thread per task.
+"""
+
+class Return(Exception):
+	"""
+	Raised inside a coroutine to return a value, as Python 2 generators can't
+	return values.
+	"""
+	def __init__(self, value = None):
+		Exception.__init__(self)
+		self.value = value
+
+class _Coroutine:
+	"""
+	_Coroutine drives one generator on the EventLoop. The generator may yield
+	None to let other coroutines run, a number of seconds to sleep, a Future
+	or another generator to wait for. Sleeps are resumed with True if the
+	deadline was reached and False if interrupted.
+	"""
+	def __init__(self, loop, gen, future):
+		self.__loop = loop
+		self.__gen = gen
+		self.__future = future
+
+	def step(self, value = None, exc_info = None):
+		try:
+			if exc_info is not None:
+				yielded = self.__gen.throw(*exc_info)
+			else:
+				yielded = self.__gen.send(value)
+		except StopIteration:
+			self.__future.set_result(None)
+			return
+		except Return as r:
+			self.__future.set_result(r.value)
+			return
+		except Exception:
+			self.__future.set_exception()
+			return
+
+		if yielded is None:
+			self.__loop.call_soon(self.step)
+		elif isinstance(yielded, (int, long, float)):
+			self.__wait(self.__loop.sleep(time.time() + yielded))
+		elif isinstance(yielded, Future):
+			self.__wait(yielded)
+		elif isinstance(yielded, types.GeneratorType):
+			self.__wait(self.__loop.spawn(yielded))
+		else:
+			error = TypeError('Coroutine yielded unsupported value: ' + repr(yielded))
+			self.__loop.call_soon(self.step, None, (TypeError, error, None))
+
+	def __wait(self, future):
+		future.add_done_callback(lambda f: self.__loop.call_soon(self.__resume, f))
+
+	def __resume(self, future):
+		try:
+			value = future.result(0)
+		except Exception:
+			self.step(None, sys.exc_info())
+		else:
+			self.step(value)
+
+class EventLoop:
+	"""
+	EventLoop runs callbacks and coroutines in one thread. All public methods
+	are thread safe, which makes the loop a bridge between threaded Tasks and
+	coroutines: threads spawn coroutines and wait on the returned Future,
+	coroutines yield the Futures of a TaskGroup.
+	"""
+	def __init__(self, name = 'EventLoop'):
+		"""
+		name	A string with the name of the loop thread
+		"""
+		self.__name = name
+		self.__ready = collections.deque()
+		self.__timers = []
+		self.__parked = []
+		self.__seq = itertools.count()
+		self.__cond = threading.Condition()
+		self.__thread = None
+		self.__stopped = False
+
+	def start(self):
+		"""
+		Starts the loop thread, does nothing if already running.
+		"""
+		with self.__cond:
+			if self.__thread is not None:
+				return
+			self.__stopped = False
+			self.__thread = threading.Thread(target=self.__loop, name=self.__name)
+			self.__thread.daemon = True
+			self.__thread.start()
+
+	def stop(self):
+		"""
+		Stops the loop thread after running the ready callbacks. Pending
+		timers and coroutines are dropped.
+		"""
+		with self.__cond:
+			thread = self.__thread
+			self.__stopped = True
+			self.__cond.notify()
+		if thread is not None and thread is not threading.current_thread():
+			thread.join()
+		self.__thread = None
+
+	def running(self):
+		"""
+		Returns True if the loop thread is running.
+		"""
+		return self.__thread is not None and self.__thread.is_alive()
+
+	def call_soon(self, fn, *args):
+		"""
+		Schedules fn(*args) to be called in the loop thread.
+		"""
+		with self.__cond:
+			self.__ready.append((fn, args))
+			self.__cond.notify()
+
+	def call_at(self, deadline, fn, *args):
+		"""
+		Schedules fn(*args) to be called in the loop thread at the absolute
+		"deadline" timestamp.
+		"""
+		self.__push(deadline, fn, args, False)
+
+	def call_later(self, seconds, fn, *args):
+		"""
+		Schedules fn(*args) to be called in the loop thread after "seconds".
+		"""
+		self.__push(time.time() + seconds, fn, args, False)
+
+	def sleep(self, deadline):
+		"""
+		Returns a Future that gets True at the absolute "deadline" timestamp,
+		or False when interrupted first. A deadline of None only ends on
+		interruption.
+		"""
+		future = Future()
+		if deadline is None:
+			with self.__cond:
+				self.__parked.append(future)
+		else:
+			self.__push(deadline, future.set_result, (True,), True)
+		return future
+
+	def interrupt(self):
+		"""
+		Ends all current sleeps with False. The interruption is run in the
+		loop thread, so a coroutine can't miss it between checking a condition
+		and going to sleep.
+		"""
+		self.call_soon(self.__interrupt)
+
+	def spawn(self, gen):
+		"""
+		Runs a generator as a coroutine on the loop and returns a Future with
+		the value it returns through Return.
+		"""
+		if not isinstance(gen, types.GeneratorType):
+			raise TypeError('gen not generator')
+		future = Future()
+		self.call_soon(_Coroutine(self, gen, future).step)
+		return future
+
+	def call(self, fn, *args):
+		"""
+		Calls fn(*args) in the loop thread and returns a Future with the
+		result, for threads that need to touch coroutine owned state.
+		"""
+		future = Future()
+		def call():
+			try:
+				future.set_result(fn(*args))
+			except Exception:
+				future.set_exception()
+		self.call_soon(call)
+		return future
+
+	def __push(self, deadline, fn, args, interruptible):
+		with self.__cond:
+			entry = (deadline, next(self.__seq), fn, args, interruptible)
+			heapq.heappush(self.__timers, entry)
+			if self.__timers[0] is entry:
+				self.__cond.notify()
+
+	def __interrupt(self):
+		with self.__cond:
+			parked = self.__parked
+			self.__parked = []
+			sleeping = [e for e in self.__timers if e[4]]
+			self.__timers = [e for e in self.__timers if not e[4]]
+			heapq.heapify(self.__timers)
+		for future in parked:
+			future.set_result(False)
+		for entry in sleeping:
+			entry[2](False)
+
+	def __loop(self):
+		"""
+		The loop thread, moves expired timers to the ready queue and runs the
+		ready callbacks in batches.
+		"""
+		while True:
+			with self.__cond:
+				while True:
+					now = time.time()
+					while self.__timers and self.__timers[0][0] <= now:
+						entry = heapq.heappop(self.__timers)
+						self.__ready.append((entry[2], entry[3]))
+					if self.__ready or self.__stopped:
+						break
+					if self.__timers:
+						self.__cond.wait(self.__timers[0][0] - now)
+					else:
+						self.__cond.wait()
+				if not self.__ready:
+					return
+				batch = self.__ready
+				self.__ready = collections.deque()
+				stopped = self.__stopped
+			for fn, args in batch:
+				try:
+					fn(*args)
+				except Exception:
+					logger.error('EventLoop, Exception in callback: (%s)', self.__name, exc_info=True)
+			if stopped:
+				return
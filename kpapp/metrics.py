@@ -0,0 +1,280 @@
+import threading
+import time
+
+"""
+The metrics.py module containes low overhead runtime metrics used by the
+TaskManager and the Database wrapper, such as the Histogram, TaskStats and
+QueryStats classes.
+"""
+
+class Histogram:
+	"""
+	Histogram is a HDR style histogram of durations. Values are recorded in
+	microseconds into log-linear buckets, every power of two is split into
+	2^SUB_BITS buckets, which keeps the relative error below 2^-SUB_BITS
+	regardless of magnitude while using little memory.
+	"""
+	SUB_BITS = 5
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__buckets = {}
+		self.__count = 0
+		self.__total = 0
+		self.__min = None
+		self.__max = 0
+
+	def record(self, seconds):
+		"""
+		Records a duration.
+		seconds		A float with the duration in seconds
+		"""
+		value = max(int(seconds * 1000000), 0)
+		bits = value.bit_length()
+		if bits > self.SUB_BITS:
+			shift = bits - self.SUB_BITS
+			key = (shift << self.SUB_BITS) | (value >> shift)
+		else:
+			key = value
+		with self.__lock:
+			self.__buckets[key] = self.__buckets.get(key, 0) + 1
+			self.__count += 1
+			self.__total += value
+			if self.__min is None or value < self.__min:
+				self.__min = value
+			if value > self.__max:
+				self.__max = value
+
+	def merge(self, other):
+		"""
+		Adds the recorded values of another Histogram.
+		"""
+		buckets, count, total, low, high = other.__state()
+		with self.__lock:
+			for key, n in buckets.items():
+				self.__buckets[key] = self.__buckets.get(key, 0) + n
+			self.__count += count
+			self.__total += total
+			if low is not None and (self.__min is None or low < self.__min):
+				self.__min = low
+			self.__max = max(self.__max, high)
+
+	def count(self):
+		"""
+		Returns the number of recorded values.
+		"""
+		return self.__count
+
+	def percentile(self, percent):
+		"""
+		Returns the value in seconds below which "percent" percent of the
+		recorded values fall.
+		"""
+		buckets, count, total, low, high = self.__state()
+		if not count:
+			return 0.0
+		rank = max(int(round(count * percent / 100.0)), 1)
+		seen = 0
+		for key in sorted(buckets):
+			seen += buckets[key]
+			if seen >= rank:
+				return min(self.__value(key), high) / 1000000.0
+		return high / 1000000.0
+
+	def snapshot(self):
+		"""
+		Returns a dictionary with count, mean, min, max and common percentiles
+		in seconds.
+		"""
+		buckets, count, total, low, high = self.__state()
+		return {
+			'count': count,
+			'mean': total / 1000000.0 / count if count else 0.0,
+			'min': (low or 0) / 1000000.0,
+			'max': high / 1000000.0,
+			'p50': self.percentile(50),
+			'p90': self.percentile(90),
+			'p99': self.percentile(99),
+			'p999': self.percentile(99.9),
+		}
+
+	def __value(self, key):
+		"""
+		Returns the upper bound in microseconds of a bucket.
+		"""
+		shift = key >> self.SUB_BITS
+		if not shift:
+			return key
+		mantissa = key & ((1 << self.SUB_BITS) - 1)
+		return ((mantissa + 1) << shift) - 1
+
+	def __state(self):
+		with self.__lock:
+			return dict(self.__buckets), self.__count, self.__total, self.__min, self.__max
+
+class TaskStats:
+	"""
+	TaskStats records the runtime metrics of one Task: the latency of every
+	work() call, the number of iterations, the time spent idle or paused and
+	the number of exceptions.
+	"""
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__latency = Histogram()
+		self.__started = time.time()
+		self.__stopped = None
+		self.__iterations = 0
+		self.__errors = 0
+		self.__idle = 0.0
+		self.__paused = 0.0
+
+	def work(self, seconds):
+		"""
+		Records one work() call.
+		"""
+		self.__latency.record(seconds)
+		with self.__lock:
+			self.__iterations += 1
+
+	def idle(self, seconds):
+		"""
+		Records time spent idling.
+		"""
+		with self.__lock:
+			self.__idle += seconds
+
+	def paused(self, seconds):
+		"""
+		Records time spent paused.
+		"""
+		with self.__lock:
+			self.__paused += seconds
+
+	def error(self):
+		"""
+		Records one exception.
+		"""
+		with self.__lock:
+			self.__errors += 1
+
+	def start(self):
+		"""
+		Continues the measured period, when a halted task is restarted.
+		"""
+		self.__stopped = None
+
+	def stop(self):
+		"""
+		Marks the end of the measured period, when the task has halted.
+		"""
+		self.__stopped = time.time()
+
+	def snapshot(self):
+		"""
+		Returns a dictionary with the metrics, see TaskStats.combine().
+		"""
+		return TaskStats.combine([self])
+
+	@staticmethod
+	def combine(stats):
+		"""
+		Returns a dictionary with the metrics of several TaskStats combined,
+		used for the workers of a TaskGroup.
+		iterations	Number of work() calls
+		rate		Iterations per second
+		errors		Number of exceptions
+		idle		Seconds spent idle
+		paused		Seconds spent paused
+		idle_ratio	Share of the time spent idle or paused
+		latency		Histogram snapshot of the work() latency
+		"""
+		now = time.time()
+		latency = Histogram()
+		result = {'iterations': 0, 'errors': 0, 'idle': 0.0, 'paused': 0.0}
+		elapsed = 0.0
+		wall = 0.0
+		for s in stats:
+			with s.__lock:
+				result['iterations'] += s.__iterations
+				result['errors'] += s.__errors
+				result['idle'] += s.__idle
+				result['paused'] += s.__paused
+				period = (s.__stopped or now) - s.__started
+			latency.merge(s.__latency)
+			elapsed += period
+			wall = max(wall, period)
+		result['rate'] = result['iterations'] / wall if wall > 0 else 0.0
+		if elapsed > 0:
+			result['idle_ratio'] = min((result['idle'] + result['paused']) / elapsed, 1.0)
+		else:
+			result['idle_ratio'] = 0.0
+		result['latency'] = latency.snapshot()
+		return result
+
+class QueryStats:
+	"""
+	QueryStats aggregates the executions of SQL statements: how often each
+	statement ran, the total and maximum execution time and the number of
+	rows returned or changed. At most MAX_STATEMENTS distinct statements are
+	kept, further statements are aggregated under OTHER.
+	"""
+	MAX_STATEMENTS = 1000
+	OTHER = '<other>'
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__statements = {}
+		self.__latency = Histogram()
+
+	def record(self, sql, seconds, rows = 0):
+		"""
+		Records one execution of a statement, returns the entry that rows()
+		adds to.
+		"""
+		self.__latency.record(seconds)
+		with self.__lock:
+			entry = self.__statements.get(sql)
+			if entry is None:
+				if len(self.__statements) >= self.MAX_STATEMENTS:
+					sql = self.OTHER
+				entry = self.__statements.setdefault(sql, [0, 0.0, 0.0, 0])
+			entry[0] += 1
+			entry[1] += seconds
+			entry[2] = max(entry[2], seconds)
+			entry[3] += max(rows, 0)
+		return entry
+
+	def rows(self, entry, rows):
+		"""
+		Adds fetched rows to an entry returned by record().
+		"""
+		# Counted per fetch without the lock, a lost update only skews
+		# the statistics
+		entry[3] += rows
+
+	def top(self, n = 10, by = 'total'):
+		"""
+		Returns a list with the "n" statements with the highest "by" value,
+		as dictionaries with sql, count, total, mean, max and rows.
+		"""
+		if by not in ('count', 'total', 'mean', 'max', 'rows'):
+			raise ValueError('by must be one of: count, total, mean, max, rows')
+		with self.__lock:
+			items = [(sql, list(entry)) for sql, entry in self.__statements.items()]
+		result = [{
+			'sql': sql,
+			'count': entry[0],
+			'total': entry[1],
+			'mean': entry[1] / entry[0],
+			'max': entry[2],
+			'rows': entry[3],
+		} for sql, entry in items]
+		result.sort(key=lambda s: s[by], reverse=True)
+		return result[:n]
+
+	def snapshot(self):
+		"""
+		Returns a dictionary with the number of distinct statements and a
+		Histogram snapshot of all execution times.
+		"""
+		with self.__lock:
+			statements = len(self.__statements)
+		return {'statements': statements, 'latency': self.__latency.snapshot()}
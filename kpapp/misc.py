@@ -1,27 +1,97 @@
+import hashlib
+import marshal
 import os
 import sys
 import types
-import yaml
 
 from .utils import check_type
 
+class FrozenDict(dict):
+	"""
+	A read-only dictionary, the loaded configuration can be shared without
+	copies since no one can change it. copy() returns a plain dictionary.
+	"""
+	def __readonly(self, *args, **kwargs):
+		raise TypeError('FrozenDict is read-only')
+
+	__setitem__ = __delitem__ = __readonly
+	clear = pop = popitem = setdefault = update = __readonly
+
+	def __reduce__(self):
+		return (FrozenDict, (dict(self),))
+
+	def __repr__(self):
+		return 'FrozenDict(' + dict.__repr__(self) + ')'
+
+def freeze(value):
+	"""
+	Returns a read-only copy of a configuration value, dictionaries become
+	FrozenDicts and lists tuples.
+	"""
+	if isinstance(value, dict):
+		return FrozenDict((k, freeze(v)) for k, v in value.items())
+	if isinstance(value, (list, tuple)):
+		return tuple(freeze(v) for v in value)
+	return value
+
+def _thaw(value):
+	"""
+	Returns a plain copy of a frozen configuration value, FrozenDicts become
+	dictionaries, for marshal.
+	"""
+	if isinstance(value, dict):
+		return dict((k, _thaw(v)) for k, v in value.items())
+	if isinstance(value, tuple):
+		return tuple(_thaw(v) for v in value)
+	return value
+
+def _digest(value):
+	"""
+	Returns a repr of a value with dictionaries sorted, so equal inputs
+	digest equal.
+	"""
+	if isinstance(value, dict):
+		return '{' + ','.join(repr(k) + ':' + _digest(v) for k, v in sorted(value.items())) + '}'
+	if isinstance(value, (list, tuple)):
+		return '[' + ','.join(_digest(v) for v in value) + ']'
+	return repr(value)
+
+def diff(old, new):
+	"""
+	Returns the set of keys whose values differ between two dictionaries,
+	including keys only one of them has.
+	"""
+	return set(k for k in set(old.keys()) | set(new.keys())
+		if not old.has_key(k) or not new.has_key(k) or old[k] != new[k])
+
 class Config:
 	__app_path = os.path.dirname(os.path.abspath(sys.argv[0]))
 	__usr_path = os.path.expanduser('~')
 	__exe_path = os.path.abspath(os.getcwd())
+	CACHE = '.cache'
 
 	def __init__(self):
 		self.__config = None
+		self.__loaded = None
+		self.__mtime = None
 
-	def load(self, path, default = {}, immutable = {}):
+	def load(self, path, default = {}, immutable = {}, cache = True):
 		"""
 		Loads configuration from disk. But can be prepended with a hardcoded
 		default configuration and postpended with an immutable hardcoded
 		configuration. Loaded config overrides default values and immutable
-		config overrides loaded values.
+		config overrides loaded values. The result is a read-only FrozenDict.
+
+		The merged result is cached in a file next to the yaml file, path +
+		CACHE, that is used as long as the modification time and hash of the
+		yaml file and the default and immutable config are unchanged. The
+		cache is written with marshal, which can't run code when read, and
+		configs with values marshal can't write, such as yaml timestamps,
+		aren't cached.
 		path		String with path to config yaml file
 		default		Prepended default config
 		immutable	Postpended immutable config
+		cache		Use and write the cache file
 		"""
 		check_type(path, types.StringType)
 		check_type(default, types.DictType)
@@ -30,17 +100,103 @@ class Config:
 			raise ValueError('Path is not an existing file.')
 
 		if not bool(self.__config):
-			f = file(path, 'r')
-			config = yaml.load(f)
+			f = file(path, 'rb')
+			source = f.read()
 			f.close()
-
-			d = default.copy()
-			d.update(config)
-			i = d.copy()
-			i.update(immutable)
-			self.__config = i
+			key = (
+				os.path.getmtime(path),
+				hashlib.sha1(source).hexdigest(),
+				hashlib.sha1(_digest(default) + _digest(immutable)).hexdigest())
+			config = self.__cached(path + self.CACHE, key) if cache else None
+			if config is None:
+				config = self.__merge(source, default, immutable)
+				if cache:
+					self.__store(path + self.CACHE, key, config)
+			self.__config = config
+			self.__loaded = (path, default, immutable, cache)
+			self.__mtime = key[0]
 		return self.__config
 
+	def reload(self):
+		"""
+		Loads the configuration again from the file and with the arguments of
+		the last load() and returns it. A failed reload keeps the current
+		config, and changed() returns False until the file is modified again.
+		"""
+		if self.__loaded is None:
+			raise RuntimeError('Config not loaded')
+		config = self.__config
+		try:
+			mtime = os.path.getmtime(self.__loaded[0])
+		except OSError:
+			mtime = self.__mtime
+		self.__config = None
+		try:
+			return self.load(*self.__loaded)
+		except Exception:
+			self.__config = config
+			self.__mtime = mtime
+			raise
+
+	def changed(self):
+		"""
+		Returns True if the loaded file was modified since it was loaded.
+		"""
+		if self.__loaded is None:
+			return False
+		try:
+			return os.path.getmtime(self.__loaded[0]) != self.__mtime
+		except OSError:
+			return False
+
+	def __merge(self, source, default, immutable):
+		"""
+		Parses the yaml source with the C loader when available and merges it
+		with the default and immutable config.
+		"""
+		import yaml
+		loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+		config = yaml.load(source, Loader=loader) or {}
+
+		d = default.copy()
+		d.update(config)
+		i = d.copy()
+		i.update(immutable)
+		return freeze(i)
+
+	def __cached(self, path, key):
+		"""
+		Returns the cached config if the cache file matches the key.
+		"""
+		try:
+			f = file(path, 'rb')
+			try:
+				cached = marshal.load(f)
+			finally:
+				f.close()
+		except Exception:
+			return None
+		if not isinstance(cached, tuple) or len(cached) != 2 or cached[0] != key or not isinstance(cached[1], dict):
+			return None
+		return freeze(cached[1])
+
+	def __store(self, path, key, config):
+		"""
+		Writes the cache file, failing silently when the directory is not
+		writable or the config can't be marshalled.
+		"""
+		tmp = path + '.%d.tmp' % os.getpid()
+		try:
+			f = file(tmp, 'wb')
+			try:
+				marshal.dump((key, _thaw(config)), f)
+			finally:
+				f.close()
+			os.rename(tmp, path)
+		except (IOError, OSError, ValueError):
+			if os.path.exists(tmp):
+				os.remove(tmp)
+
 	def app_dir(self):
 		"""
 		Absolute path to the executed scripts location.
@@ -0,0 +1,96 @@
+import multiprocessing
+import signal
+
+"""
+The process.py module containes helpers used by the TaskManager to run Tasks
+and TaskGroup workers in child processes, in order to spread CPU bound work
+over several cores.
+"""
+
+def run_task(task, sig):
+	"""
+	Process target for a Task set up in process mode. Binds the task to a
+	Signal backed by multiprocessing events and runs it.
+	task	The Task instance, a copy is run in the child process
+	sig		Signal instance with multiprocessing.Event halt and run events
+	"""
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	task._bind(sig)
+	task.run()
+
+class WorkerProcess:
+	"""
+	WorkerProcess runs the _initialize(), work() and _finalize() methods of a
+	TaskGroup in a child process. Work items and results are passed over a
+	pipe and must be picklable.
+	"""
+	def __init__(self, name, group):
+		"""
+		name	A string with the process name
+		group	The TaskGroup to run work() for
+		"""
+		self.__name = name
+		self.__group = group
+		self.__conn = None
+		self.__process = None
+
+	def start(self):
+		"""
+		Starts the child process.
+		"""
+		parent, child = multiprocessing.Pipe()
+		self.__process = multiprocessing.Process(target=self.__serve, name=self.__name, args=(child,))
+		self.__process.start()
+		child.close()
+		self.__conn = parent
+
+	def stop(self):
+		"""
+		Tells the child process to finalize and exit, then joins it.
+		"""
+		try:
+			self.__conn.send(('stop', None))
+		except (IOError, EOFError):
+			pass
+		self.__process.join()
+		self.__conn.close()
+
+	def call(self, item):
+		"""
+		Executes work(item) in the child process and returns the result, or
+		raises the exception raised by work(). A dead child process is
+		restarted.
+		"""
+		try:
+			self.__conn.send(('work', item))
+			ok, value = self.__conn.recv()
+		except (IOError, EOFError):
+			self.__process.join()
+			self.__conn.close()
+			self.start()
+			raise RuntimeError('Worker process "' + self.__name + '" died')
+		if not ok:
+			raise value
+		return value
+
+	def __serve(self, conn):
+		"""
+		The child process loop.
+		"""
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+		self.__group._initialize()
+		while True:
+			cmd, item = conn.recv()
+			if cmd == 'stop':
+				break
+			try:
+				result = (True, self.__group.work(item))
+			except Exception as e:
+				result = (False, e)
+			try:
+				conn.send(result)
+			except Exception as e:
+				# Results and exceptions must be picklable
+				conn.send((False, RuntimeError('Result not picklable: ' + str(e))))
+		self.__group._finalize()
+		conn.close()
@@ -0,0 +1,146 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import Histogram
+
+"""
+The rwlock.py module containes the RWLock class used by the Database wrapper
+to let readers share a database while writers get it exclusively.
+"""
+
+class RWLock:
+	"""
+	RWLock is a reader/writer lock with writer preference. Any number of
+	threads may hold the read lock at once, the write lock is exclusive. New
+	readers wait while a writer is waiting, so writers don't starve under
+	read-heavy load. Both locks are reentrant for the holding thread, and the
+	thread holding the write lock may also take the read lock, which it keeps
+	when it releases the write lock first. The time spent waiting for the
+	locks is recorded in Histograms.
+	"""
+	def __init__(self):
+		self.__cond = threading.Condition(threading.Lock())
+		self.__readers = 0
+		self.__writer = None
+		self.__writes = 0
+		self.__waiting = 0
+		self.__local = threading.local()
+		self.__read_wait = Histogram()
+		self.__write_wait = Histogram()
+
+	def acquire_read(self):
+		"""
+		Acquires the shared read lock.
+		"""
+		me = threading.current_thread()
+		depth = getattr(self.__local, 'reads', 0)
+		if depth:
+			self.__local.reads = depth + 1
+			return
+		if self.__writer is me:
+			# Not counted in the readers while the write lock is held
+			self.__local.owned = True
+			self.__local.reads = 1
+			return
+		start = time.time()
+		with self.__cond:
+			while self.__writer is not None or self.__waiting:
+				self.__cond.wait()
+			self.__readers += 1
+		self.__read_wait.record(time.time() - start)
+		self.__local.reads = 1
+
+	def release_read(self):
+		"""
+		Releases the shared read lock.
+		"""
+		depth = getattr(self.__local, 'reads', 0)
+		if not depth:
+			raise RuntimeError('Read lock not held')
+		self.__local.reads = depth - 1
+		if depth > 1:
+			return
+		if getattr(self.__local, 'owned', False):
+			self.__local.owned = False
+			return
+		with self.__cond:
+			self.__readers -= 1
+			if not self.__readers:
+				self.__cond.notify_all()
+
+	def acquire_write(self):
+		"""
+		Acquires the exclusive write lock.
+		"""
+		me = threading.current_thread()
+		if self.__writer is me:
+			self.__writes += 1
+			return
+		if getattr(self.__local, 'reads', 0):
+			raise RuntimeError('Can\'t upgrade a read lock to a write lock')
+		start = time.time()
+		with self.__cond:
+			self.__waiting += 1
+			try:
+				while self.__writer is not None or self.__readers:
+					self.__cond.wait()
+			finally:
+				self.__waiting -= 1
+			self.__writer = me
+			self.__writes = 1
+		self.__write_wait.record(time.time() - start)
+
+	def release_write(self):
+		"""
+		Releases the exclusive write lock.
+		"""
+		if self.__writer is not threading.current_thread():
+			raise RuntimeError('Write lock not held')
+		self.__writes -= 1
+		if self.__writes:
+			return
+		with self.__cond:
+			self.__writer = None
+			if getattr(self.__local, 'owned', False):
+				# The read lock taken under the write lock is kept, counted
+				# as a reader from now on
+				self.__local.owned = False
+				self.__readers += 1
+			self.__cond.notify_all()
+
+	@contextmanager
+	def reader(self):
+		"""
+		Context manager holding the read lock.
+		"""
+		self.acquire_read()
+		try:
+			yield
+		finally:
+			self.release_read()
+
+	@contextmanager
+	def writer(self):
+		"""
+		Context manager holding the write lock.
+		"""
+		self.acquire_write()
+		try:
+			yield
+		finally:
+			self.release_write()
+
+	def stats(self):
+		"""
+		Returns a dictionary with the current number of readers, writers and
+		waiting writers, and snapshots of the read and write wait times, see
+		Histogram.snapshot().
+		"""
+		return {
+			'readers': self.__readers,
+			'writer': self.__writer is not None,
+			'waiting': self.__waiting,
+			'read_wait': self.__read_wait.snapshot(),
+			'write_wait': self.__write_wait.snapshot(),
+		}
@@ -28,3 +28,22 @@ class Service:
 
 	def name(self):
 		return self.__name
+
+	def reconfigure(self, config):
+		"""
+		Replaces the config with a reloaded one and lets the service retune
+		itself in place, see _reconfigured().
+		config	The new config dictionary of the service
+		"""
+		if not isinstance(config, dict):
+			raise TypeError('"config" must be dict')
+		old = self.__config
+		self.__config = config
+		self._reconfigured(old, config)
+
+	def _reconfigured(self, old, new):
+		"""
+		Overridable callback called by reconfigure() with the old and new
+		config, _config() already returns the new one.
+		"""
+		pass
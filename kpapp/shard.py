@@ -0,0 +1,162 @@
+import binascii
+import threading
+
+from .common import logger
+
+"""
+The shard.py module containes the ShardedDatabase class that spreads one
+logical database over several Database instances, and the reshard() helper
+that moves rows between shard layouts.
+"""
+
+def crc32(key):
+	"""
+	Default shard key hash, stable across processes and Python versions.
+	"""
+	if isinstance(key, unicode):
+		key = key.encode('utf-8')
+	elif not isinstance(key, str):
+		key = str(key)
+	return binascii.crc32(key) & 0xffffffff
+
+class ShardedDatabase:
+	"""
+	ShardedDatabase routes every key to one of its shards, each a Database
+	of its own file, so writes to different shards don't wait for each other.
+	Queries without a key fan out to all shards and merge their rows.
+	"""
+	def __init__(self, name, shards, key = crc32):
+		"""
+		name	A string with the logical database name
+		shards	A list of Database instances
+		key		Callable hashing a routing key to an integer
+		"""
+		if not isinstance(name, basestring):
+			raise TypeError('name not basestring')
+		if not shards:
+			raise ValueError('shards must not be empty')
+		self.__name = name
+		self.__shards = list(shards)
+		self.__key = key
+
+	def name(self):
+		"""
+		Returns the logical database name.
+		"""
+		return self.__name
+
+	def count(self):
+		"""
+		Returns the number of shards.
+		"""
+		return len(self.__shards)
+
+	def shards(self):
+		"""
+		Returns the list of shard Databases.
+		"""
+		return list(self.__shards)
+
+	def index(self, key):
+		"""
+		Returns the index of the shard that "key" routes to.
+		"""
+		return self.__key(key) % len(self.__shards)
+
+	def shard(self, key):
+		"""
+		Returns the shard Database that "key" routes to.
+		"""
+		return self.__shards[self.index(key)]
+
+	def execute(self, sql, params = ()):
+		"""
+		Executes a statement in a transaction on every shard, for schema
+		changes. Returns the total number of changed rows.
+		"""
+		count = 0
+		for shard in self.__shards:
+			with shard.atomic() as conn:
+				count += max(conn.execute_sql(sql, params).rowcount, 0)
+		return count
+
+	def select(self, sql, params = (), order = None, reverse = False, limit = None, parallel = False):
+		"""
+		Runs a query on every shard and returns the merged rows.
+		order		Callable returning the sort key of a row, None keeps the
+					rows in shard order
+		reverse		Sort in descending order
+		limit		Maximum number of rows to return
+		parallel	Query the shards in concurrent threads
+		"""
+		if parallel:
+			results = [None] * len(self.__shards)
+			def query(i):
+				results[i] = self.__shards[i].select(sql, params)
+			threads = [threading.Thread(target=query, args=(i,)) for i in range(len(self.__shards))]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			if None in results:
+				raise RuntimeError('Sharded query on "' + self.__name + '" failed')
+		else:
+			results = [shard.select(sql, params) for shard in self.__shards]
+		rows = [row for result in results for row in result]
+		if order is not None:
+			rows.sort(key=order, reverse=reverse)
+		if limit is not None:
+			rows = rows[:limit]
+		return rows
+
+	def stats(self):
+		"""
+		Returns a list with the statistics of every shard, see
+		Database.stats().
+		"""
+		return [shard.stats() for shard in self.__shards]
+
+def reshard(source, target, tables, batch = 1000):
+	"""
+	Copies the rows of "tables" from the shards of "source" to the shards of
+	"target", routing every row by its key column with the target key
+	function. Missing tables are created on the target shards from the schema
+	of the first source shard. Returns the number of copied rows.
+	source		ShardedDatabase to read from
+	target		ShardedDatabase to write to, usually with another shard count
+	tables		Dictionary with the key column name of every table
+	batch		Rows per insert transaction
+	"""
+	schema = source.shards()[0].select(
+		'SELECT name, sql FROM sqlite_master WHERE type = \'table\' AND sql IS NOT NULL')
+	schema = dict((name.lower(), sql) for name, sql in schema)
+	for table in tables:
+		if table.lower() not in schema:
+			raise ValueError('Table "' + table + '" not found in "' + source.name() + '"')
+		sql = schema[table.lower()].replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1)
+		target.execute(sql)
+
+	total = 0
+	for table, column in tables.items():
+		for shard in source.shards():
+			with shard.read() as conn:
+				cursor = conn.execute_sql('SELECT * FROM "%s"' % table)
+				names = [d[0] for d in cursor.description]
+				if column not in names:
+					raise ValueError('Column "' + column + '" not found in "' + table + '"')
+				pos = names.index(column)
+				insert = 'INSERT INTO "%s" VALUES (%s)' % (table, ', '.join(['?'] * len(names)))
+				rows = cursor.fetchmany(batch)
+				while rows:
+					routed = {}
+					for row in rows:
+						routed.setdefault(target.index(row[pos]), []).append(row)
+					for i, part in routed.items():
+						dest = target.shards()[i]
+						with dest.atomic() as write:
+							dest.invalidate(insert)
+							write.cursor().executemany(insert, part)
+					total += len(rows)
+					rows = cursor.fetchmany(batch)
+		logger.info('Resharded table %s of %s into %d shards', table, source.name(), target.count())
+	return total
@@ -0,0 +1,65 @@
+import collections
+import threading
+import time
+
+"""
+The supervisor.py module containes the Supervisor class used by the
+TaskManager to decide when and how fast crashed tasks are restarted.
+"""
+
+class Supervisor:
+	"""
+	Supervisor keeps the restart history of tasks in the style of Erlang
+	supervisors. A task may be restarted "max_restarts" times within "period"
+	seconds, the delay before each restart doubles from "backoff" up to
+	"max_backoff". When the intensity is exceeded the TaskManager escalates.
+	"""
+	STRATEGIES = ('one_for_one', 'one_for_all')
+	def __init__(self, max_restarts = 3, period = 5, backoff = 0.1, max_backoff = 10):
+		"""
+		max_restarts	Maximum number of restarts within period
+		period			Seconds of restart history to consider
+		backoff			Seconds to wait before the first restart
+		max_backoff		Maximum seconds to wait before a restart
+		"""
+		self.__max_restarts = max_restarts
+		self.__period = period
+		self.__backoff = backoff
+		self.__max_backoff = max_backoff
+		self.__history = {}
+		self.__lock = threading.Lock()
+
+	def configure(self, max_restarts = 3, period = 5, backoff = 0.1, max_backoff = 10):
+		"""
+		Changes the restart intensity and backoff, keeping the restart
+		history. Takes the arguments of the constructor.
+		"""
+		with self.__lock:
+			self.__max_restarts = max_restarts
+			self.__period = period
+			self.__backoff = backoff
+			self.__max_backoff = max_backoff
+
+	def crashed(self, name):
+		"""
+		Registers a crash, returns the seconds to wait before restarting or
+		None when the restart intensity is exceeded.
+		name	The name of the Task or TaskGroup
+		"""
+		now = time.time()
+		with self.__lock:
+			history = self.__history.setdefault(name, collections.deque())
+			while history and history[0] < now - self.__period:
+				history.popleft()
+			if len(history) >= self.__max_restarts:
+				return None
+			history.append(now)
+			return min(self.__backoff * 2 ** (len(history) - 1), self.__max_backoff)
+
+	def restarts(self, name):
+		"""
+		Returns the number of restarts within the current period.
+		"""
+		now = time.time()
+		with self.__lock:
+			return len([t for t in self.__history.get(name, []) if t >= now - self.__period])
@@ -1,8 +1,20 @@
 import threading
 import time
 import sys
+import os
+import signal
+import Queue
+import multiprocessing
+import traceback
 from .common import logger
+from .future import Future
+from .channel import Channel, Topic
+from .loop import EventLoop
+from .metrics import TaskStats
+from .supervisor import Supervisor
+from .process import run_task, WorkerProcess
 from .service import Service
+from .timer import Timer
 
 """
 The task.py module containes classes needed to manage multithreading and running
@@ -12,27 +24,74 @@ tasks within the application.
 class Signal:
 	"""
 	Signal class is used by the TaskManager to communicate with the Task
-	classes.
+	classes. A Signal can be layered under a parent Signal, then it halts when
+	either is halted and runs only when both are running.
 	"""
-	def __init__(self, halt, run):
+	POLL = 0.1
+	def __init__(self, halt, run, timer = None, parent = None):
 		"""
 		halt	threading.Event signaling halt to all the Task threads
 		run		threading.Event signaling pause/resume to all Task threads
+		timer	Timer instance used to sleep, optional
+		parent	Signal instance this signal is layered under, optional
 		"""
+		if parent is not None and not isinstance(parent, Signal):
+			raise TypeError('parent not Signal')
 		self.__run = run
 		self.__halt = halt
+		self.__parent = parent
+		if timer is None and parent is not None:
+			timer = parent.timer()
+		self.__timer = timer
 
 	def halt(self):
 		"""
 		Returns the state of the halt signal
 		"""
-		return self.__halt.is_set()
+		if self.__halt.is_set():
+			return True
+		return self.__parent is not None and self.__parent.halt()
+
+	def running(self):
+		"""
+		Returns False if the signal is paused.
+		"""
+		if not self.__run.is_set():
+			return False
+		return self.__parent is None or self.__parent.running()
 
 	def pause(self):
 		"""
-		Will make calling thread pause until resume signal
+		Will make calling thread pause until resume signal, or halt
+		"""
+		if self.__parent is not None:
+			self.__parent.pause()
+		while not self.__run.wait(self.POLL):
+			if self.halt():
+				return
+
+	def timer(self):
+		"""
+		Returns the Timer used to sleep, or None.
 		"""
-		self.__run.wait()
+		return self.__timer
+
+	def sleep(self, deadline):
+		"""
+		Will make calling thread sleep until the absolute "deadline" timestamp.
+		The sleep is interrupted by halt and suspend. Returns True if the
+		deadline was reached.
+		"""
+		if self.__timer is None:
+			self.__halt.wait(max(deadline - time.time(), 0))
+			return time.time() >= deadline
+		event = self.__timer.schedule(deadline)
+		# The TaskManager sets the signal before interrupting the timer, so
+		# checking after scheduling can't miss an interruption.
+		if self.halt() or not self.running():
+			return False
+		event.wait()
+		return time.time() >= deadline
 
 class Task:
 	"""
@@ -57,7 +116,10 @@ class Task:
 		self.__sig = sig
 		self.__config = config
 		self.__done = False
-		self.__idle = 0
+		self.__idle = None
+		self.__stats = TaskStats()
+		self.__supervisor = None
+		self.__busy = False
 
 	def name(self):
 		"""
@@ -65,11 +127,47 @@ class Task:
 		"""
 		return self.__name
 
+	def stats(self):
+		"""
+		Returns the TaskStats with the runtime metrics of the task.
+		"""
+		return self.__stats
+
+	def _bind(self, sig):
+		"""
+		Replaces the Signal the task listens to, used by the TaskManager.
+		"""
+		if not isinstance(sig, Signal):
+			raise TypeError('sig not Signal')
+		self.__sig = sig
+
+	def _busy(self):
+		"""
+		Returns True while the task is running an iteration of work().
+		"""
+		return self.__busy
+
+	def _supervise(self, callback):
+		"""
+		Sets a callable that is called with the task when run() crashes,
+		instead of exiting the thread with sys.exit(). Used by the TaskManager
+		to restart crashed tasks.
+		"""
+		self.__supervisor = callback
+
 	def _idle(self, seconds):
 		"""
-		Instructs the run() method to sleep for "seconds" seconds.
+		Instructs the run() method to sleep for "seconds" seconds, fractions
+		of a second are allowed.
 		"""
-		self.__idle = int(seconds)
+		self.__idle = time.time() + float(seconds)
+
+	def _idle_until(self, deadline):
+		"""
+		Instructs the run() method to sleep until the absolute "deadline"
+		timestamp. Useful for drift free periodic work.
+		"""
+		self.__idle = float(deadline)
 
 	def _config(self):
 		"""
@@ -77,12 +175,24 @@ class Task:
 		"""
 		return self.__config
 
+	def _signal(self):
+		"""
+		Returns the Signal the task listens to.
+		"""
+		return self.__sig
+
 	def _done(self):
 		"""
 		Instructs the run() method to exit thread.
 		"""
 		self.__done = True
 
+	def _is_done(self):
+		"""
+		Returns True if _done() has been called.
+		"""
+		return self.__done
+
 	def _initialize(self):
 		"""
 		Overridable method that the run() method executes before entering the
@@ -105,55 +215,658 @@ class Task:
 		traceback. It is recommended to not handle unexpected exceptions, but
 		lets the task report them in a standardized manner.
 		"""
+		self.__stats.start()
 		try:
 			self._initialize()
 			while not (self.__sig.halt() or self.__done):
+				start = time.time()
 				self.__sig.pause()
-				if self.__idle > 0:
-					self.__idle -= 1
-					time.sleep(1)
+				now = time.time()
+				self.__stats.paused(now - start)
+				if self.__idle is not None:
+					if self.__sig.sleep(self.__idle):
+						self.__idle = None
+					self.__stats.idle(time.time() - now)
 				else:
-					self.work()
+					self.__busy = True
+					self._step(self.__stats)
+					self.__busy = False
 			self._finalize()
 		except:
+			self.__busy = False
+			self.__stats.error()
+			self.__stats.stop()
 			logger.critical('Task.run(), Unhandled exception: (%s)', self.__name, exc_info=True)
-			sys.exit('########## Program crash due to internal error ##########')
+			if self.__supervisor is None:
+				sys.exit('########## Program crash due to internal error ##########')
+			self.__supervisor(self)
+			return
+		self.__stats.stop()
 		logger.info('Thread %s has gracefully halted', self.__name)
 
+	def _step(self, stats):
+		"""
+		Runs one iteration of the work loop and records its latency in the
+		TaskStats "stats".
+		"""
+		start = time.time()
+		self.work()
+		stats.work(time.time() - start)
+
 	def work(self):
 		"""
 		The Tasks business logic should be implemented in the work() method.
 		"""
 		raise NotImplementedError
 
+class AsyncTask(Task):
+	"""
+	AsyncTask is a lightweight Task that runs as a coroutine on the TaskManager
+	event loop instead of in its own thread. The work() method should be a
+	generator, it may yield None to let other coroutines run, a number of
+	seconds to sleep, a Future or another generator to wait for. Blocking calls
+	stall every AsyncTask, they should be submitted to a TaskGroup and its
+	Future yielded.
+	"""
+	def __init__(self, name, sig, config = {}):
+		"""
+		name 	A string with the Task name
+		sig		The Signal class instance to listen too
+		config	A dictionary with config values
+		"""
+		Task.__init__(self, name, sig, config)
+		self.__idle = None
+		self.__busy = False
+
+	def _idle(self, seconds):
+		"""
+		Instructs the coroutine to sleep for "seconds" seconds.
+		"""
+		self.__idle = time.time() + float(seconds)
+
+	def _idle_until(self, deadline):
+		"""
+		Instructs the coroutine to sleep until the absolute "deadline"
+		timestamp.
+		"""
+		self.__idle = float(deadline)
+
+	def run(self, args = {}):
+		"""
+		AsyncTasks can't run as threads, use TaskManager.setup().
+		"""
+		raise RuntimeError('AsyncTask runs on the TaskManager event loop')
+
+	def _busy(self):
+		"""
+		Returns True while the coroutine is running an iteration of work().
+		"""
+		return self.__busy
+
+	def coroutine(self, loop):
+		"""
+		The generator run on the EventLoop by the TaskManager, the coroutine
+		counterpart of Task.run(). Pausing and idling park the coroutine on the
+		loop, the TaskManager interrupts the loop on suspend, resume and halt.
+		"""
+		sig = self._signal()
+		stats = self.stats()
+		stats.start()
+		self._initialize()
+		while not (sig.halt() or self._is_done()):
+			start = time.time()
+			if not sig.running():
+				yield loop.sleep(None)
+				stats.paused(time.time() - start)
+			elif self.__idle is not None:
+				reached = yield loop.sleep(self.__idle)
+				if reached:
+					self.__idle = None
+				stats.idle(time.time() - start)
+			else:
+				self.__busy = True
+				try:
+					yield self.work()
+				finally:
+					self.__busy = False
+				stats.work(time.time() - start)
+		self._finalize()
+		stats.stop()
+		logger.info('Coroutine %s has gracefully halted', self.name())
+
+class _WorkQueue(Queue.Queue):
+	"""
+	Bounded work queue used by TaskGroup. Supports batch puts with one lock
+	handoff and control messages that bypass the bound.
+	"""
+	def put_many(self, items, block = True, timeout = None):
+		"""
+		Puts several items, blocking while the queue is full. Returns the
+		number of items put, which is less than len(items) on timeout or if
+		not blocking.
+		"""
+		count = 0
+		endtime = None
+		if timeout is not None:
+			endtime = time.time() + timeout
+		with self.not_full:
+			for item in items:
+				while self.maxsize > 0 and self._qsize() >= self.maxsize:
+					if not block:
+						return count
+					if endtime is None:
+						self.not_full.wait()
+					else:
+						remaining = endtime - time.time()
+						if remaining <= 0:
+							return count
+						self.not_full.wait(remaining)
+				self._put(item)
+				self.unfinished_tasks += 1
+				self.not_empty.notify()
+				count += 1
+		return count
+
+	def put_control(self, item):
+		"""
+		Puts an item first in line, ignoring the bound.
+		"""
+		with self.not_empty:
+			self.queue.appendleft(item)
+			self.unfinished_tasks += 1
+			self.not_empty.notify()
+
+	def drain(self):
+		"""
+		Removes and returns all queued items.
+		"""
+		with self.not_full:
+			items = list(self.queue)
+			self.queue.clear()
+			self.not_full.notify_all()
+		with self.all_tasks_done:
+			self.unfinished_tasks -= len(items)
+			if not self.unfinished_tasks:
+				self.all_tasks_done.notify_all()
+		return items
+
+	def join(self, timeout = None):
+		"""
+		Waits until every item put has been marked done with task_done().
+		Returns False if the timeout expired.
+		"""
+		endtime = None
+		if timeout is not None:
+			endtime = time.time() + timeout
+		with self.all_tasks_done:
+			while self.unfinished_tasks:
+				if endtime is None:
+					self.all_tasks_done.wait()
+				else:
+					remaining = endtime - time.time()
+					if remaining <= 0:
+						return False
+					self.all_tasks_done.wait(remaining)
+		return True
+
+class _GroupWorker(Task):
+	"""
+	_GroupWorker is the Task that runs one worker thread of a TaskGroup.
+	"""
+	def __init__(self, name, group, sig, generation):
+		Task.__init__(self, name, sig)
+		self.__group = group
+		self.__process = None
+		self.__generation = generation
+
+	def _initialize(self):
+		self.__process = self.__group._open(self.name())
+
+	def _finalize(self):
+		self.__group._close(self.__process)
+
+	def _step(self, stats):
+		if not self.__group._process(self.__process, stats, self.__generation):
+			self._done()
+
 class TaskGroup:
 	"""
-	TaskGroup is to be implemented. With TaskGroup you should be able to
-	instantiate, monitor and communicate with Tasks in groups.
+	TaskGroup is a pool of worker threads pulling work items from a shared
+	bounded queue. Submitted items are passed to work() and the results are
+	delivered through Future objects. In order to implement a group, TaskGroup
+	can be subclassed and work() implemented, by default callable items are
+	called. A TaskGroup is started by TaskManager.setup().
+
+	In process mode every worker thread hands its items to a child process
+	that runs _initialize(), work() and _finalize(), items and results must
+	then be picklable.
+
+	Crashed workers are restarted by the TaskManager according to the
+	strategy, "one_for_one" replaces the crashed worker and "one_for_all"
+	replaces all workers.
 	"""
-	pass
+	_STOP = object()
+	_WAKE = object()
+
+	def __init__(self, name, sig, workers = 1, queue_size = 0, config = {}, strategy = 'one_for_one'):
+		"""
+		name 		A string with the TaskGroup name
+		sig			The Signal class instance to listen too
+		workers		Number of worker threads
+		queue_size	Maximum number of queued items, 0 is unbounded
+		config		A dictionary with config values
+		strategy	Restart strategy, "one_for_one" or "one_for_all"
+		"""
+		if not isinstance(name, basestring):
+			raise TypeError('name not basestring')
+		if not isinstance(sig, Signal):
+			raise TypeError('sig not Signal')
+		if not isinstance(config, dict):
+			raise TypeError('config not dict')
+		if workers < 1:
+			raise ValueError('workers must be at least 1')
+		if strategy not in Supervisor.STRATEGIES:
+			raise ValueError('strategy must be one of: ' + ', '.join(Supervisor.STRATEGIES))
+
+		self.__name = name
+		self.__strategy = strategy
+		self.__generation = 0
+		self.__stale = 0
+		self.__respawn = False
+		self.__supervisor = None
+		self.__config = config
+		self.__size = workers
+		self.__queue = _WorkQueue(queue_size)
+		self.__lock = threading.Lock()
+		self.__workers = {}
+		self.__stats = []
+		self.__count = 0
+		self.__started = False
+		self.__mode = 'thread'
+
+		self.__run = threading.Event()
+		self.__run.set()
+		self.__halt = threading.Event()
+		self.__sig = Signal(halt=self.__halt, run=self.__run, parent=sig)
+
+	def name(self):
+		"""
+		Returns group name.
+		"""
+		return self.__name
+
+	def size(self):
+		"""
+		Returns the configured number of workers.
+		"""
+		return self.__size
+
+	def qsize(self):
+		"""
+		Returns the approximate number of queued items.
+		"""
+		return self.__queue.qsize()
+
+	def get_signal(self):
+		"""
+		Returns the groups Signal, layered under the Signal it was created
+		with.
+		"""
+		return self.__sig
+
+	def _config(self):
+		"""
+		Returns initiated config values dictionary.
+		"""
+		return self.__config
+
+	def mode(self):
+		"""
+		Returns the execution mode, "thread" or "process".
+		"""
+		return self.__mode
+
+	def _initialize(self):
+		"""
+		Overridable method that every worker executes before entering the work
+		loop.
+		"""
+		pass
+
+	def _finalize(self):
+		"""
+		Overridable method that every worker executes after exiting the work
+		loop.
+		"""
+		pass
+
+	def work(self, item):
+		"""
+		The groups business logic should be implemented in the work() method,
+		it is called with each submitted item and its return value becomes the
+		result of the Future.
+		"""
+		if callable(item):
+			return item()
+		raise NotImplementedError
+
+	def submit(self, item, block = True, timeout = None):
+		"""
+		Queues an item for processing and returns a Future. Blocks while the
+		queue is full, raises Queue.Full if not blocking or on timeout.
+		"""
+		if self.__sig.halt():
+			raise RuntimeError('TaskGroup "' + self.__name + '" halted')
+		future = Future()
+		self.__queue.put((item, future), block, timeout)
+		return future
+
+	def submit_batch(self, items, block = True, timeout = None):
+		"""
+		Queues several items at once and returns a list of Futures. Items
+		that couldn't be queued in time get a Queue.Full exception set.
+		"""
+		if self.__sig.halt():
+			raise RuntimeError('TaskGroup "' + self.__name + '" halted')
+		entries = [(item, Future()) for item in items]
+		count = self.__queue.put_many(entries, block, timeout)
+		for entry in entries[count:]:
+			entry[1].set_exception(Queue.Full('TaskGroup "' + self.__name + '" queue full'))
+		return [entry[1] for entry in entries]
+
+	def map(self, items, timeout = None):
+		"""
+		Processes all items and returns a list with the results in order.
+		timeout		Seconds to wait for each result, None waits forever
+		"""
+		return [future.result(timeout) for future in self.submit_batch(items)]
+
+	def strategy(self):
+		"""
+		Returns the restart strategy.
+		"""
+		return self.__strategy
+
+	def start(self, mode = 'thread', supervisor = None):
+		"""
+		Starts the worker threads, called by TaskManager.setup().
+		mode		"thread" or "process"
+		supervisor	Callable that is called with the group when a worker
+					crashes, None exits the worker thread with sys.exit()
+		"""
+		if mode not in ('thread', 'process'):
+			raise ValueError('mode must be "thread" or "process"')
+		with self.__lock:
+			if self.__started:
+				raise RuntimeError('TaskGroup already started')
+			self.__started = True
+			self.__mode = mode
+			self.__supervisor = supervisor
+			self.__spawn(self.__size)
+
+	def resize(self, workers):
+		"""
+		Changes the number of worker threads at runtime. Surplus workers exit
+		after finishing their current item.
+		"""
+		if workers < 1:
+			raise ValueError('workers must be at least 1')
+		with self.__lock:
+			diff = workers - self.__size
+			self.__size = workers
+			if not self.__started:
+				return
+			if diff > 0:
+				self.__spawn(diff)
+			for i in range(-diff):
+				self.__queue.put_control(self._STOP)
+		logger.info('TaskGroup %s resized to %d workers', self.__name, workers)
+
+	def workers(self):
+		"""
+		Returns the number of running worker threads.
+		"""
+		with self.__lock:
+			return len(self.__workers)
+
+	def threads(self):
+		"""
+		Returns a dictionary with the running worker threads by name.
+		"""
+		with self.__lock:
+			return dict(self.__workers)
+
+	def suspend(self):
+		"""
+		Pauses the workers of this group only.
+		"""
+		self.__run.clear()
+		timer = self.__sig.timer()
+		if timer is not None:
+			timer.interrupt()
+
+	def resume(self):
+		"""
+		Resumes the paused workers of this group.
+		"""
+		self.__run.set()
+
+	def suspended(self):
+		"""
+		Returns True if the workers of this group are paused.
+		"""
+		return not self.__run.is_set()
+
+	def drain(self, timeout = None):
+		"""
+		Lets the workers finish all queued and running items and then pauses
+		them. Returns False if the timeout expired first, the group then keeps
+		running.
+		"""
+		self.__run.set()
+		if not self.__queue.join(timeout):
+			return False
+		self.suspend()
+		return True
+
+	def halt(self):
+		"""
+		Halts the workers of this group. Queued items are discarded and their
+		Futures get a RuntimeError.
+		"""
+		self.__halt.set()
+		self.__run.set()
+		for entry in self.__queue.drain():
+			if entry is not self._STOP and entry is not self._WAKE:
+				entry[1].set_exception(RuntimeError('TaskGroup "' + self.__name + '" halted'))
+		with self.__lock:
+			for i in range(len(self.__workers)):
+				self.__queue.put_control(self._STOP)
+
+	def _open(self, name):
+		"""
+		Prepares a worker thread, returns its WorkerProcess in process mode or
+		None.
+		"""
+		if self.__mode == 'process':
+			process = WorkerProcess(name, self)
+			process.start()
+			return process
+		self._initialize()
+		return None
+
+	def _close(self, process):
+		"""
+		Cleans up after a worker thread.
+		"""
+		if process is None:
+			self._finalize()
+		else:
+			process.stop()
+
+	def _restart(self):
+		"""
+		Replaces crashed workers according to the strategy, called by the
+		TaskManager after the restart backoff. With "one_for_all" the old
+		workers are woken up and exit, the new workers are started when the
+		last old worker has exited.
+		"""
+		with self.__lock:
+			if self.__sig.halt():
+				return
+			if self.__strategy == 'one_for_all':
+				self.__generation += 1
+				self.__stale = len(self.__workers)
+				for i in range(self.__stale):
+					self.__queue.put_control(self._WAKE)
+				self.__respawn = self.__stale > 0
+				count = self.__size
+				if not self.__respawn:
+					self.__spawn(count)
+			else:
+				count = max(self.__size - len(self.__workers), 0)
+				self.__spawn(count)
+		logger.warning('TaskGroup %s restarting %d workers', self.__name, count)
+
+	def _process(self, process, stats, generation):
+		"""
+		Processes one item, called by the worker threads. Returns False when
+		the worker should exit.
+		process		The workers WorkerProcess in process mode, or None
+		stats		The workers TaskStats, waiting for items counts as idle
+		generation	The workers generation, older workers exit
+		"""
+		start = time.time()
+		entry = self.__queue.get()
+		try:
+			now = time.time()
+			stats.idle(now - start)
+			if entry is self._STOP:
+				return False
+			if generation != self.__generation:
+				if entry is not self._WAKE:
+					self.__queue.put_control(entry)
+				return False
+			if entry is self._WAKE:
+				return True
+			item, future = entry
+			self.__sig.pause()
+			start = time.time()
+			stats.paused(start - now)
+			if self.__sig.halt():
+				future.set_exception(RuntimeError('TaskGroup "' + self.__name + '" halted'))
+				return False
+			try:
+				if process is None:
+					result = self.work(item)
+				else:
+					result = process.call(item)
+			except Exception:
+				stats.error()
+				logger.error('TaskGroup.work(), Exception in group: (%s)', self.__name, exc_info=True)
+				future.set_exception()
+			else:
+				future.set_result(result)
+			stats.work(time.time() - start)
+			return True
+		finally:
+			self.__queue.task_done()
+
+	def stats(self):
+		"""
+		Returns a dictionary with the combined runtime metrics of all workers
+		that have run in the group, see TaskStats.combine(), and the current
+		number of workers and queued items.
+		"""
+		with self.__lock:
+			stats = list(self.__stats)
+			workers = len(self.__workers)
+		result = TaskStats.combine(stats)
+		result['workers'] = workers
+		result['queued'] = self.qsize()
+		return result
+
+	def __spawn(self, count):
+		for i in range(count):
+			self.__count += 1
+			name = '%s-%d' % (self.__name, self.__count)
+			worker = _GroupWorker(name, self, self.__sig, self.__generation)
+			if self.__supervisor is not None:
+				worker._supervise(self.__crashed)
+			self.__stats.append(worker.stats())
+			thread = threading.Thread(target=self.__work, name=name, args=(worker, self.__generation))
+			self.__workers[name] = thread
+			thread.start()
+
+	def __crashed(self, worker):
+		with self.__lock:
+			# No longer counted by a one_for_one restart
+			self.__workers.pop(worker.name(), None)
+		self.__supervisor(self)
+
+	def __work(self, worker, generation):
+		try:
+			worker.run()
+		finally:
+			with self.__lock:
+				if self.__workers.pop(worker.name(), None) is None:
+					return
+				if generation != self.__generation and self.__stale > 0:
+					self.__stale -= 1
+					if self.__stale == 0 and self.__respawn and not self.__sig.halt():
+						self.__respawn = False
+						self.__spawn(self.__size)
 
 class TaskManager(Service):
 	"""
 	TaskManag is the Application Service that handles multithreading and
-	interthread communications
+	interthread communications. It supervises its tasks, crashed tasks are
+	restarted with backoff and when the restart intensity is exceeded the
+	process is sent SIGTERM. Tasks in process mode are not supervised, a
+	crash ends their child process and is logged there, the workers of a
+	TaskGroup in process mode are.
+
+	Every task and group has its own run signal layered under the global one,
+	so tasks can be suspended, resumed and drained by name or tag while the
+	rest keeps running.
 	"""
 	NAME = 'TaskManager'
 	KILL_RANGE = 10
-	def __init__(self):
+	def __init__(self, config = {}):
 		"""
 		Instantiates and initializes the TaskManager setting up interthread
 		communication.
+		config	Dictionary, the "supervisor" section holds the Supervisor
+				arguments and the "groups" section the number of "workers"
+				of TaskGroups by name
 		"""
-		Service.__init__(self, self.NAME)
+		Service.__init__(self, self.NAME, config)
+		self.__supervisor = Supervisor(**(self._config('supervisor') or {}))
 		self.__tasks = {}
+		self.__groups = {}
+		self.__threads = {}
+		self.__processes = {}
+		self.__pauses = {}
+		self.__tags = {}
+		self.__coroutines = {}
+		self.__channels = {}
+		self.__topics = {}
+		self.__lock = threading.Lock()
+		self.__restarting = set()
+		self.__restart_lock = threading.RLock()
+		self.__stragglers = {}
 
 		self.__run = threading.Event()
 		self.__run.set()
 		self.__halt = threading.Event()
 		self.__halt.clear()
+		self.__timer = Timer()
 
-		self.__signal = Signal(run=self.__run, halt=self.__halt)
+		self.__signal = Signal(run=self.__run, halt=self.__halt, timer=self.__timer)
+		self.__process_signal = None
+		self.__process_halt = None
+		self.__process_run = None
+		self.__loop = EventLoop()
 
 	def get_signal(self):
 		"""
@@ -161,47 +874,419 @@ class TaskManager(Service):
 		"""
 		return self.__signal
 
-	def suspend(self):
+	def get_process_signal(self):
 		"""
-		Pauses the threads by setting the "run" signal to False.
+		Returns a Signal backed by multiprocessing events, used by Tasks
+		running in process mode. Created on first use.
 		"""
-		self.__run.clear()
+		if self.__process_signal is None:
+			self.__process_halt = multiprocessing.Event()
+			self.__process_run = multiprocessing.Event()
+			if self.__halt.is_set():
+				self.__process_halt.set()
+			if self.__run.is_set():
+				self.__process_run.set()
+			self.__process_signal = Signal(halt=self.__process_halt, run=self.__process_run)
+		return self.__process_signal
 
-	def resume(self):
+	def get_timer(self):
 		"""
-		Resumes the paused threads by setting the "run" signal to True.
+		Returns the internal Timer used to wake up idling tasks.
 		"""
-		self.__run.set()
+		return self.__timer
+
+	def get_loop(self):
+		"""
+		Returns the EventLoop that runs the AsyncTasks, it is started by the
+		first AsyncTask set up.
+		"""
+		return self.__loop
 
-	def stop(self):
+	def channel(self, name, size = 0, policy = 'block', key = None):
 		"""
-		Halts all the threads by setting the run signal to False. Then cleans
-		up all the threads.
+		Returns the named Channel, created with the given arguments on first
+		use. All channels are closed on stop(), which wakes up their consumer.
+		name	A string with the channel name
+		size	Maximum number of queued items, 0 is unbounded
+		policy	What to do with new items when full, see Channel.POLICIES
+		key		Callable returning the coalesce key of an item
 		"""
+		with self.__lock:
+			if name not in self.__channels:
+				self.__channels[name] = Channel(name, size, policy, key)
+				if self.__halt.is_set():
+					self.__channels[name].close()
+			return self.__channels[name]
+
+	def topic(self, name):
+		"""
+		Returns the named Topic, created on first use. All topics are closed
+		on stop().
+		"""
+		with self.__lock:
+			if name not in self.__topics:
+				self.__topics[name] = Topic(name)
+				if self.__halt.is_set():
+					self.__topics[name].close()
+			return self.__topics[name]
+
+	def suspend(self, target = None):
+		"""
+		Pauses the threads by setting the "run" signal to False. Idling
+		threads are woken up so that they pause at once.
+		target	Name or tag of the tasks and groups to pause, None pauses all
+		"""
+		if target is None:
+			self.__run.clear()
+			if self.__process_run is not None:
+				self.__process_run.clear()
+		else:
+			for name in self.__select(target):
+				if name in self.__groups:
+					self.__groups[name].suspend()
+				else:
+					self.__pauses[name].clear()
+		self.__timer.interrupt()
+		self.__loop.interrupt()
+
+	def resume(self, target = None):
+		"""
+		Resumes the paused threads by setting the "run" signal to True. Tasks
+		paused by name or tag stay paused until resumed the same way.
+		target	Name or tag of the tasks and groups to resume, None resumes
+				the global signal
+		"""
+		if target is None:
+			self.__run.set()
+			if self.__process_run is not None:
+				self.__process_run.set()
+		else:
+			for name in self.__select(target):
+				if name in self.__groups:
+					self.__groups[name].resume()
+				else:
+					self.__pauses[name].set()
+		self.__loop.interrupt()
+
+	def suspended(self, name):
+		"""
+		Returns True if the task or group "name" is paused by name or tag.
+		"""
+		if name in self.__groups:
+			return self.__groups[name].suspended()
+		if name not in self.__pauses:
+			raise ValueError('No task named "' + name + '"')
+		return not self.__pauses[name].is_set()
+
+	def drain(self, target, timeout = None):
+		"""
+		Pauses the tasks and groups with the name or tag "target" once they
+		are idle. Groups first finish their queued items, tasks finish the
+		current iteration of work(). Returns False if the timeout expired
+		before all of them were drained.
+		timeout		Seconds to wait in total, None waits forever
+		"""
+		deadline = None
+		if timeout is not None:
+			deadline = time.time() + timeout
+		names = self.__select(target)
+		for name in names:
+			if name in self.__groups:
+				remaining = None
+				if deadline is not None:
+					remaining = max(deadline - time.time(), 0)
+				if not self.__groups[name].drain(remaining):
+					return False
+			else:
+				self.__pauses[name].clear()
+		self.__timer.interrupt()
+		self.__loop.interrupt()
+		delay = 0.001
+		while any(self.__tasks[name]._busy() for name in names if name in self.__tasks):
+			if deadline is not None and time.time() >= deadline:
+				return False
+			time.sleep(delay)
+			delay = min(delay * 2, 0.05)
+		return True
+
+	def tags(self, name):
+		"""
+		Returns the set of tags of the task or group "name".
+		"""
+		return set(self.__tags.get(name, ()))
+
+	def __select(self, target):
+		"""
+		Returns the names of the tasks and groups with the name or tag
+		"target", raises ValueError if there are none.
+		"""
+		names = [name for name, tags in self.__tags.items() if name == target or target in tags]
+		if not names:
+			raise ValueError('No task or tag named "' + target + '"')
+		return names
+
+	def stop(self, timeout = None):
+		"""
+		Halts all the threads by setting the halt signal. Then joins the
+		threads, processes and coroutines started by the TaskManager within
+		one overall deadline, while they run their _finalize() methods
+		concurrently. Returns True when all halted, see stragglers() for the
+		ones that didn't.
+		timeout		Seconds to wait, defaults to KILL_RANGE
+		"""
+		if timeout is None:
+			timeout = TaskManager.KILL_RANGE
+		deadline = time.time() + timeout
 		logger.info('Halt all threads')
 		self.__halt.set()
+		# Tasks suspended by name or tag wake up to halt too
+		for run in self.__pauses.values():
+			run.set()
 		self.__run.set()
+		if self.__process_signal is not None:
+			self.__process_halt.set()
+			self.__process_run.set()
+		for group in self.__groups.values():
+			group.halt()
+		self.__timer.stop()
+		self.__loop.interrupt()
+		with self.__lock:
+			for channel in self.__channels.values():
+				channel.close()
+			for topic in self.__topics.values():
+				topic.close()
 
-		for i in range(TaskManager.KILL_RANGE):
-			if threading.active_count() > 1:
-				time.sleep(1)
-			else:
-				logger.info('All threads halted')
-				return True
-		logger.error('Couldn\'t halt all threads')
+		threads = self.__threads.items()
+		for group in self.__groups.values():
+			threads.extend(group.threads().items())
+		for name, thread in threads:
+			thread.join(max(deadline - time.time(), 0))
+		for name, process in self.__processes.items():
+			process.join(max(deadline - time.time(), 0))
+		for name, future in self.__coroutines.items():
+			try:
+				future.exception(max(deadline - time.time(), 0))
+			except Exception:
+				pass
+
+		stragglers = {}
+		frames = sys._current_frames()
+		for name, thread in threads:
+			if thread.is_alive():
+				frame = frames.get(thread.ident)
+				stragglers[name] = ''.join(traceback.format_stack(frame)) if frame else ''
+		for name, process in self.__processes.items():
+			if process.is_alive():
+				stragglers[name] = 'Process pid %d' % process.pid
+		for name, future in self.__coroutines.items():
+			if not future.done():
+				stragglers[name] = 'Coroutine'
+		self.__stragglers = stragglers
+		if not stragglers:
+			self.__loop.stop()
+			logger.info('All threads halted')
+			return True
+		for name in stragglers:
+			logger.error('Couldn\'t halt thread: %s\n%s', name, stragglers[name])
 		return False
 
-	def setup(self, task, args = {}):
+	def stragglers(self):
+		"""
+		Returns a dictionary with the name and stack at the last stop() of
+		every thread, process and coroutine that didn't halt.
+		"""
+		return dict(self.__stragglers)
+
+	def stats(self):
+		"""
+		Returns a snapshot of the runtime metrics of all tasks and groups, see
+		TaskStats.combine(). Tasks running in process mode are measured in
+		their child process and report no metrics.
+		"""
+		return {
+			'tasks': dict((name, task.stats().snapshot()) for name, task in self.__tasks.items()),
+			'groups': dict((name, group.stats()) for name, group in self.__groups.items()),
+		}
+
+	def get(self, name):
+		"""
+		Returns a registered Task or TaskGroup by name, or None.
+		"""
+		if name in self.__groups:
+			return self.__groups[name]
+		return self.__tasks.get(name)
+
+	def __coroutine_done(self, name):
+		"""
+		Returns a Future callback that reports and supervises crashed
+		coroutines.
+		"""
+		def done(future):
+			try:
+				future.result(0)
+			except Exception:
+				self.__tasks[name].stats().error()
+				self.__tasks[name].stats().stop()
+				logger.critical('AsyncTask.coroutine(), Unhandled exception: (%s)', name, exc_info=True)
+				self.__crashed(self.__tasks[name])
+		return done
+
+	def __crashed(self, task):
+		"""
+		Supervisor callback for crashed tasks, schedules a restart after the
+		backoff or escalates.
+		"""
+		self.__supervise(task.name(), self.__restart, task)
+
+	def __group_crashed(self, group):
 		"""
-		Registers a Task and initializes a thread for the run() method.
+		Supervisor callback for TaskGroups with a crashed worker.
+		"""
+		self.__supervise(group.name(), group._restart)
+
+	def __supervise(self, name, restart, *args):
+		if self.__halt.is_set():
+			return
+		delay = self.__supervisor.crashed(name)
+		if delay is None:
+			self.__escalate(name)
+			return
+		with self.__restart_lock:
+			if name in self.__restarting:
+				# The scheduled restart replaces every crashed worker
+				return
+			self.__restarting.add(name)
+			logger.warning('Restarting %s in %.3f seconds', name, delay)
+			self.__loop.start()
+			self.__loop.call_later(delay, self.__restarted, name, restart, *args)
+
+	def __restarted(self, name, restart, *args):
+		"""
+		Runs a scheduled restart under the restart lock, so restarts of a
+		task can't overlap.
+		"""
+		with self.__restart_lock:
+			self.__restarting.discard(name)
+			restart(*args)
+
+	def __escalate(self, name):
+		"""
+		Called when the restart intensity of a task is exceeded, asks the
+		process to terminate.
+		"""
+		logger.critical('Restart intensity exceeded by %s, terminating process', name)
+		os.kill(os.getpid(), signal.SIGTERM)
+
+	def __restart(self, task):
 		"""
-		if not isinstance(task, Task):
+		Restarts a crashed task in a new thread or coroutine.
+		"""
+		if self.__halt.is_set():
+			return
+		if isinstance(task, AsyncTask):
+			self.__start_coroutine(task)
+			return
+		thread = self.__threads.get(task.name())
+		if thread is not None and thread.is_alive():
+			# The crashed thread is still returning, with no backoff
+			self.__restarting.add(task.name())
+			self.__loop.call_later(0.01, self.__restarted, task.name(), self.__restart, task)
+			return
+		self.__start_thread(task, {})
+
+	def __start_thread(self, task, args):
+		thread = threading.Thread(target=task.run, name=task.name(), args=args)
+		thread.start()
+		self.__threads[task.name()] = thread
+
+	def __start_coroutine(self, task):
+		self.__loop.start()
+		future = self.__loop.spawn(task.coroutine(self.__loop))
+		future.add_done_callback(self.__coroutine_done(task.name()))
+		self.__coroutines[task.name()] = future
+
+	def __layer(self, task, run, halt):
+		"""
+		Binds the task to its own run signal layered under the Signal it was
+		created with.
+		"""
+		run.set()
+		self.__pauses[task.name()] = run
+		task._bind(Signal(halt=halt, run=run, parent=task._signal()))
+
+	def _reconfigured(self, old, new):
+		"""
+		Applies a reloaded "supervisor" section and resizes the TaskGroups
+		whose number of workers changed in the "groups" section.
+		"""
+		if old.get('supervisor') != new.get('supervisor'):
+			self.__supervisor.configure(**(new.get('supervisor') or {}))
+			logger.info('Supervisor reconfigured')
+		for name, cc in (new.get('groups') or {}).items():
+			group = self.__groups.get(name)
+			workers = (cc or {}).get('workers')
+			if group is not None and workers and workers != group.size():
+				group.resize(workers)
+
+	def supervisor(self):
+		"""
+		Returns the Supervisor holding the restart history.
+		"""
+		return self.__supervisor
+
+	def setup(self, task, args = {}, mode = 'thread', tags = ()):
+		"""
+		Registers a Task and initializes a thread for the run() method. A
+		TaskGroup is registered and its worker threads are started.
+		task	A Task or TaskGroup instance
+		args	Arguments for the run() method
+		mode	"thread" or "process", in process mode a Task runs in a child
+				process listening to get_process_signal(), without restarts,
+				and a TaskGroup runs work() in one child process per worker
+		tags	Tags for suspending, resuming and draining several tasks at
+				once, a string is a single tag
+		"""
+		if not isinstance(task, (Task, TaskGroup)):
 			raise TypeError('Not a Task')
-		elif task.name() in self.__tasks:
+		elif mode not in ('thread', 'process'):
+			raise ValueError('mode must be "thread" or "process"')
+		elif isinstance(task, AsyncTask) and mode != 'thread':
+			raise ValueError('AsyncTask can\'t run in process mode')
+		elif task.name() in self.__tasks or task.name() in self.__groups:
 			raise RuntimeError('Task already exists')
+		if isinstance(tags, basestring):
+			tags = (tags,)
+		self.__tags[task.name()] = frozenset(tags)
+		if isinstance(task, AsyncTask):
+			logger.info('Starting coroutine: %s', task.name())
+			self.__tasks[task.name()] = task
+			self.__layer(task, threading.Event(), self.__halt)
+			self.__start_coroutine(task)
+			logger.info('Coroutine started: %s', task.name())
+		elif isinstance(task, TaskGroup):
+			logger.info('Starting group: %s', task.name())
+			self.__groups[task.name()] = task
+			workers = ((self._config('groups') or {}).get(task.name()) or {}).get('workers')
+			if workers:
+				task.resize(workers)
+			task.start(mode, self.__group_crashed)
+			logger.info('Group started: %s, %d workers', task.name(), task.size())
+		elif mode == 'process':
+			logger.info('Starting process: %s', task.name())
+			self.__tasks[task.name()] = task
+			parent = self.get_process_signal()
+			run = multiprocessing.Event()
+			run.set()
+			self.__pauses[task.name()] = run
+			sig = Signal(halt=self.__process_halt, run=run, parent=parent)
+			process = multiprocessing.Process(target=run_task, name=task.name(), args=(task, sig))
+			process.start()
+			self.__processes[task.name()] = process
+			logger.info('Process started: %s, pid %d', task.name(), process.pid)
 		else:
 			logger.info('Starting thread: %s', task.name())
 			self.__tasks[task.name()] = task
-			thread = threading.Thread(target=task.run, name=task.name(), args=args)
-			thread.start()
+			self.__layer(task, threading.Event(), self.__halt)
+			task._supervise(self.__crashed)
+			self.__start_thread(task, args)
 			logger.info('Thread started: %s', task.name())
@@ -0,0 +1,119 @@
+import threading
+import traceback
+from ..common import logger
+from ..jobs import JobQueue
+from ..task import Task, TaskGroup
+
+"""
+The jobs.py module containes the JobDispatcher task that feeds the jobs of a
+JobQueue to a TaskGroup.
+"""
+
+class JobDispatcher(Task):
+	"""
+	JobDispatcher claims jobs from a JobQueue in batches and submits them to
+	the workers of a TaskGroup, whose work() is called with each Job tuple.
+	Jobs whose work() returns are acknowledged, jobs whose work() raises are
+	retried with backoff, the results are written back in batches too.
+
+	At most "batch" jobs are in flight at once, so the queue of the group
+	should hold at least "batch" items. The dispatcher polls the JobQueue
+	every "poll" seconds while it is empty. Jobs in flight when the
+	dispatcher halts are claimed again after their visibility timeout.
+	"""
+	NAME = 'JobDispatcher'
+	def __init__(self, name, sig, queue, group, batch = 100, poll = 0.5):
+		"""
+		name	A string with the Task name
+		sig		The Signal class instance to listen too
+		queue	The JobQueue to claim jobs from
+		group	The TaskGroup running the jobs
+		batch	Maximum number of jobs claimed and in flight at once
+		poll	Seconds between claims while the queue is empty
+		"""
+		Task.__init__(self, name, sig)
+		if not isinstance(queue, JobQueue):
+			raise TypeError('queue not JobQueue')
+		if not isinstance(group, TaskGroup):
+			raise TypeError('group not TaskGroup')
+		if batch < 1:
+			raise ValueError('batch must be at least 1')
+		self.__queue = queue
+		self.__group = group
+		self.__batch = batch
+		self.__poll = poll
+		self.__lock = threading.Lock()
+		self.__done = threading.Event()
+		self.__acks = []
+		self.__nacks = []
+		self.__flight = 0
+		self.__counters = {'claimed': 0, 'acked': 0, 'failed': 0}
+
+	def counters(self):
+		"""
+		Returns a dictionary with the number of claimed, acknowledged and
+		failed jobs, and the number of jobs in flight.
+		"""
+		with self.__lock:
+			counters = dict(self.__counters)
+			counters['in_flight'] = self.__flight
+		return counters
+
+	def _finalize(self):
+		"""
+		Writes back the results of the finished jobs.
+		"""
+		self.__flush()
+
+	def work(self):
+		self.__flush()
+		with self.__lock:
+			free = self.__batch - self.__flight
+		if free < self.__batch / 2:
+			# Wait for the workers instead of claiming small batches
+			self.__done.wait(self.__poll)
+			self.__done.clear()
+			return
+		jobs = self.__queue.claim(free)
+		if not jobs:
+			self._idle(self.__poll)
+			return
+		with self.__lock:
+			self.__flight += len(jobs)
+			self.__counters['claimed'] += len(jobs)
+		for job, future in zip(jobs, self.__group.submit_batch(jobs)):
+			future.add_done_callback(lambda future, job=job: self.__finished(job, future))
+
+	def __finished(self, job, future):
+		"""
+		Future callback, queues the job for acknowledgement or retry.
+		"""
+		error = future.exception(0)
+		with self.__lock:
+			self.__flight -= 1
+			if error is None:
+				self.__acks.append(job)
+			else:
+				self.__nacks.append((job, ''.join(traceback.format_exception_only(type(error), error)).strip()))
+		self.__done.set()
+
+	def __flush(self):
+		"""
+		Acknowledges the finished jobs and returns the failed ones to the
+		queue.
+		"""
+		with self.__lock:
+			acks, self.__acks = self.__acks, []
+			nacks, self.__nacks = self.__nacks, []
+		if acks:
+			self.__queue.ack(acks)
+		failed = {}
+		for job, error in nacks:
+			failed.setdefault(error, []).append(job)
+		for error, jobs in failed.items():
+			self.__queue.nack(jobs, error)
+		with self.__lock:
+			self.__counters['acked'] += len(acks)
+			self.__counters['failed'] += len(nacks)
+		if nacks:
+			logger.info('Job dispatcher %s, %d jobs failed', self.name(), len(nacks))
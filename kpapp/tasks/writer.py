@@ -0,0 +1,153 @@
+import sys
+import time
+from ..channel import Channel, ChannelClosed
+from ..common import logger
+from ..future import Future
+from ..task import Task
+
+"""
+The writer.py module containes the Writer task that commits writes to a
+database in batched transactions.
+"""
+
+class Writer(Task):
+	"""
+	Writer is a write-behind Task for one Database. Writes from any thread are
+	queued on a Channel and committed together in one transaction when
+	"max_batch" writes are queued or the oldest has waited "max_delay"
+	seconds. Every write runs in its own savepoint, so a failing write only
+	fails its own Future, the Futures of the others resolve on commit.
+
+	The Writer stops when its Channel is closed, after committing the queued
+	writes. The TaskManager closes its named channels on stop().
+	"""
+	NAME = 'Writer'
+	POLL = 0.1
+	def __init__(self, name, sig, db, channel, max_batch = 500, max_delay = 0.01):
+		"""
+		name		A string with the Task name
+		sig			The Signal class instance to listen too
+		db			The Database to write to
+		channel		The Channel to queue writes on
+		max_batch	Maximum number of writes per transaction
+		max_delay	Maximum seconds a write waits for its transaction
+		"""
+		Task.__init__(self, name, sig)
+		if not isinstance(channel, Channel):
+			raise TypeError('channel not Channel')
+		if max_batch < 1:
+			raise ValueError('max_batch must be at least 1')
+		self.__db = db
+		self.__channel = channel
+		self.__max_batch = max_batch
+		self.__max_delay = max_delay
+		self.__batches = 0
+		self.__writes = 0
+
+	def call(self, fn, *args):
+		"""
+		Queues fn(database, *args) to run in the next transaction, database
+		is the peewee database. Returns a Future with the return value of fn,
+		resolved when the transaction is committed.
+		"""
+		future = Future()
+		self.__channel.put((fn, args, future))
+		return future
+
+	def execute(self, sql, params = ()):
+		"""
+		Queues a SQL statement, returns a Future with the number of changed
+		rows.
+		"""
+		return self.call(self.__execute, sql, params)
+
+	def execute_many(self, sql, rows):
+		"""
+		Queues a SQL statement to execute once for every parameter tuple in
+		"rows", returns a Future with the number of changed rows.
+		"""
+		return self.call(self.__execute_many, sql, list(rows))
+
+	def pending(self):
+		"""
+		Returns the number of queued writes.
+		"""
+		return self.__channel.qsize()
+
+	def counters(self):
+		"""
+		Returns a dictionary with the number of committed transactions and
+		writes.
+		"""
+		return {'batches': self.__batches, 'writes': self.__writes}
+
+	def _finalize(self):
+		"""
+		Commits the writes still queued when the task halts.
+		"""
+		try:
+			ops = self.__channel.get_batch(self.__max_batch, 0)
+			while ops:
+				self.__commit(ops)
+				ops = self.__channel.get_batch(self.__max_batch, 0)
+		except ChannelClosed:
+			pass
+
+	def work(self):
+		try:
+			ops = self.__channel.get_batch(self.__max_batch, self.POLL)
+		except ChannelClosed:
+			self._done()
+			return
+		if not ops:
+			return
+		deadline = time.time() + self.__max_delay
+		while len(ops) < self.__max_batch:
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				break
+			try:
+				ops.extend(self.__channel.get_batch(self.__max_batch - len(ops), remaining))
+			except ChannelClosed:
+				break
+		self.__commit(ops)
+
+	def __commit(self, ops):
+		"""
+		Runs the writes in one transaction and resolves their Futures after
+		the commit.
+		"""
+		if not ops:
+			return
+		results = []
+		try:
+			with self.__db.atomic() as conn:
+				for fn, args, future in ops:
+					try:
+						with conn.atomic():
+							results.append((future, fn(conn, *args), None))
+					except Exception:
+						results.append((future, None, sys.exc_info()))
+		except Exception:
+			logger.error('Writer %s, transaction failed', self.name(), exc_info=True)
+			exc_info = sys.exc_info()
+			for fn, args, future in ops:
+				future.set_exception(exc_info)
+			return
+		self.__batches += 1
+		self.__writes += len(ops)
+		for future, result, exc_info in results:
+			if exc_info is None:
+				future.set_result(result)
+			else:
+				future.set_exception(exc_info)
+
+	@staticmethod
+	def __execute(conn, sql, params):
+		return conn.execute_sql(sql, params).rowcount
+
+	def __execute_many(self, conn, sql, rows):
+		self.__db.invalidate(sql)
+		cursor = conn.cursor()
+		cursor.executemany(sql, rows)
+		return cursor.rowcount
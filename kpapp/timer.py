@@ -0,0 +1,103 @@
+import heapq
+import itertools
+import threading
+import time
+
+"""
+The timer.py module containes the Timer class, a central deadline scheduler
+used by the TaskManager to wake up idling tasks.
+"""
+
+class Timer:
+	"""
+	Timer is a heap based deadline scheduler. Threads that want to sleep
+	register a deadline and block on an event, one single timer thread wakes
+	them up when their deadline is reached. All sleepers can be interrupted at
+	once, which is used on halt and suspend.
+	"""
+	def __init__(self, name = 'Timer'):
+		"""
+		name	A string with the name of the timer thread
+		"""
+		self.__name = name
+		self.__heap = []
+		self.__seq = itertools.count()
+		self.__cond = threading.Condition()
+		self.__thread = None
+		self.__stopped = False
+
+	def schedule(self, deadline):
+		"""
+		Registers an absolute deadline (time.time() based) and returns a
+		threading.Event that will be set when the deadline is reached or the
+		timer is interrupted. The timer thread is started on demand.
+		deadline	A float timestamp
+		"""
+		event = threading.Event()
+		with self.__cond:
+			if self.__stopped or deadline <= time.time():
+				event.set()
+				return event
+			heapq.heappush(self.__heap, (deadline, next(self.__seq), event))
+			if self.__thread is None or not self.__thread.is_alive():
+				self.__thread = threading.Thread(target=self.__loop, name=self.__name)
+				self.__thread.daemon = True
+				self.__thread.start()
+			elif self.__heap[0][2] is event:
+				self.__cond.notify()
+		return event
+
+	def sleep(self, deadline):
+		"""
+		Blocks the calling thread until deadline or interruption. Returns True
+		if the deadline was reached.
+		deadline	A float timestamp
+		"""
+		self.schedule(deadline).wait()
+		return time.time() >= deadline
+
+	def interrupt(self):
+		"""
+		Wakes up all currently sleeping threads.
+		"""
+		with self.__cond:
+			heap = self.__heap
+			self.__heap = []
+			self.__cond.notify()
+		for entry in heap:
+			entry[2].set()
+
+	def pending(self):
+		"""
+		Returns the number of registered deadlines.
+		"""
+		with self.__cond:
+			return len(self.__heap)
+
+	def stop(self):
+		"""
+		Interrupts all sleepers and stops the timer thread. Deadlines scheduled
+		after stop will return immediately.
+		"""
+		with self.__cond:
+			self.__stopped = True
+			thread = self.__thread
+		self.interrupt()
+		if thread is not None and thread is not threading.current_thread():
+			thread.join()
+
+	def __loop(self):
+		"""
+		The timer thread, sleeps until the earliest deadline and wakes up the
+		expired entries.
+		"""
+		with self.__cond:
+			while not self.__stopped:
+				if not self.__heap:
+					self.__cond.wait()
+					continue
+				now = time.time()
+				while self.__heap and self.__heap[0][0] <= now:
+					heapq.heappop(self.__heap)[2].set()
+				if self.__heap:
+					self.__cond.wait(self.__heap[0][0] - now)
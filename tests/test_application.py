@@ -0,0 +1,114 @@
+import unittest
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from kpapp.application import Application
+from kpapp.common import conf, logger
+from kpapp.task import TaskGroup
+
+class App(Application):
+
+    def __init__(self, config = {}):
+        Application.__init__(self, config)
+        self.initialized = False
+        self.finalized = False
+
+    def _initialize(self):
+        self.initialized = True
+
+    def _finalize(self):
+        self.finalized = True
+        Application._finalize(self)
+
+class TestApplicationRun(unittest.TestCase):
+
+    def test_shutdown(self):
+        app = App()
+        thread = threading.Thread(target=app.run)
+        thread.start()
+        time.sleep(0.05)
+        app.shutdown()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(app.initialized)
+        self.assertTrue(app.finalized)
+
+    def test_sigterm(self):
+        app = App()
+        previous = signal.getsignal(signal.SIGTERM)
+        threading.Timer(0.05, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        start = time.time()
+        app.run()
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(app.finalized)
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous)
+
+    def test_async_logging(self):
+        handlers = [type(h) for h in logger.handlers]
+        app = App({'Log': {'async': True, 'batch': 10}})
+        threading.Timer(0.05, app.shutdown).start()
+        app.run()
+        self.assertTrue(app.finalized)
+        self.assertEqual([type(h) for h in logger.handlers], handlers)
+
+    def test_sighup(self):
+        app = App()
+        reloads = []
+        app.reload = lambda config=None: reloads.append(config)
+        threading.Timer(0.05, os.kill, (os.getpid(), signal.SIGHUP)).start()
+        threading.Timer(0.2, app.shutdown).start()
+        app.run()
+        self.assertEqual(reloads, [None])
+        self.assertTrue(app.finalized)
+
+    def test_no_watch(self):
+        app = App({'Application': {'watch_config': False}})
+        threading.Timer(0.3, app.shutdown).start()
+        start = time.clock()
+        app.run()
+        self.assertTrue(time.clock() - start < 0.15)
+
+class TestReload(unittest.TestCase):
+
+    def test_reload(self):
+        app = App({'TaskManager': {'groups': {'pool': {'workers': 1}}}, 'Other': {'x': 1}})
+        tm = app.task_manager()
+        group = TaskGroup('pool', tm.get_signal())
+        tm.setup(group)
+        try:
+            changed = app.reload({'TaskManager': {'groups': {'pool': {'workers': 3}},
+                                                  'supervisor': {'max_restarts': 1}},
+                                  'Other': {'x': 1}})
+            self.assertEqual(changed, set(['TaskManager']))
+            self.assertEqual(group.size(), 3)
+            self.assertTrue(app.task_manager() is tm)
+            self.assertEqual(app.reload(None), set())
+        finally:
+            tm.stop()
+
+class TestOpenDatabases(unittest.TestCase):
+
+    def test_parallel(self):
+        path = tempfile.mkdtemp()
+        try:
+            rel = '/' + os.path.relpath(path, conf.app_dir())
+            app = App({
+                'Application': {'open_databases': 'parallel'},
+                'DatabaseManager': dict(
+                    (name, {'type': 'sqlite', 'class': 'kpapp.db.Database', 'path': rel + '/' + name + '.db'})
+                    for name in ('a', 'b')),
+            })
+            threading.Timer(0.05, app.shutdown).start()
+            app.run()
+            self.assertTrue(app.initialized)
+            self.assertTrue(os.path.exists(path + '/a.db'))
+            self.assertTrue(os.path.exists(path + '/b.db'))
+        finally:
+            shutil.rmtree(path)
+
+if __name__ == '__main__':
+    unittest.main()
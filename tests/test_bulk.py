@@ -0,0 +1,124 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from kpapp.common import conf
+from kpapp.db import DatabaseManager
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        path = '/' + os.path.relpath(self.path, conf.app_dir())
+        self.dm = DatabaseManager({
+            'db': {'type': 'sqlite', 'class': 'kpapp.db.Database', 'path': path + '/db.db', 'pool': {}},
+        })
+        self.db = self.dm.get('db')
+        with self.db.atomic() as conn:
+            conn.execute_sql('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT, price REAL)')
+        with open(self.path + '/items.csv', 'wb') as f:
+            f.write('id,name,price\n')
+            for i in range(1, 101):
+                f.write('%d,item-%d,%s\n' % (i, i, '' if i % 10 == 0 else '%d.5' % i))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def count(self):
+        return self.db.select('SELECT COUNT(*) FROM item')[0][0]
+
+    def test_csv(self):
+        progress = []
+        bulk = self.dm.bulk('db')
+        self.assertEqual(bulk.load('item', self.path + '/items.csv', batch=30, relax=True, progress=progress.append), 100)
+        self.assertEqual(progress, [30, 60, 90, 100])
+        self.assertEqual(self.count(), 100)
+        self.assertEqual(self.db.select('SELECT name, price FROM item WHERE id = 10'), [(u'item-10', None)])
+        with self.db.read() as conn:
+            self.assertNotEqual(conn.execute_sql('PRAGMA synchronous').fetchone()[0], 0)
+        self.assertEqual(bulk.dump('SELECT * FROM item ORDER BY id', self.path + '/out.csv', chunk=7), 100)
+        with open(self.path + '/out.csv', 'rb') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'id,name,price')
+        self.assertEqual(lines[1], '1,item-1,1.5')
+        self.assertEqual(lines[10], '10,item-10,')
+
+    def test_readers(self):
+        counts = []
+        def progress(count):
+            reader = threading.Thread(target=lambda: counts.append(self.count()))
+            reader.start()
+            reader.join(5)
+        self.dm.bulk('db').load('item', self.path + '/items.csv', batch=40, progress=progress)
+        self.assertEqual(counts, [40, 80, 100])
+
+    def test_dump_writers(self):
+        with self.db.atomic() as conn:
+            conn.execute_sql('CREATE TABLE other (x INTEGER)')
+        self.dm.bulk('db').load('item', self.path + '/items.csv')
+        written = []
+        def progress(count):
+            def write():
+                with self.db.atomic() as conn:
+                    conn.execute_sql('INSERT INTO other VALUES (?)', (count,))
+                written.append(count)
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join(5)
+        bulk = self.dm.bulk('db')
+        self.assertEqual(bulk.dump('SELECT * FROM item', self.path + '/out.csv', chunk=40, progress=progress), 100)
+        self.assertEqual(written, [40, 80, 100])
+        self.assertEqual(bulk.dump('SELECT id, name FROM item', self.path + '/out.jsonl', chunk=30, key='id'), 100)
+        with open(self.path + '/out.jsonl') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row['id'] for row in rows], range(1, 101))
+
+    def test_jsonl(self):
+        bulk = self.dm.bulk('db')
+        with open(self.path + '/items.jsonl', 'wb') as f:
+            for i in range(1, 21):
+                f.write(json.dumps({'id': i, 'name': 'item-%d' % i}) + '\n')
+        self.assertEqual(bulk.load('item', self.path + '/items.jsonl'), 20)
+        self.assertEqual(bulk.dump('SELECT id, name FROM item WHERE id > ?', self.path + '/out.jsonl', params=(15,)), 5)
+        with open(self.path + '/out.jsonl') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[0], {'id': 16, 'name': 'item-16'})
+
+    def test_resume(self):
+        bulk = self.dm.bulk('db')
+        checkpoint = self.path + '/items.checkpoint'
+        with self.db.atomic() as conn:
+            conn.execute_sql('INSERT INTO item VALUES (45, \'taken\', NULL)')
+        self.assertRaises(Exception, bulk.load, 'item', self.path + '/items.csv', batch=20, checkpoint=checkpoint)
+        self.assertEqual(self.count(), 41)
+        with open(checkpoint) as f:
+            self.assertEqual(f.read(), '40')
+        with self.db.atomic() as conn:
+            conn.execute_sql('DELETE FROM item WHERE id = 45')
+        self.assertEqual(bulk.load('item', self.path + '/items.csv', batch=20, checkpoint=checkpoint), 60)
+        self.assertEqual(self.count(), 100)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_blank_lines(self):
+        bulk = self.dm.bulk('db')
+        checkpoint = self.path + '/blank.checkpoint'
+        with open(self.path + '/blank.csv', 'wb') as f:
+            f.write('id,name\n1,a\n\n2,b\n\n\n3,c\n')
+        with self.db.atomic() as conn:
+            conn.execute_sql('INSERT INTO item VALUES (3, \'taken\', NULL)')
+        self.assertRaises(Exception, bulk.load, 'item', self.path + '/blank.csv', batch=2, checkpoint=checkpoint)
+        with open(checkpoint) as f:
+            self.assertEqual(f.read(), '2')
+        with self.db.atomic() as conn:
+            conn.execute_sql('DELETE FROM item WHERE id = 3')
+        self.assertEqual(bulk.load('item', self.path + '/blank.csv', batch=2, checkpoint=checkpoint), 1)
+        self.assertEqual(self.db.select('SELECT id, name FROM item ORDER BY id'), [(1, u'a'), (2, u'b'), (3, u'c')])
+
+    def test_format(self):
+        self.assertRaises(ValueError, self.dm.bulk('db').load, 'item', self.path + '/items.txt')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import time
+
+from kpapp.cache import QueryCache, read_tables, written_tables
+
+class TestTables(unittest.TestCase):
+
+    def test_read(self):
+        sql = 'SELECT "t1"."id" FROM "person" AS "t1" INNER JOIN "pet" AS "t2" ON ("t2"."owner_id" = "t1"."id")'
+        self.assertEqual(read_tables(sql), set(['person', 'pet']))
+        sql = 'SELECT a.x, b.y FROM a, main.b AS bb, (SELECT z FROM c), d WHERE a.id = bb.id'
+        self.assertEqual(read_tables(sql), set(['a', 'b', 'c', 'd']))
+        sql = "SELECT x FROM a JOIN b ON a.id = b.id, c WHERE x IN (SELECT y FROM e) AND s = 'FROM f'"
+        self.assertEqual(read_tables(sql), set(['a', 'b', 'c', 'e']))
+
+    def test_written(self):
+        self.assertEqual(written_tables('INSERT INTO "person" ("name") VALUES (?)'), set(['person']))
+        self.assertEqual(written_tables('UPDATE person SET name = ?'), set(['person']))
+        self.assertEqual(written_tables('DELETE FROM "pet" WHERE id = ?'), set(['pet']))
+        self.assertEqual(written_tables('INSERT OR REPLACE INTO pet VALUES (1)'), set(['pet']))
+        self.assertEqual(written_tables('SELECT * FROM pet'), set())
+        self.assertEqual(written_tables('COMMIT'), set())
+        self.assertTrue(written_tables('VACUUM') is None)
+        self.assertEqual(written_tables('WITH s AS (SELECT x FROM a) SELECT * FROM s'), set())
+        self.assertEqual(written_tables('WITH s(x) AS (SELECT x FROM a) INSERT INTO b SELECT x FROM s'), set(['b']))
+        self.assertEqual(written_tables('WITH s AS (SELECT 1) DELETE FROM b WHERE id IN s'), set(['b']))
+        self.assertTrue(written_tables('WITH s AS (SELECT 1)') is None)
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = QueryCache(size=2)
+        cache.put('SELECT 1 FROM a', (), [1])
+        cache.put('SELECT 2 FROM a', (), [2])
+        self.assertEqual(cache.get('SELECT 1 FROM a'), [1])
+        cache.put('SELECT 3 FROM a', (), [3])
+        self.assertTrue(cache.get('SELECT 2 FROM a') is None)
+        self.assertEqual(cache.get('SELECT 1 FROM a'), [1])
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_ttl(self):
+        cache = QueryCache()
+        cache.put('SELECT * FROM a', (1,), [1], ttl=0.01)
+        self.assertEqual(cache.get('SELECT * FROM a', (1,)), [1])
+        self.assertTrue(cache.get('SELECT * FROM a', (2,)) is None)
+        time.sleep(0.02)
+        self.assertTrue(cache.get('SELECT * FROM a', (1,)) is None)
+        self.assertEqual(cache.stats()['expired'], 1)
+
+    def test_invalidate(self):
+        cache = QueryCache()
+        cache.put('SELECT * FROM a JOIN b', (), [1])
+        cache.put('SELECT * FROM c', (), [2])
+        self.assertEqual(cache.invalidate(['B']), 1)
+        self.assertTrue(cache.get('SELECT * FROM a JOIN b') is None)
+        self.assertEqual(cache.get('SELECT * FROM c'), [2])
+        self.assertEqual(cache.invalidate(), 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
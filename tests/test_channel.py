@@ -0,0 +1,109 @@
+import unittest
+import threading
+import time
+import Queue
+
+from kpapp.channel import Channel, Topic, ChannelClosed
+from kpapp.task import TaskManager
+
+class TestChannel(unittest.TestCase):
+
+    def test_batch(self):
+        channel = Channel('test')
+        self.assertEqual(channel.put_batch(range(10)), 10)
+        self.assertEqual(channel.get_batch(4), [0, 1, 2, 3])
+        self.assertEqual(channel.get_batch(), range(4, 10))
+        self.assertEqual(channel.stats()['get'], 10)
+
+    def test_timeout(self):
+        channel = Channel('test', size=1)
+        self.assertRaises(Queue.Empty, channel.get, 0.01)
+        self.assertEqual(channel.get_batch(10, 0.01), [])
+        self.assertTrue(channel.put(1))
+        self.assertFalse(channel.put(2, 0.01))
+
+    def test_block(self):
+        channel = Channel('test', size=2)
+        received = []
+        def consume():
+            while len(received) < 100:
+                received.extend(channel.get_batch(10))
+        thread = threading.Thread(target=consume)
+        thread.start()
+        self.assertEqual(channel.put_batch(range(100)), 100)
+        thread.join(5)
+        self.assertEqual(received, range(100))
+
+    def test_drop(self):
+        channel = Channel('test', size=2, policy='drop')
+        self.assertEqual(channel.put_batch([1, 2, 3]), 2)
+        self.assertEqual(channel.get_batch(), [1, 2])
+        self.assertEqual(channel.stats()['dropped'], 1)
+
+    def test_drop_oldest(self):
+        channel = Channel('test', size=2, policy='drop_oldest')
+        channel.put_batch([1, 2, 3])
+        self.assertEqual(channel.get_batch(), [2, 3])
+
+    def test_coalesce(self):
+        channel = Channel('test', size=2, policy='coalesce', key=lambda item: item[0])
+        channel.put_batch([('a', 1), ('b', 1), ('a', 2), ('c', 1)])
+        self.assertEqual(channel.get_batch(), [('b', 1), ('c', 1)])
+        stats = channel.stats()
+        self.assertEqual(stats['coalesced'], 1)
+        self.assertEqual(stats['dropped'], 1)
+
+    def test_coalesce_accepted(self):
+        channel = Channel('test', size=1, policy='coalesce', key=lambda item: item[0])
+        self.assertTrue(channel.put(('a', 1)))
+        self.assertTrue(channel.put(('a', 2)))
+        self.assertEqual(channel.put_batch([('a', 3), ('a', 4)]), 2)
+        self.assertEqual(channel.get_batch(), [('a', 4)])
+        topic = Topic('test')
+        topic.subscribe(size=1, policy='coalesce', key=lambda item: item[0])
+        self.assertEqual(topic.publish_batch([('a', 1), ('a', 2)]), 1)
+
+    def test_close(self):
+        channel = Channel('test')
+        threading.Timer(0.05, channel.close).start()
+        self.assertRaises(ChannelClosed, channel.get)
+        self.assertRaises(ChannelClosed, channel.put, 1)
+
+    def test_policy(self):
+        self.assertRaises(ValueError, Channel, 'test', 0, 'unknown')
+        self.assertRaises(ValueError, Channel, 'test', 0, 'coalesce')
+
+class TestTopic(unittest.TestCase):
+
+    def test_publish(self):
+        topic = Topic('test')
+        a = topic.subscribe()
+        b = topic.subscribe(size=1)
+        c = topic.subscribe(size=1, policy='drop')
+        self.assertEqual(topic.publish_batch([1, 2]), 2)
+        self.assertEqual(a.get_batch(), [1, 2])
+        self.assertEqual(b.get_batch(), [2])
+        self.assertEqual(c.get_batch(), [1])
+        topic.unsubscribe(c)
+        topic.unsubscribe(a)
+        self.assertEqual(topic.subscribers(), 1)
+        self.assertEqual(topic.publish(3), 1)
+        self.assertEqual(b.get(), 3)
+
+class TestTaskManagerChannels(unittest.TestCase):
+
+    def test_named(self):
+        tm = TaskManager()
+        channel = tm.channel('jobs', size=10)
+        self.assertTrue(tm.channel('jobs') is channel)
+        topic = tm.topic('events')
+        self.assertTrue(tm.topic('events') is topic)
+        subscriber = topic.subscribe()
+        threading.Timer(0.05, tm.stop).start()
+        start = time.time()
+        self.assertRaises(ChannelClosed, channel.get)
+        self.assertRaises(ChannelClosed, subscriber.get)
+        self.assertTrue(time.time() - start < 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,404 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from peewee import Model, TextField
+
+from kpapp.common import conf
+from kpapp.db import Database, DatabaseManager, SqlitePool
+from kpapp.rwlock import RWLock
+from kpapp.task import TaskManager
+
+class TestDatabaseManager(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        path = '/' + os.path.relpath(self.path, conf.app_dir())
+        self.config = {
+            'plain': {'type': 'sqlite', 'class': 'kpapp.db.Database', 'path': path + '/plain.db'},
+            'pooled': {'type': 'sqlite', 'class': 'kpapp.db.Database', 'path': path + '/pooled.db',
+                       'pool': {'max_connections': 4, 'idle_timeout': 60}},
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_plain(self):
+        db = DatabaseManager(self.config).get('plain')
+        self.assertFalse(isinstance(db.get(), SqlitePool))
+        with db as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+
+    def test_pool(self):
+        db = DatabaseManager(self.config).get('pooled')
+        pool = db.get()
+        self.assertTrue(isinstance(pool, SqlitePool))
+        with db as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+            self.assertEqual(conn.execute_sql('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(pool.in_use(), 0)
+        self.assertEqual(pool.idle(), 1)
+
+    def test_concurrent(self):
+        db = DatabaseManager(self.config).get('pooled')
+        with db as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+        inside = []
+        release = threading.Event()
+        def read():
+            with db.read() as conn:
+                inside.append(conn.execute_sql('SELECT COUNT(*) FROM t').fetchone()[0])
+                release.wait(5)
+        threads = [threading.Thread(target=read) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for i in range(200):
+            if len(inside) == 3:
+                break
+            time.sleep(0.01)
+        self.assertEqual(inside, [0, 0, 0])
+        self.assertEqual(db.get().in_use(), 3)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(db.get().in_use(), 0)
+        self.assertEqual(db.get().idle(), 3)
+        self.assertEqual(db.get().evict(0), 3)
+        self.assertEqual(db.get().idle(), 0)
+
+    def test_missing(self):
+        self.assertRaises(RuntimeError, DatabaseManager(self.config).get, 'unknown')
+
+    def test_atomic(self):
+        db = DatabaseManager(self.config).get('pooled')
+        with db.atomic() as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+        try:
+            with db.atomic() as conn:
+                conn.execute_sql('INSERT INTO t VALUES (1)')
+                raise ValueError
+        except ValueError:
+            pass
+        with db.read() as conn:
+            self.assertEqual(conn.execute_sql('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+        self.assertEqual(db.get().in_use(), 0)
+        self.assertFalse(db.stats()['writer'])
+
+    def test_cache(self):
+        self.config['pooled']['cache'] = {'size': 10, 'ttl': 60}
+        db = DatabaseManager(self.config).get('pooled')
+        with db.atomic() as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+            conn.execute_sql('CREATE TABLE u (x INTEGER)')
+        self.assertEqual(db.select('SELECT COUNT(*) FROM t'), [(0,)])
+        self.assertEqual(db.select('SELECT COUNT(*) FROM u'), [(0,)])
+        with db.atomic() as conn:
+            conn.execute_sql('INSERT INTO t VALUES (1)')
+        self.assertEqual(db.select('SELECT COUNT(*) FROM t'), [(1,)])
+        self.assertEqual(db.select('SELECT COUNT(*) FROM u'), [(0,)])
+        stats = db.stats()['cache']
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 3)
+        self.assertTrue(stats['invalidations'] >= 1)
+        sql = 'SELECT COUNT(*) FROM t, u'
+        self.assertEqual(db.select(sql), [(0,)])
+        with db.atomic() as conn:
+            conn.execute_sql('INSERT INTO u VALUES (1)')
+        self.assertEqual(db.select(sql), [(1,)])
+        with db.atomic() as conn:
+            conn.execute_sql('WITH s AS (SELECT 2) INSERT INTO u SELECT * FROM s')
+        self.assertEqual(db.select(sql), [(2,)])
+        with db.atomic() as conn:
+            conn.execute_sql('DELETE FROM u')
+        rows = db.select('SELECT COUNT(*) FROM u')
+        rows.append((2,))
+        self.assertEqual(db.select('SELECT COUNT(*) FROM u'), [(0,)])
+
+    def test_instrument(self):
+        self.config['pooled']['instrument'] = {'slow': 0}
+        dm = DatabaseManager(self.config)
+        db = dm.get('pooled')
+        with db.atomic() as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+            for i in range(5):
+                conn.execute_sql('INSERT INTO t VALUES (?)', (i,))
+        for i in range(3):
+            db.select('SELECT x FROM t WHERE x > ?', (i,))
+        top = dm.queries('pooled', 2)
+        self.assertEqual(len(top), 2)
+        self.assertTrue(top[0]['total'] >= top[1]['total'])
+        by_count = dict((q['sql'], q) for q in db.queries(10, 'count'))
+        self.assertEqual(by_count['INSERT INTO t VALUES (?)']['count'], 5)
+        self.assertEqual(by_count['INSERT INTO t VALUES (?)']['rows'], 5)
+        self.assertEqual(by_count['SELECT x FROM t WHERE x > ?']['rows'], 4 + 3 + 2)
+        stats = db.stats()
+        self.assertTrue(stats['queries']['statements'] >= 3)
+        self.assertEqual(stats['write_wait']['count'], 1)
+
+    def test_profile(self):
+        self.config['plain'].update({'profile': 'fast', 'synchronous': 'off', 'busy_timeout': 1})
+        self.config['pooled']['profile'] = 'safe'
+        dm = DatabaseManager(self.config)
+        with dm.get('plain').read() as conn:
+            self.assertEqual(conn.execute_sql('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute_sql('PRAGMA synchronous').fetchone()[0], 0)
+            self.assertEqual(conn.execute_sql('PRAGMA cache_size').fetchone()[0], -65536)
+            self.assertEqual(conn.execute_sql('PRAGMA temp_store').fetchone()[0], 2)
+            self.assertEqual(conn.execute_sql('PRAGMA busy_timeout').fetchone()[0], 1000)
+        with dm.get('pooled').read() as conn:
+            self.assertEqual(conn.execute_sql('PRAGMA synchronous').fetchone()[0], 2)
+            self.assertEqual(conn.execute_sql('PRAGMA busy_timeout').fetchone()[0], 5000)
+        self.config['plain']['profile'] = 'turbo'
+        self.assertRaises(RuntimeError, DatabaseManager(self.config).get, 'plain')
+        self.config['plain'].update({'profile': 'fast', 'mmap_size': '0; DROP TABLE t'})
+        self.assertRaises(RuntimeError, DatabaseManager(self.config).get, 'plain')
+
+    def test_open(self):
+        dm = DatabaseManager(self.config)
+        with dm.get('pooled').atomic() as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+        self.config['pooled']['warmup'] = ['SELECT * FROM t', ['SELECT x FROM t WHERE x > ?', [1]], 'INSERT INTO t VALUES (1)']
+        timings = dm.open(parallel=True)
+        self.assertEqual(sorted(timings.keys()), ['plain', 'pooled'])
+        pool = dm.get('pooled').get()
+        self.assertEqual(pool.in_use(), 0)
+        self.assertEqual(pool.idle(), 1)
+        self.assertEqual(dm.get('pooled').select('SELECT COUNT(*) FROM t'), [(0,)])
+        self.assertFalse(dm.get('plain').get().is_closed())
+        by_sql = dict((q['sql'], q) for q in dm.queries('pooled', 10))
+        self.assertTrue('SELECT x FROM t WHERE x > ?' in by_sql)
+        self.assertTrue('EXPLAIN INSERT INTO t VALUES (1)' in by_sql)
+        self.config['pooled']['warmup'] = ['SELECT * FROM missing']
+        self.assertRaises(RuntimeError, DatabaseManager(self.config).open, None, True)
+
+    def test_reconfigure(self):
+        self.config['pooled']['cache'] = {'size': 10}
+        dm = DatabaseManager(self.config)
+        db = dm.get('pooled')
+        with db.atomic() as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER)')
+        for i in range(5):
+            db.select('SELECT * FROM t WHERE x = ?', (i,))
+        with db.read():
+            thread = threading.Thread(target=lambda: db.select('SELECT COUNT(*) FROM t'))
+            thread.start()
+            thread.join()
+        pool = db.get()
+        self.assertEqual(pool.idle(), 2)
+        config = dict(self.config)
+        config['pooled'] = dict(self.config['pooled'], cache={'size': 2}, synchronous='off',
+                                pool={'max_connections': 1}, path='/moved.db')
+        dm.reconfigure(config)
+        self.assertTrue(dm.get('pooled') is db)
+        self.assertEqual(db.stats()['cache']['size'], 2)
+        self.assertEqual(db.queries(10, 'count')[0]['count'], 5)
+        self.assertEqual(pool.idle(), 1)
+        pool.evict(0)
+        with db.read() as conn:
+            self.assertEqual(conn.execute_sql('PRAGMA synchronous').fetchone()[0], 0)
+        def hold(held, release):
+            with db.read():
+                held.set()
+                release.wait(5)
+        events = [(threading.Event(), threading.Event()) for i in range(2)]
+        threads = [threading.Thread(target=hold, args=pair) for pair in events]
+        pool.configure(max_connections=2)
+        for thread, (held, release) in zip(threads, events):
+            thread.start()
+            held.wait(5)
+        self.assertEqual(pool.in_use(), 2)
+        pool.configure(max_connections=1)
+        for thread, (held, release) in zip(threads, events):
+            release.set()
+            thread.join(5)
+        self.assertEqual(pool.in_use(), 0)
+        self.assertEqual(pool.idle(), 1)
+        dm.reconfigure({'plain': self.config['plain'], 'pooled': dict(config['pooled'], instrument=False)})
+        del config['pooled']['cache']
+        dm.reconfigure({'plain': self.config['plain'], 'pooled': config['pooled']})
+        self.assertTrue(db.cache() is None)
+        self.assertEqual(db.queries(), [])
+        dm.reconfigure({'plain': self.config['plain']})
+        self.assertTrue(dm.get('pooled') is db)
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        path = '/' + os.path.relpath(self.path, conf.app_dir())
+        self.db = DatabaseManager({
+            'db': {'type': 'sqlite', 'class': 'kpapp.db.Database', 'path': path + '/db.db', 'pool': {}},
+        }).get('db')
+        with self.db.atomic() as conn:
+            conn.execute_sql('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)')
+            conn.cursor().executemany('INSERT INTO item VALUES (?, ?)', [(i, 'item-%d' % i) for i in range(1, 101)])
+        class Item(Model):
+            name = TextField()
+            class Meta:
+                database = self.db.get()
+        self.Item = Item
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_iterate(self):
+        rows = list(self.db.iterate('SELECT id, name FROM item', chunk=7))
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(rows[0], (1, 'item-1'))
+        row = next(self.db.iterate('SELECT id, name FROM item', row='namedtuple'))
+        self.assertEqual((row.id, row.name), (1, 'item-1'))
+        names = [obj.name for obj in self.db.iterate(self.Item.select(), row='model')]
+        self.assertEqual(len(names), 100)
+        self.assertFalse(self.db.stats()['readers'])
+
+    def test_halt(self):
+        tm = TaskManager()
+        sig = tm.get_signal()
+        rows = []
+        for row in self.db.iterate('SELECT id FROM item', chunk=10, sig=sig):
+            rows.append(row)
+            if len(rows) == 15:
+                tm.stop()
+        self.assertEqual(len(rows), 20)
+        self.assertFalse(self.db.stats()['readers'])
+
+    def test_paginate(self):
+        rows = list(self.db.paginate('SELECT id, name FROM item WHERE id > ?', 'id', (10,), chunk=30, row='dict'))
+        self.assertEqual([r['id'] for r in rows], range(11, 101))
+        query = self.Item.select(self.Item.id, self.Item.name)
+        rows = list(self.db.paginate(query, self.Item.id, chunk=30, start=50))
+        self.assertEqual([r[0] for r in rows], range(51, 101))
+        objs = list(self.db.paginate(query, self.Item.id, chunk=30, row='model'))
+        self.assertEqual([obj.id for obj in objs], range(1, 101))
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        path = '/' + os.path.relpath(self.path, conf.app_dir())
+        self.config = {
+            'db': {'type': 'sqlite', 'class': 'kpapp.db.Database', 'path': path + '/db.db',
+                   'pool': {}, 'writer': {'max_batch': 50, 'max_delay': 0.05}},
+        }
+        self.tm = TaskManager()
+        self.dm = DatabaseManager(self.config, self.tm)
+        with self.dm.get('db').write() as conn:
+            conn.execute_sql('CREATE TABLE t (x INTEGER UNIQUE)')
+
+    def tearDown(self):
+        self.tm.stop()
+        shutil.rmtree(self.path)
+
+    def test_batch(self):
+        writer = self.dm.writer('db')
+        self.assertTrue(self.dm.writer('db') is writer)
+        futures = [writer.execute('INSERT INTO t VALUES (?)', (i,)) for i in range(200)]
+        self.assertEqual([future.result(5) for future in futures], [1] * 200)
+        self.assertTrue(writer.counters()['batches'] < 200)
+        self.assertEqual(writer.counters()['writes'], 200)
+        with self.dm.get('db').read() as conn:
+            self.assertEqual(conn.execute_sql('SELECT COUNT(*) FROM t').fetchone()[0], 200)
+
+    def test_failure(self):
+        writer = self.dm.writer('db')
+        first = writer.execute('INSERT INTO t VALUES (1)')
+        duplicate = writer.execute('INSERT INTO t VALUES (1)')
+        many = writer.execute_many('INSERT INTO t VALUES (?)', [(2,), (3,)])
+        self.assertEqual(first.result(5), 1)
+        self.assertTrue(duplicate.exception(5) is not None)
+        self.assertEqual(many.result(5), 2)
+
+    def test_stop(self):
+        writer = self.dm.writer('db')
+        futures = [writer.execute('INSERT INTO t VALUES (?)', (i,)) for i in range(20)]
+        self.assertTrue(self.tm.stop())
+        self.assertTrue(all(future.done() for future in futures))
+
+    def test_no_task_manager(self):
+        self.assertRaises(RuntimeError, DatabaseManager(self.config).writer, 'db')
+
+class TestRWLock(unittest.TestCase):
+
+    def test_shared(self):
+        lock = RWLock()
+        inside = []
+        release = threading.Event()
+        def read():
+            with lock.reader():
+                inside.append(1)
+                release.wait(5)
+        threads = [threading.Thread(target=read) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for i in range(200):
+            if len(inside) == 3:
+                break
+            time.sleep(0.01)
+        self.assertEqual(lock.stats()['readers'], 3)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(lock.stats()['read_wait']['count'], 3)
+
+    def test_writer_preference(self):
+        lock = RWLock()
+        order = []
+        lock.acquire_read()
+        def write():
+            with lock.writer():
+                order.append('write')
+        def read():
+            with lock.reader():
+                order.append('read')
+        writer = threading.Thread(target=write)
+        writer.start()
+        for i in range(200):
+            if lock.stats()['waiting']:
+                break
+            time.sleep(0.01)
+        reader = threading.Thread(target=read)
+        reader.start()
+        time.sleep(0.05)
+        self.assertEqual(order, [])
+        lock.release_read()
+        writer.join(5)
+        reader.join(5)
+        self.assertEqual(order, ['write', 'read'])
+
+    def test_reentrant(self):
+        lock = RWLock()
+        with lock.writer():
+            with lock.writer():
+                with lock.reader():
+                    pass
+        with lock.reader():
+            with lock.reader():
+                self.assertRaises(RuntimeError, lock.acquire_write)
+        self.assertEqual(lock.stats()['readers'], 0)
+        self.assertFalse(lock.stats()['writer'])
+
+    def test_release_write_first(self):
+        lock = RWLock()
+        lock.acquire_write()
+        lock.acquire_read()
+        lock.release_write()
+        self.assertEqual(lock.stats()['readers'], 1)
+        self.assertFalse(lock.stats()['writer'])
+        acquired = []
+        def write():
+            with lock.writer():
+                acquired.append(1)
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        self.assertEqual(acquired, [])
+        lock.release_read()
+        writer.join(5)
+        self.assertEqual(acquired, [1])
+        self.assertEqual(lock.stats()['readers'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from kpapp.events import EventLog
+
+class TestEventLog(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def fill(self, log, count = 1000):
+        log.append_many([('even' if i % 2 == 0 else 'odd', {'i': i}, 1000.0 + i) for i in range(count)])
+
+    def test_query(self):
+        log = EventLog(self.path, segment_bytes=4096, index_interval=256)
+        self.fill(log)
+        self.assertTrue(len(log.segments()) > 5)
+        events = list(log.query(1100, 1200))
+        self.assertEqual([e['data']['i'] for e in events], range(100, 200))
+        self.assertEqual(events[0], {'ts': 1100.0, 'type': 'even', 'data': {'i': 100}})
+        self.assertEqual(len(list(log.query(1990, types=['odd']))), 5)
+        self.assertEqual(len(list(log.query(end=1010))), 10)
+        self.assertEqual(len(list(log.query())), 1000)
+        self.assertEqual(list(log.query(5000)), [])
+        log.close()
+
+    def test_order(self):
+        log = EventLog(self.path)
+        first = log.append('start')
+        self.assertTrue(log.append('next') >= first)
+        self.assertRaises(ValueError, log.append, 'past', None, first - 1)
+        self.assertEqual([e['type'] for e in log.query()], ['start', 'next'])
+        log.close()
+        self.assertRaises(RuntimeError, log.append, 'closed')
+
+    def test_reopen(self):
+        log = EventLog(self.path, segment_bytes=4096, index_interval=256)
+        self.fill(log)
+        log.close()
+        segment = os.path.join(self.path, '%08d.jsonl' % log.segments()[-1])
+        with open(segment, 'ab') as f:
+            f.write('{"ts":2000.0,"ty')
+        os.remove(segment[:-5] + 'idx')
+        log = EventLog(self.path, segment_bytes=4096, index_interval=256)
+        self.assertRaises(ValueError, log.append, 'past', None, 1500)
+        log.append('late', None, 2500)
+        self.assertEqual([e['data']['i'] for e in log.query(1995, 2000)], range(995, 1000))
+        self.assertEqual([e['type'] for e in log.query(2000)], ['late'])
+        log.close()
+
+    def test_prune(self):
+        log = EventLog(self.path, segment_bytes=4096, index_interval=256)
+        self.fill(log)
+        count = len(log.segments())
+        removed = log.prune(1500)
+        self.assertTrue(removed > 0)
+        self.assertEqual(len(log.segments()), count - removed)
+        events = list(log.query())
+        self.assertTrue(events[0]['ts'] <= 1500)
+        self.assertEqual(events[-1]['ts'], 1999)
+        log.close()
+
+if __name__ == '__main__':
+    unittest.main()
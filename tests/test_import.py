@@ -0,0 +1,58 @@
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+
+import kpapp
+
+BENCHMARK = """
+import sys, time
+start = time.time()
+import kpapp
+from kpapp import ThresholdCounter, check_type
+elapsed = time.time() - start
+heavy = [name for name in ('peewee', 'yaml', 'kpapp.task', 'kpapp.db', 'multiprocessing') if name in sys.modules]
+print elapsed, ','.join(heavy)
+"""
+
+class TestImport(unittest.TestCase):
+
+    # Seconds a cold import of kpapp for ThresholdCounter may take
+    BUDGET = 0.05
+
+    def run_python(self, code):
+        path = tempfile.mkdtemp()
+        try:
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(kpapp.__file__)))
+            process = subprocess.Popen(
+                [sys.executable, '-c', code], cwd=path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = process.communicate()
+            self.assertEqual(process.returncode, 0, err)
+            self.assertEqual(os.listdir(path), [])
+            return out.split()
+        finally:
+            shutil.rmtree(path)
+
+    def test_lazy(self):
+        best = None
+        for i in range(3):
+            out = self.run_python(BENCHMARK)
+            self.assertEqual(out[1:], [])
+            best = min(best or float(out[0]), float(out[0]))
+        self.assertTrue(best < self.BUDGET, 'kpapp import took %.3fs' % best)
+
+    def test_exports(self):
+        from kpapp import Application, Database, TaskGroup, conf
+        self.assertTrue(kpapp.Database is Database)
+        self.assertEqual(sorted(kpapp.__all__), sorted(set(dir(kpapp)) & set(kpapp.__all__)))
+        self.assertRaises(AttributeError, getattr, kpapp, 'missing')
+        self.assertRaises(ImportError, self.import_missing)
+
+    def import_missing(self):
+        from kpapp import missing
+
+if __name__ == '__main__':
+    unittest.main()
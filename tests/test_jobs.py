@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from kpapp.common import conf
+from kpapp.db import DatabaseManager
+from kpapp.jobs import Job
+from kpapp.task import TaskManager, TaskGroup
+from kpapp.tasks.jobs import JobDispatcher
+
+class Sum(TaskGroup):
+
+    def __init__(self, name, sig):
+        TaskGroup.__init__(self, name, sig, workers=4, queue_size=200)
+        self.lock = threading.Lock()
+        self.total = 0
+
+    def work(self, job):
+        if job.payload.get('fail'):
+            raise ValueError('failing job')
+        with self.lock:
+            self.total += job.payload['n']
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        path = '/' + os.path.relpath(self.path, conf.app_dir())
+        self.config = {
+            'db': {'type': 'sqlite', 'class': 'kpapp.db.Database', 'path': path + '/db.db', 'pool': {},
+                   'jobs': {'max_attempts': 2, 'backoff': 0.05}},
+        }
+        self.tm = TaskManager()
+        self.dm = DatabaseManager(self.config, self.tm)
+
+    def tearDown(self):
+        self.tm.stop()
+        shutil.rmtree(self.path)
+
+    def test_claim(self):
+        queue = self.dm.jobs('db')
+        self.assertTrue(self.dm.jobs('db') is queue)
+        self.assertEqual(queue.put_many([{'n': i} for i in range(10)]), 10)
+        urgent = queue.put({'n': 'urgent'}, priority=5)
+        queue.put({'n': 'later'}, delay=60)
+        jobs = queue.claim(3)
+        self.assertEqual(jobs[0], Job(urgent, {'n': 'urgent'}, 5, 1))
+        self.assertEqual([job.payload['n'] for job in jobs[1:]], [0, 1])
+        self.assertEqual(queue.stats(), {'ready': 8, 'delayed': 1, 'claimed': 3, 'dead': 0})
+        self.assertEqual(queue.ack(jobs), 3)
+        self.assertEqual(len(queue.claim(100)), 8)
+        self.assertEqual(queue.claim(100), [])
+
+    def test_visibility(self):
+        queue = self.dm.jobs('db')
+        queue.put({'n': 1})
+        stale = queue.claim(1, visibility=0.01)[0]
+        time.sleep(0.02)
+        job = queue.claim(1)[0]
+        self.assertEqual((job.id, job.attempts), (stale.id, 2))
+        self.assertEqual(queue.ack([stale]), 0)
+        self.assertEqual(queue.ack([job]), 1)
+        queue.put({'n': 2})
+        queue.claim(1, visibility=0)
+        queue.claim(1, visibility=0)
+        self.assertEqual(queue.claim(1), [])
+        self.assertEqual(queue.dead()[0]['error'], 'Visibility timeout expired')
+
+    def test_retry(self):
+        queue = self.dm.jobs('db')
+        queue.put({'n': 1})
+        job = queue.claim(1)[0]
+        self.assertEqual(queue.nack([job], 'first'), 0)
+        self.assertEqual(queue.claim(1), [])
+        time.sleep(0.06)
+        job = queue.claim(1)[0]
+        self.assertEqual(queue.nack([job], 'second'), 1)
+        dead = queue.dead()
+        self.assertEqual(len(dead), 1)
+        self.assertEqual(dead[0]['error'], 'second')
+        self.assertEqual(queue.requeue(), 1)
+        self.assertEqual(queue.claim(1)[0].attempts, 1)
+
+    def test_dispatcher(self):
+        queue = self.dm.jobs('db')
+        queue.put_many([{'n': i} for i in range(1000)])
+        queue.put({'fail': True})
+        group = Sum('sum', self.tm.get_signal())
+        self.tm.setup(group)
+        dispatcher = JobDispatcher('jobs', self.tm.get_signal(), queue, group, batch=100, poll=0.01)
+        self.tm.setup(dispatcher)
+        deadline = time.time() + 10
+        while queue.stats()['dead'] == 0 or queue.stats()['ready'] or dispatcher.counters()['in_flight']:
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(group.total, sum(range(1000)))
+        self.assertEqual(dispatcher.counters()['acked'], 1000)
+        self.assertEqual(dispatcher.counters()['failed'], 2)
+        self.assertEqual(queue.stats(), {'ready': 0, 'delayed': 0, 'claimed': 0, 'dead': 1})
+        self.assertTrue('failing job' in queue.dead()[0]['error'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+
+from kpapp.loghandler import AsyncFileHandler, install, uninstall
+
+class TestAsyncFileHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.log = logging.getLogger('test_loghandler')
+        self.log.propagate = False
+        self.log.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+            handler.close()
+        shutil.rmtree(self.path)
+
+    def test_write(self):
+        handler = AsyncFileHandler(self.path + '/app.log')
+        self.log.addHandler(handler)
+        args = ['first']
+        self.log.info('message %s', args)
+        args.append('changed')
+        for i in range(100):
+            self.log.info('line %d', i)
+        handler.flush()
+        with open(self.path + '/app.log') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "message ['first']")
+        self.assertEqual(len(lines), 101)
+        self.assertEqual(handler.stats()['written'], 101)
+
+    def test_missing_directory(self):
+        handler = AsyncFileHandler(self.path + '/data/log/app.log')
+        self.log.addHandler(handler)
+        self.log.info('message')
+        handler.flush()
+        self.assertEqual(handler.stats()['written'], 1)
+        self.assertTrue(os.path.exists(self.path + '/data/log/app.log'))
+
+    def test_rotate(self):
+        handler = AsyncFileHandler(self.path + '/app.log', max_bytes=1000, backup_count=2, compress=True, batch=10)
+        self.log.addHandler(handler)
+        for i in range(300):
+            self.log.info('line %04d', i)
+        handler.close()
+        self.assertTrue(handler.stats()['rotations'] >= 2)
+        self.assertTrue(os.path.exists(self.path + '/app.log.1.gz'))
+        self.assertTrue(os.path.exists(self.path + '/app.log.2.gz'))
+        self.assertFalse(os.path.exists(self.path + '/app.log.3.gz'))
+        lines = []
+        for i in (2, 1):
+            f = gzip.open(self.path + '/app.log.%d.gz' % i)
+            lines.extend(f.read().splitlines())
+            f.close()
+        with open(self.path + '/app.log') as f:
+            lines.extend(f.read().splitlines())
+        self.assertEqual(lines, ['line %04d' % i for i in range(300 - len(lines), 300)])
+
+    def test_overflow(self):
+        handler = AsyncFileHandler(self.path + '/app.log', buffer=1, overflow='drop')
+        self.assertRaises(ValueError, AsyncFileHandler, self.path + '/x.log', overflow='coalesce')
+        self.log.addHandler(handler)
+        for i in range(1000):
+            self.log.info('line %d', i)
+        handler.close()
+        stats = handler.stats()
+        self.assertEqual(stats['written'] + stats['dropped'], 1000)
+
+    def test_install(self):
+        self.log.addHandler(logging.FileHandler(self.path + '/app.log', mode='a+'))
+        pairs = install(self.log, {'batch': 10})
+        self.assertEqual(len(pairs), 1)
+        self.assertTrue(isinstance(self.log.handlers[0], AsyncFileHandler))
+        self.log.info('async')
+        uninstall(self.log, pairs)
+        self.assertEqual(type(self.log.handlers[0]), logging.FileHandler)
+        self.log.info('sync')
+        self.log.handlers[0].flush()
+        with open(self.path + '/app.log') as f:
+            self.assertEqual(f.read().splitlines(), ['async', 'sync'])
+
+if __name__ == '__main__':
+    unittest.main()
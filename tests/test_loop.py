@@ -0,0 +1,135 @@
+import unittest
+import time
+
+from kpapp.loop import EventLoop, Return
+from kpapp.task import TaskManager, AsyncTask, TaskGroup
+
+def add(a, b):
+    yield 0.01
+    raise Return(a + b)
+
+def nested():
+    value = yield add(1, 2)
+    raise Return(value * 10)
+
+def failing():
+    yield None
+    raise ValueError('fail')
+
+class Counter(AsyncTask):
+
+    def __init__(self, name, sig, limit = 0):
+        AsyncTask.__init__(self, name, sig)
+        self.count = 0
+        self.limit = limit
+        self.finalized = False
+
+    def _finalize(self):
+        self.finalized = True
+
+    def work(self):
+        self.count += 1
+        if self.count == self.limit:
+            self._done()
+        yield 0.001
+
+class Offload(AsyncTask):
+
+    def __init__(self, name, sig, group):
+        AsyncTask.__init__(self, name, sig)
+        self.group = group
+        self.result = None
+
+    def work(self):
+        self.result = yield self.group.submit(lambda: 7 * 6)
+        self._done()
+
+class TestEventLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+        self.loop.start()
+
+    def tearDown(self):
+        self.loop.stop()
+
+    def test_return(self):
+        self.assertEqual(self.loop.spawn(add(2, 3)).result(5), 5)
+
+    def test_nested(self):
+        self.assertEqual(self.loop.spawn(nested()).result(5), 30)
+
+    def test_exception(self):
+        self.assertRaises(ValueError, self.loop.spawn(failing()).result, 5)
+
+    def test_call(self):
+        self.assertEqual(self.loop.call(lambda: 'loop').result(5), 'loop')
+
+    def test_interrupt(self):
+        future = self.loop.sleep(time.time() + 60)
+        parked = self.loop.sleep(None)
+        self.loop.interrupt()
+        self.assertFalse(future.result(5))
+        self.assertFalse(parked.result(5))
+
+    def test_many(self):
+        futures = [self.loop.spawn(add(i, i)) for i in range(2000)]
+        self.assertEqual([f.result(10) for f in futures], [i + i for i in range(2000)])
+
+class TestAsyncTask(unittest.TestCase):
+
+    def setUp(self):
+        self.tm = TaskManager()
+
+    def test_done(self):
+        task = Counter('counter', self.tm.get_signal(), limit=5)
+        self.tm.setup(task)
+        for i in range(100):
+            if task.finalized:
+                break
+            time.sleep(0.01)
+        self.assertEqual(task.count, 5)
+        self.assertTrue(task.finalized)
+        self.tm.stop()
+
+    def test_halt(self):
+        tasks = [Counter('counter-%d' % i, self.tm.get_signal()) for i in range(100)]
+        for task in tasks:
+            self.tm.setup(task)
+        time.sleep(0.05)
+        self.tm.stop()
+        self.assertTrue(all(task.finalized for task in tasks))
+
+    def test_suspend(self):
+        task = Counter('counter', self.tm.get_signal())
+        self.tm.setup(task)
+        time.sleep(0.02)
+        self.tm.suspend()
+        time.sleep(0.02)
+        count = task.count
+        time.sleep(0.05)
+        self.assertEqual(task.count, count)
+        self.tm.resume()
+        time.sleep(0.05)
+        self.assertTrue(task.count > count)
+        self.tm.stop()
+
+    def test_bridge(self):
+        group = TaskGroup('group', self.tm.get_signal())
+        self.tm.setup(group)
+        task = Offload('offload', self.tm.get_signal(), group)
+        self.tm.setup(task)
+        for i in range(100):
+            if task.result is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(task.result, 42)
+        self.tm.stop()
+
+    def test_process_mode(self):
+        task = Counter('counter', self.tm.get_signal())
+        self.assertRaises(ValueError, self.tm.setup, task, {}, 'process', ['db'])
+        self.assertEqual(self.tm.tags('counter'), set())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import time
+
+from kpapp.metrics import Histogram, TaskStats, QueryStats
+from kpapp.task import TaskManager, Task, TaskGroup
+
+class Busy(Task):
+
+    def work(self):
+        time.sleep(0.001)
+        self._idle(0.005)
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        snapshot = Histogram().snapshot()
+        self.assertEqual(snapshot['count'], 0)
+        self.assertEqual(snapshot['p99'], 0.0)
+
+    def test_percentiles(self):
+        h = Histogram()
+        for i in range(1, 1001):
+            h.record(i / 1000.0)
+        snapshot = h.snapshot()
+        self.assertEqual(snapshot['count'], 1000)
+        self.assertAlmostEqual(snapshot['mean'], 0.5005, places=3)
+        self.assertAlmostEqual(snapshot['min'], 0.001, places=6)
+        self.assertAlmostEqual(snapshot['max'], 1.0, places=6)
+        self.assertTrue(abs(snapshot['p50'] - 0.5) / 0.5 < 0.05)
+        self.assertTrue(abs(snapshot['p99'] - 0.99) / 0.99 < 0.05)
+
+    def test_merge(self):
+        a = Histogram()
+        b = Histogram()
+        a.record(0.001)
+        b.record(0.002)
+        a.merge(b)
+        self.assertEqual(a.count(), 2)
+        self.assertAlmostEqual(a.snapshot()['max'], 0.002, places=6)
+
+class TestTaskStats(unittest.TestCase):
+
+    def test_combine(self):
+        a = TaskStats()
+        b = TaskStats()
+        a.work(0.01)
+        b.work(0.02)
+        b.error()
+        a.idle(0.5)
+        result = TaskStats.combine([a, b])
+        self.assertEqual(result['iterations'], 2)
+        self.assertEqual(result['errors'], 1)
+        self.assertEqual(result['latency']['count'], 2)
+        self.assertTrue(0 < result['idle_ratio'] <= 1.0)
+
+class TestQueryStats(unittest.TestCase):
+
+    def test_top(self):
+        stats = QueryStats()
+        stats.record('SELECT 1', 0.5, 1)
+        entry = stats.record('SELECT 2', 0.2)
+        stats.record('SELECT 2', 0.2)
+        stats.rows(entry, 10)
+        top = stats.top(1)
+        self.assertEqual(top[0]['sql'], 'SELECT 1')
+        top = stats.top(1, 'count')
+        self.assertEqual(top[0]['sql'], 'SELECT 2')
+        self.assertEqual(top[0]['rows'], 10)
+        self.assertAlmostEqual(top[0]['mean'], 0.2)
+        self.assertEqual(stats.snapshot()['latency']['count'], 3)
+        self.assertRaises(ValueError, stats.top, 1, 'unknown')
+
+class TestTaskManagerStats(unittest.TestCase):
+
+    def test_stats(self):
+        tm = TaskManager()
+        tm.setup(Busy('busy', tm.get_signal()))
+        group = TaskGroup('group', tm.get_signal(), workers=2)
+        tm.setup(group)
+        group.map([lambda: 1] * 10, timeout=5)
+        time.sleep(0.05)
+        tm.stop()
+        stats = tm.stats()
+        busy = stats['tasks']['busy']
+        self.assertTrue(busy['iterations'] > 0)
+        self.assertTrue(busy['idle'] > 0)
+        self.assertTrue(busy['latency']['p50'] >= 0.0009)
+        self.assertEqual(stats['groups']['group']['iterations'], 10)
+        self.assertEqual(stats['groups']['group']['workers'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,9 @@ import types
 import os
 import shutil
 import tempfile
+import yaml
 
-from kpapp.misc import Config
+from kpapp.misc import Config, diff
 
 test_yaml = """
 ---
@@ -52,6 +53,82 @@ class TestConfig(unittest.TestCase):
         self.assertTrue(set(merged.keys()) == set(result.keys()))
         self.assertTrue(set(merged.values()) == set(result.values()))
 
+    def test_cache(self):
+        path = self.__test_path + '/test.yaml'
+        merged = Config().load(path, {'star': 'sun'})
+        self.assertTrue(os.path.exists(path + Config.CACHE))
+        load = yaml.load
+        yaml.load = None
+        try:
+            self.assertEqual(Config().load(path, {'star': 'sun'}), merged)
+        finally:
+            yaml.load = load
+        self.assertEqual(Config().load(path, {'star': 'moon'})['star'], 'moon')
+        f = file(path, 'a')
+        f.write('star: sirius\n')
+        f.close()
+        self.assertEqual(Config().load(path, {'star': 'sun'})['star'], 'sirius')
+
+    def test_cache_frozen(self):
+        path = self.__test_path + '/list.yaml'
+        f = file(path, 'w')
+        f.write('db:\n  warmup: [a, b]\n')
+        f.close()
+        Config().load(path)
+        load = yaml.load
+        yaml.load = None
+        try:
+            cached = Config().load(path)
+        finally:
+            yaml.load = load
+        self.assertEqual(cached['db']['warmup'], ('a', 'b'))
+        self.assertRaises(TypeError, cached['db'].update, {'foo': 1})
+        f = file(path, 'a')
+        f.write('when: 2020-01-01\n')
+        f.close()
+        os.remove(path + Config.CACHE)
+        self.assertEqual(Config().load(path)['when'].year, 2020)
+        self.assertFalse(os.path.exists(path + Config.CACHE))
+
+    def test_frozen(self):
+        f = file(self.__test_path + '/list.yaml', 'w')
+        f.write('db:\n  warmup: [a, b]\n')
+        f.close()
+        merged = self.__config.load(self.__test_path + '/list.yaml', cache=False)
+        self.assertFalse(os.path.exists(self.__test_path + '/list.yaml' + Config.CACHE))
+        self.assertTrue(isinstance(merged, dict))
+        self.assertRaises(TypeError, merged.__setitem__, 'foo', 1)
+        self.assertRaises(TypeError, merged['db'].update, {'foo': 1})
+        self.assertEqual(merged['db']['warmup'], ('a', 'b'))
+        copy = merged.copy()
+        copy['foo'] = 1
+        self.assertEqual(type(copy), dict)
+
+    def test_reload(self):
+        path = self.__test_path + '/test.yaml'
+        self.assertRaises(RuntimeError, self.__config.reload)
+        self.assertFalse(self.__config.changed())
+        first = self.__config.load(path, {'star': 'sun'})
+        self.assertTrue(self.__config.load(path) is first)
+        f = file(path, 'a')
+        f.write('star: sirius\n')
+        f.close()
+        os.utime(path, (0, 0))
+        self.assertTrue(self.__config.changed())
+        second = self.__config.reload()
+        self.assertEqual(second['star'], 'sirius')
+        self.assertFalse(self.__config.changed())
+        self.assertEqual(diff(first, second), set(['star']))
+        self.assertEqual(diff({'a': 1}, {'b': 1}), set(['a', 'b']))
+        f = file(path, 'a')
+        f.write('star: [\n')
+        f.close()
+        os.utime(path, (1, 1))
+        self.assertTrue(self.__config.changed())
+        self.assertRaises(Exception, self.__config.reload)
+        self.assertFalse(self.__config.changed())
+        self.assertTrue(self.__config.load(path) is second)
+
     def test_usr(self):
         self.assertTrue(os.path.exists(self.__config.usr_dir()))
 
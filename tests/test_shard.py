@@ -0,0 +1,65 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from kpapp.common import conf
+from kpapp.db import DatabaseManager
+from kpapp.shard import ShardedDatabase, reshard, crc32
+
+class TestShardedDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        path = '/' + os.path.relpath(self.path, conf.app_dir())
+        self.config = {
+            'users': {'type': 'sharded_sqlite', 'class': 'kpapp.db.Database',
+                      'path': path + '/users-%d.db', 'shards': 4},
+            'users2': {'type': 'sharded_sqlite', 'class': 'kpapp.db.Database',
+                       'path': path + '/users2-%d.db', 'shards': 2, 'pool': {}},
+            'broken': {'type': 'sharded_sqlite', 'class': 'kpapp.db.Database',
+                       'path': path + '/broken.db', 'shards': 2},
+        }
+        self.dm = DatabaseManager(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def fill(self, db):
+        db.execute('CREATE TABLE user (id INTEGER PRIMARY KEY, name TEXT)')
+        for i in range(100):
+            with db.shard(i).atomic() as conn:
+                conn.execute_sql('INSERT INTO user VALUES (?, ?)', (i, 'user-%d' % i))
+
+    def test_route(self):
+        db = self.dm.get('users')
+        self.assertTrue(isinstance(db, ShardedDatabase))
+        self.assertEqual(db.count(), 4)
+        self.assertEqual(db.index('alice'), crc32('alice') % 4)
+        self.fill(db)
+        counts = [shard.select('SELECT COUNT(*) FROM user')[0][0] for shard in db.shards()]
+        self.assertEqual(sum(counts), 100)
+        self.assertTrue(all(count > 0 for count in counts))
+        self.assertEqual(db.shard(42).select('SELECT name FROM user WHERE id = ?', (42,)), [('user-42',)])
+
+    def test_fan_out(self):
+        db = self.dm.get('users')
+        self.fill(db)
+        rows = db.select('SELECT id FROM user', order=lambda row: row[0], reverse=True, limit=3)
+        self.assertEqual(rows, [(99,), (98,), (97,)])
+        self.assertEqual(len(db.select('SELECT id FROM user', parallel=True)), 100)
+
+    def test_reshard(self):
+        source = self.dm.get('users')
+        target = self.dm.get('users2')
+        self.fill(source)
+        self.assertEqual(reshard(source, target, {'user': 'id'}, batch=7), 100)
+        self.assertEqual(len(target.select('SELECT id FROM user')), 100)
+        for i in (0, 17, 99):
+            self.assertEqual(target.shard(i).select('SELECT id FROM user WHERE id = ?', (i,)), [(i,)])
+
+    def test_config(self):
+        self.assertRaises(RuntimeError, self.dm.get, 'broken')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+import unittest
+import threading
+import time
+import Queue
+import os
+import signal
+
+from kpapp.task import TaskManager, Task, TaskGroup
+
+class Square(TaskGroup):
+
+    def work(self, item):
+        if item < 0:
+            raise ValueError('negative')
+        return item * item
+
+class Pid(TaskGroup):
+
+    def work(self, item):
+        return os.getpid()
+
+class Idle(Task):
+
+    def work(self):
+        self._idle(0.01)
+
+class TestTaskGroup(unittest.TestCase):
+
+    def setUp(self):
+        self.tm = TaskManager()
+
+    def tearDown(self):
+        self.tm.stop()
+
+    def test_map(self):
+        group = Square('square', self.tm.get_signal(), workers=4, queue_size=2)
+        self.tm.setup(group)
+        self.assertEqual(group.map(range(20), timeout=5), [i * i for i in range(20)])
+
+    def test_callable(self):
+        group = TaskGroup('callable', self.tm.get_signal())
+        self.tm.setup(group)
+        self.assertEqual(group.submit(lambda: 42).result(5), 42)
+
+    def test_exception(self):
+        group = Square('square', self.tm.get_signal())
+        self.tm.setup(group)
+        future = group.submit(-1)
+        self.assertRaises(ValueError, future.result, 5)
+        self.assertEqual(group.submit(3).result(5), 9)
+
+    def test_backpressure(self):
+        group = Square('square', self.tm.get_signal(), workers=1, queue_size=1)
+        group.suspend()
+        self.tm.setup(group)
+        future = group.submit(2)
+        self.assertRaises(Queue.Full, group.submit, 3, True, 0.05)
+        futures = group.submit_batch([4, 5], block=False)
+        self.assertTrue(isinstance(futures[1].exception(0), Queue.Full))
+        group.resume()
+        self.assertEqual(future.result(5), 4)
+
+    def test_resize(self):
+        group = TaskGroup('resize', self.tm.get_signal(), workers=2)
+        self.tm.setup(group)
+        self.assertEqual(group.workers(), 2)
+        group.resize(4)
+        self.assertEqual(group.workers(), 4)
+        group.resize(1)
+        for i in range(50):
+            if group.workers() == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(group.workers(), 1)
+
+    def test_halt(self):
+        group = TaskGroup('halt', self.tm.get_signal(), workers=2)
+        group.suspend()
+        self.tm.setup(group)
+        future = group.submit(lambda: 1)
+        group.halt()
+        self.assertRaises(RuntimeError, future.result, 5)
+        self.assertRaises(RuntimeError, group.submit, lambda: 1)
+        for i in range(50):
+            if group.workers() == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(group.workers(), 0)
+
+    def test_duplicate(self):
+        self.tm.setup(TaskGroup('dup', self.tm.get_signal()))
+        self.assertRaises(RuntimeError, self.tm.setup, TaskGroup('dup', self.tm.get_signal()))
+
+class TestProcessMode(unittest.TestCase):
+
+    def setUp(self):
+        self.tm = TaskManager()
+
+    def test_group(self):
+        group = Square('square', self.tm.get_signal(), workers=2)
+        self.tm.setup(group, mode='process')
+        self.assertEqual(group.mode(), 'process')
+        self.assertEqual(group.map(range(10), timeout=5), [i * i for i in range(10)])
+        self.assertRaises(ValueError, group.submit(-1).result, 5)
+        self.tm.stop()
+
+    def test_pids(self):
+        group = Pid('pid', self.tm.get_signal(), workers=2)
+        self.tm.setup(group, mode='process')
+        pids = set(group.map(range(10), timeout=5))
+        self.assertFalse(os.getpid() in pids)
+        self.tm.stop()
+
+    def test_task(self):
+        task = Idle('idle', self.tm.get_signal())
+        self.tm.setup(task, mode='process')
+        self.tm.suspend()
+        self.tm.resume()
+        self.assertTrue(self.tm.stop())
+
+class Stuck(Task):
+
+    def __init__(self, name, sig, release):
+        Task.__init__(self, name, sig)
+        self.release = release
+
+    def work(self):
+        self.release.wait()
+        self._done()
+
+class TestStop(unittest.TestCase):
+
+    def setUp(self):
+        self.tm = TaskManager()
+
+    def test_fast(self):
+        for i in range(20):
+            self.tm.setup(Idle('idle-%d' % i, self.tm.get_signal()))
+        self.tm.setup(TaskGroup('group', self.tm.get_signal(), workers=4))
+        start = time.time()
+        self.assertTrue(self.tm.stop())
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_straggler(self):
+        release = threading.Event()
+        self.tm.setup(Stuck('stuck', self.tm.get_signal(), release))
+        self.tm.setup(Idle('idle', self.tm.get_signal()))
+        self.assertFalse(self.tm.stop(0.1))
+        release.set()
+        stragglers = self.tm.stragglers()
+        self.assertEqual(stragglers.keys(), ['stuck'])
+        self.assertTrue('release.wait()' in stragglers['stuck'])
+
+class Crashy(Task):
+
+    def __init__(self, name, sig, crashes):
+        Task.__init__(self, name, sig)
+        self.crashes = crashes
+        self.runs = 0
+
+    def _initialize(self):
+        self.runs += 1
+
+    def work(self):
+        if self.crashes > 0:
+            self.crashes -= 1
+            raise RuntimeError('crash')
+        self._idle(0.01)
+
+class CrashyGroup(TaskGroup):
+
+    def __init__(self, name, sig, crashes, strategy):
+        TaskGroup.__init__(self, name, sig, workers=2, strategy=strategy)
+        self.crashes = crashes
+        self.lock = threading.Lock()
+
+    def _initialize(self):
+        with self.lock:
+            if self.crashes > 0:
+                self.crashes -= 1
+                raise RuntimeError('crash')
+
+class TestSupervisor(unittest.TestCase):
+
+    def wait(self, condition):
+        for i in range(200):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_restart(self):
+        tm = TaskManager({'supervisor': {'backoff': 0.01}})
+        task = Crashy('crashy', tm.get_signal(), 2)
+        tm.setup(task)
+        self.assertTrue(self.wait(lambda: task.runs == 3))
+        self.assertEqual(tm.supervisor().restarts('crashy'), 2)
+        self.assertEqual(tm.stats()['tasks']['crashy']['errors'], 2)
+        self.assertTrue(tm.stop())
+
+    def test_one_for_one(self):
+        tm = TaskManager({'supervisor': {'backoff': 0.01}})
+        group = CrashyGroup('group', tm.get_signal(), 1, 'one_for_one')
+        tm.setup(group)
+        self.assertTrue(self.wait(lambda: tm.supervisor().restarts('group') == 1 and group.workers() == 2))
+        self.assertEqual(group.map([lambda: 1] * 4, timeout=5), [1] * 4)
+        self.assertTrue(tm.stop())
+
+    def test_one_for_all(self):
+        tm = TaskManager({'supervisor': {'backoff': 0.01}})
+        group = CrashyGroup('group', tm.get_signal(), 1, 'one_for_all')
+        tm.setup(group)
+        self.assertTrue(self.wait(lambda: tm.supervisor().restarts('group') == 1))
+        self.assertEqual(group.map([lambda: 1] * 10, timeout=5), [1] * 10)
+        self.assertTrue(self.wait(lambda: group.workers() == 2))
+        self.assertTrue(tm.stop())
+
+    def test_no_backoff(self):
+        tm = TaskManager({'supervisor': {'backoff': 0, 'max_restarts': 10}})
+        task = Crashy('crashy', tm.get_signal(), 2)
+        group = CrashyGroup('group', tm.get_signal(), 2, 'one_for_one')
+        tm.setup(task)
+        tm.setup(group)
+        self.assertTrue(self.wait(lambda: task.runs == 3))
+        self.assertTrue(self.wait(lambda: group.workers() == 2 and not group.crashes))
+        time.sleep(0.05)
+        self.assertEqual(group.workers(), 2)
+        self.assertEqual(group.map([lambda: 1] * 4, timeout=5), [1] * 4)
+        self.assertTrue(tm.stop())
+
+    def test_escalate(self):
+        received = []
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: received.append(signum))
+        try:
+            tm = TaskManager({'supervisor': {'max_restarts': 1, 'backoff': 0.01}})
+            task = Crashy('crashy', tm.get_signal(), 10)
+            tm.setup(task)
+            self.assertTrue(self.wait(lambda: received))
+            tm.stop()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        self.assertEqual(received, [signal.SIGTERM])
+        self.assertEqual(task.runs, 2)
+
+class Counter(Task):
+
+    def __init__(self, name, sig):
+        Task.__init__(self, name, sig)
+        self.count = 0
+
+    def work(self):
+        self.count += 1
+        self._idle(0.001)
+
+class TestTargeted(unittest.TestCase):
+
+    def setUp(self):
+        self.tm = TaskManager()
+
+    def tearDown(self):
+        self.tm.stop()
+
+    def test_suspend(self):
+        migrate = Counter('migrate', self.tm.get_signal())
+        other = Counter('other', self.tm.get_signal())
+        self.tm.setup(migrate, tags=['db'])
+        self.tm.setup(other)
+        self.assertTrue(self.tm.drain('db', 5))
+        self.assertTrue(self.tm.suspended('migrate'))
+        count = migrate.count
+        before = other.count
+        time.sleep(0.05)
+        self.assertEqual(migrate.count, count)
+        self.assertTrue(other.count > before)
+        self.tm.resume('migrate')
+        time.sleep(0.05)
+        self.assertTrue(migrate.count > count)
+        self.assertRaises(ValueError, self.tm.suspend, 'unknown')
+
+    def test_stop_suspended(self):
+        task = Counter('task', self.tm.get_signal())
+        self.tm.setup(task)
+        self.tm.suspend('task')
+        self.assertTrue(self.tm.stop(2))
+
+    def test_tags(self):
+        task = Counter('task', self.tm.get_signal())
+        self.tm.setup(task, tags='db')
+        self.assertEqual(self.tm.tags('task'), set(['db']))
+
+    def test_layered(self):
+        task = Counter('task', self.tm.get_signal())
+        self.tm.setup(task)
+        self.tm.suspend('task')
+        self.tm.resume()
+        self.assertTrue(self.tm.suspended('task'))
+        self.tm.resume('task')
+        self.assertFalse(self.tm.suspended('task'))
+
+    def test_drain_group(self):
+        group = TaskGroup('group', self.tm.get_signal(), workers=2)
+        self.tm.setup(group, tags=['db'])
+        futures = group.submit_batch([lambda: time.sleep(0.01)] * 10)
+        self.assertTrue(self.tm.drain('db', 5))
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertTrue(group.suspended())
+        future = group.submit(lambda: 1)
+        time.sleep(0.05)
+        self.assertFalse(future.done())
+        self.tm.resume('db')
+        self.assertEqual(future.result(5), 1)
+
+if __name__ == '__main__':
+    unittest.main()
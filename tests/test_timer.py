@@ -0,0 +1,83 @@
+import unittest
+import threading
+import time
+
+from kpapp.timer import Timer
+from kpapp.task import Signal
+
+class TestTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = Timer()
+
+    def tearDown(self):
+        self.timer.stop()
+
+    def test_sleep(self):
+        start = time.time()
+        self.assertTrue(self.timer.sleep(start + 0.05))
+        elapsed = time.time() - start
+        self.assertTrue(elapsed >= 0.05)
+        self.assertTrue(elapsed < 0.5)
+
+    def test_order(self):
+        now = time.time()
+        late = self.timer.schedule(now + 0.2)
+        early = self.timer.schedule(now + 0.02)
+        early.wait(1)
+        self.assertTrue(early.is_set())
+        self.assertFalse(late.is_set())
+        late.wait(1)
+        self.assertTrue(late.is_set())
+
+    def test_past_deadline(self):
+        self.assertTrue(self.timer.schedule(time.time() - 1).is_set())
+        self.assertEqual(self.timer.pending(), 0)
+
+    def test_interrupt(self):
+        event = self.timer.schedule(time.time() + 60)
+        self.assertEqual(self.timer.pending(), 1)
+        self.timer.interrupt()
+        self.assertTrue(event.is_set())
+        self.assertEqual(self.timer.pending(), 0)
+
+    def test_stop(self):
+        event = self.timer.schedule(time.time() + 60)
+        self.timer.stop()
+        self.assertTrue(event.is_set())
+        self.assertTrue(self.timer.schedule(time.time() + 60).is_set())
+
+class TestSignalSleep(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = Timer()
+        self.halt = threading.Event()
+        self.run = threading.Event()
+        self.run.set()
+        self.sig = Signal(halt=self.halt, run=self.run, timer=self.timer)
+
+    def tearDown(self):
+        self.timer.stop()
+
+    def test_deadline(self):
+        self.assertTrue(self.sig.sleep(time.time() + 0.01))
+
+    def test_halted(self):
+        self.halt.set()
+        self.assertFalse(self.sig.sleep(time.time() + 60))
+
+    def test_halt_interrupts(self):
+        def halt():
+            self.halt.set()
+            self.timer.interrupt()
+        threading.Timer(0.05, halt).start()
+        start = time.time()
+        self.assertFalse(self.sig.sleep(start + 60))
+        self.assertTrue(time.time() - start < 5)
+
+    def test_without_timer(self):
+        sig = Signal(halt=self.halt, run=self.run)
+        self.assertTrue(sig.sleep(time.time() + 0.01))
+
+if __name__ == '__main__':
+    unittest.main()